@@ -0,0 +1,264 @@
+"""
+binpkg.py
+---------
+Binary packages for a fleet of installs: build once, install many.
+
+GENTOO_HELPER_BINPKGS names the package source – a directory on the host
+(a partition of the live medium, a NAS mount) or the http(s) URL of a
+binhost, e.g. ``python3 -m http.server`` run in such a directory.
+
+* "use": binary packages are taken from the source.  A URL is configured
+  in /etc/portage/binrepos.conf with FEATURES="getbinpkg", a directory is
+  bind-mounted as the target's PKGDIR and used with --usepkg.
+* "build": as "use", and every package built from source is also packed
+  (FEATURES="buildpkg").  With a directory source the new packages land
+  right in it, so the next machine installs them as binaries.
+
+Portage chooses binary or source per package: a binary is only used when
+its USE flags, CHOST and dependencies match (--binpkg-respect-use,
+--binpkg-changed-deps).  The builder records how long every source build
+took (TIMES_FILE next to the packages); report() uses those times and the
+target's emerge.log to tell how much compilation the binaries avoided.
+
+Accelerated install: the official Gentoo binhost matching the CPU's
+x86-64 level (hw_tuning.isa_level) is added for ACCELERATED_PACKAGES
+only (--usepkg-include).  Those packages are built with generic
+-march=x86-64[-v3] CFLAGS; everything else is still compiled with the
+wizard's -march.  Packages are verified with the Gentoo keys (getuto).
+GENTOO_HELPER_OFFICIAL_BINHOST replaces the official host – a mirror URL
+or a local directory stand-in, bind-mounted as PKGDIR like above.
+The include filter would also limit the fleet's packages, so the
+accelerated install is only offered while the fleet mode is "off".
+"""
+
+# ——— Standard library ———
+import json
+import os
+import re
+import subprocess
+
+# ——— Local modules ———
+from http_transport import UrllibTransport
+from hw_tuning import HEAVY_PACKAGES
+from step_graph import append_block
+
+BINPKGS_ENV = "GENTOO_HELPER_BINPKGS"
+PKGDIR = "/var/cache/binpkgs"           # inside the target
+REPO_NAME = "gentoo-helper"
+TIMES_FILE = "gentoo-helper-build-times.json"
+EMERGE_LOG = "/var/log/emerge.log"
+MODES = ("off", "use", "build")
+
+OFFICIAL_ENV = "GENTOO_HELPER_OFFICIAL_BINHOST"
+OFFICIAL_URL = "https://distfiles.gentoo.org/releases/amd64/binpackages/23.0/{level}"
+OFFICIAL_REPO = "gentoo-official"
+# długie kompilacje, dla których -march nie daje odczuwalnej różnicy
+ACCELERATED_PACKAGES = HEAVY_PACKAGES + (
+    "dev-qt/qtbase",
+    "dev-qt/qtdeclarative",
+    "dev-lang/go",
+    "dev-lang/python",
+    "media-video/ffmpeg",
+)
+
+START_RE = re.compile(r"^(\d+):\s+>>> emerge \(\d+ of \d+\) (\S+) to /")
+BINARY_RE = re.compile(r"^\d+:\s+=== \(\d+ of \d+\) Merging Binary \(([^:)]+)")
+DONE_RE = re.compile(r"^(\d+):\s+::: completed emerge \(\d+ of \d+\) (\S+) to /")
+VERSION_RE = re.compile(r"-\d[\w.]*(?:-r\d+)?$")
+
+
+def source():
+    """Configured package source (directory or URL), or None."""
+    return os.environ.get(BINPKGS_ENV, "").strip() or None
+
+
+def is_url(src):
+    return src.startswith(("http://", "https://", "ftp://"))
+
+
+def package_name(cpv):
+    """sys-apps/foo-1.2.3-r1 → sys-apps/foo"""
+    return VERSION_RE.sub("", cpv)
+
+
+def official_source(level):
+    """Binhost for the accelerated install: the override, or the official one."""
+    return os.environ.get(OFFICIAL_ENV, "").strip() or OFFICIAL_URL.format(level=level)
+
+
+def binrepos_conf(url, name=REPO_NAME, priority=10, verify=False):
+    """Contents of /etc/portage/binrepos.conf/<name>.conf."""
+    return "\n".join([
+        f"[{name}]",
+        f"priority = {priority}",
+        f"sync-uri = {url}",
+        f"verify-signature = {str(verify).lower()}",
+    ])
+
+
+def make_conf(mode, src):
+    """Lines appended to make.conf for *mode* ("" when there is nothing to do)."""
+    features, opts = [], []
+    if mode in ("use", "build") and src:
+        opts += ["--binpkg-respect-use=y", "--binpkg-changed-deps=y"]
+        if is_url(src):
+            features.append("getbinpkg")
+        else:
+            opts.append("--usepkg")
+            # lokalne pakiety nie są podpisane (binhost: verify-signature)
+            features.append("-binpkg-request-signature")
+    if mode == "build":
+        features.append("buildpkg")
+    lines = []
+    if features:
+        lines.append(f'FEATURES="${{FEATURES}} {" ".join(features)}"')
+    if opts:
+        lines.append(f'EMERGE_DEFAULT_OPTS="${{EMERGE_DEFAULT_OPTS}} {" ".join(opts)}"')
+    if lines:
+        lines.append(f'PKGDIR="{PKGDIR}"')
+    return "\n".join(lines)
+
+
+def setup_command(mode, src):
+    """Shell command configuring the target for *mode* ("" = nothing to do)."""
+    conf = make_conf(mode, src)
+    if not conf:
+        return ""
+    cmd = ""
+    if src and is_url(src):
+        cmd += (f"mkdir -p /etc/portage/binrepos.conf && "
+                f"cat <<'EOF' >/etc/portage/binrepos.conf/{REPO_NAME}.conf &&\n"
+                f"{binrepos_conf(src)}\nEOF\n")
+    return cmd + f"mkdir -p {PKGDIR} && " + append_block(
+        "/etc/portage/make.conf", conf, "binpkg")
+
+
+def accelerated_command(src):
+    """
+    Shell command adding the binhost *src* for the accelerated install;
+    binaries are used for ACCELERATED_PACKAGES only.
+    """
+    opts = [
+        "--binpkg-respect-use=y",
+        f"--usepkg-include='{' '.join(ACCELERATED_PACKAGES)}'",
+    ]
+    cmd = ""
+    if is_url(src):
+        # pakiety z oficjalnego binhosta są podpisane kluczami Gentoo
+        verify = not os.environ.get(OFFICIAL_ENV, "").strip()
+        if verify:
+            cmd += ("{ command -v getuto >/dev/null || "
+                    "emerge --oneshot --noreplace app-portage/getuto; } && getuto && ")
+        cmd += (f"mkdir -p /etc/portage/binrepos.conf && "
+                f"cat <<'EOF' >/etc/portage/binrepos.conf/{OFFICIAL_REPO}.conf &&\n"
+                f"{binrepos_conf(src, OFFICIAL_REPO, 1, verify)}\nEOF\n")
+        features = "getbinpkg"
+    else:
+        opts.append("--usepkg")
+        features = "-binpkg-request-signature"
+    return cmd + f"mkdir -p {PKGDIR} && " + append_block(
+        "/etc/portage/make.conf",
+        f'FEATURES="${{FEATURES}} {features}"\n'
+        f'EMERGE_DEFAULT_OPTS="${{EMERGE_DEFAULT_OPTS}} {" ".join(opts)}"\n'
+        f'PKGDIR="{PKGDIR}"',
+        "accelerated")
+
+
+def bind(target_root, src):
+    """Bind-mount a directory source over the target's PKGDIR."""
+    dest = os.path.join(target_root, PKGDIR.lstrip("/"))
+    os.makedirs(src, exist_ok=True)
+    os.makedirs(dest, exist_ok=True)
+    subprocess.run(["mount", "--bind", src, dest], check=True)
+    return dest
+
+
+def unbind(dest):
+    subprocess.run(["umount", dest], check=False)
+
+
+def read_merges(path, since=0):
+    """
+    Merges logged in emerge.log after *since* (unix time):
+    list of (cpv, binary, seconds).
+    """
+    started, binary, merges = {}, set(), []
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                m = START_RE.match(line)
+                if m:
+                    if int(m.group(1)) >= since:
+                        started[m.group(2)] = int(m.group(1))
+                    continue
+                m = BINARY_RE.match(line)
+                if m:
+                    binary.add(m.group(1))
+                    continue
+                m = DONE_RE.match(line)
+                if m and m.group(2) in started:
+                    cpv = m.group(2)
+                    merges.append((cpv, cpv in binary, int(m.group(1)) - started.pop(cpv)))
+                    binary.discard(cpv)
+    except OSError:
+        pass
+    return merges
+
+
+def load_times(src):
+    """Build times recorded by the builder: {cpv or cat/pn: seconds}."""
+    try:
+        if is_url(src):
+            url = src.rstrip("/") + "/" + TIMES_FILE
+            with UrllibTransport(timeout=15).open(url) as resp:
+                return json.loads(resp.read().decode("utf-8"))
+        with open(os.path.join(src, TIMES_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_times(pkgdir, merges):
+    """Merge the source builds of this run into <pkgdir>/TIMES_FILE."""
+    path = os.path.join(pkgdir, TIMES_FILE)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            times = json.load(f)
+    except (OSError, ValueError):
+        times = {}
+    for cpv, was_binary, seconds in merges:
+        if not was_binary:
+            times[cpv] = seconds
+            times[package_name(cpv)] = seconds
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(times, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def report(merges, times):
+    """Return (binary merges, all merges, seconds of compilation avoided)."""
+    binaries = [cpv for cpv, was_binary, _ in merges if was_binary]
+    avoided = sum(times.get(cpv, times.get(package_name(cpv), 0)) for cpv in binaries)
+    return len(binaries), len(merges), avoided
+
+
+def main(argv=None):
+    """Summarise an emerge.log: binary vs source merges, avoided build time."""
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Binary package report for an emerge.log")
+    ap.add_argument("log", nargs="?", default=EMERGE_LOG)
+    ap.add_argument("--source", default=source(), help="binpkg directory or URL (build times)")
+    ap.add_argument("--since", type=int, default=0, help="only merges after this unix time")
+    args = ap.parse_args(argv)
+
+    merges = read_merges(args.log, args.since)
+    times = load_times(args.source) if args.source else {}
+    binaries, total, avoided = report(merges, times)
+    print(f"{binaries} of {total} packages from binaries, "
+          f"~{avoided // 3600} h {avoided % 3600 // 60} min of compilation avoided")
+
+
+if __name__ == "__main__":
+    main()
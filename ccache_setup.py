@@ -0,0 +1,107 @@
+"""
+ccache_setup.py
+---------------
+Compiler cache for the package builds of an installation.
+
+With the option enabled, dev-util/ccache is emerged right after make.conf
+is written and FEATURES="ccache" is switched on with CCACHE_DIR below.
+When GENTOO_HELPER_CCACHE points at a directory on the host (a
+persistent partition of the live medium, a NAS mount…), that directory
+is bind-mounted over the target's CCACHE_DIR for the whole installation,
+so the next install of the same profile starts with a warm cache.
+
+The size comes from GENTOO_HELPER_CCACHE_GB, otherwise half of the free
+space of the cache's filesystem, between MIN_GB and DEFAULT_MAX_GB.
+Statistics are zeroed when the cache is set up; stats() reads the hits
+and misses of this installation at the end.
+"""
+
+# ——— Standard library ———
+import os
+import re
+import shutil
+import subprocess
+
+CACHE_ENV = "GENTOO_HELPER_CCACHE"
+SIZE_ENV = "GENTOO_HELPER_CCACHE_GB"
+CCACHE_DIR = "/var/cache/ccache"        # inside the target
+DEFAULT_MAX_GB = 30
+MIN_GB = 2
+
+# ccache 3.x: "cache hit (direct)   12" – 4.x uses --print-stats instead
+LEGACY_RE = re.compile(r"^cache (hit \((?:direct|preprocessed)\)|miss)\s+(\d+)", re.M)
+
+
+def host_dir():
+    """Persistent cache directory on the host, or None."""
+    return os.environ.get(CACHE_ENV, "").strip() or None
+
+
+def max_size_gb(path):
+    try:
+        return max(MIN_GB, int(float(os.environ[SIZE_ENV])))
+    except (KeyError, ValueError):
+        pass
+    try:
+        free = shutil.disk_usage(path).free
+    except OSError:
+        return MIN_GB
+    return max(MIN_GB, min(DEFAULT_MAX_GB, free // 2 // 1024 ** 3))
+
+
+def config(size_gb):
+    """Contents of $CCACHE_DIR/ccache.conf (shared by the portage user)."""
+    return "\n".join([
+        f"max_size = {size_gb}G",
+        "umask = 002",
+        "hash_dir = false",
+        "compiler_check = %compiler% -dumpversion",
+        "cache_dir_levels = 3",
+    ])
+
+
+def bind(target_root, source):
+    """Bind-mount *source* over CCACHE_DIR of the target system."""
+    dest = os.path.join(target_root, CCACHE_DIR.lstrip("/"))
+    os.makedirs(source, exist_ok=True)
+    os.makedirs(dest, exist_ok=True)
+    subprocess.run(["mount", "--bind", source, dest], check=True)
+    return dest
+
+
+def unbind(dest):
+    subprocess.run(["umount", dest], check=False)
+
+
+def parse_stats(text):
+    """Return (hits, misses) from ``ccache --print-stats`` (or 3.x ``-s``)."""
+    values = {}
+    for line in text.splitlines():
+        key, _, value = line.partition("\t")
+        if value.strip().isdigit():
+            values[key.strip()] = int(value)
+    if values:
+        hits = values.get("direct_cache_hit", 0) + values.get("preprocessed_cache_hit", 0)
+        return hits, values.get("cache_miss", 0)
+    hits = misses = 0
+    for kind, count in LEGACY_RE.findall(text):
+        if kind == "miss":
+            misses += int(count)
+        else:
+            hits += int(count)
+    return hits, misses
+
+
+def stats(target_root="/mnt/gentoo"):
+    """(hits, misses) since the cache was set up, or None if unavailable."""
+    for args in (["ccache", "--print-stats"], ["ccache", "-s"]):
+        try:
+            out = subprocess.run(
+                ["chroot", target_root, "env", f"CCACHE_DIR={CCACHE_DIR}", *args],
+                capture_output=True, text=True, timeout=60,
+            )
+        except (OSError, subprocess.SubprocessError):
+            return None
+        if out.returncode == 0:
+            return parse_stats(out.stdout)
+    return None
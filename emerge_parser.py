@@ -0,0 +1,256 @@
+"""
+emerge_parser.py
+----------------
+Single-pass parser for emerge output.
+
+Every line of a long emerge run passes through parse_line(), so the hot
+path is kept cheap: lines without a ">>>", "[" or "Copying" (the vast
+majority of compiler output) are rejected by plain substring tests, and
+the rest is matched by ONE precompiled alternation regex that yields a
+typed event.  EmergeTracker folds those events into the state of the
+whole run (package n of m, phase, build counter, overall fraction); the
+wizard's step runner and the package manager in prog/ both use it.
+
+Events:
+
+* EmergeStart(index, total, package, action)
+                                      – ">>> Emerging (3 of 57) cat/pkg-1.0"
+                                      – ">>> Unmerging (1 of 2) cat/pkg-1.0..."
+                                      – ">>> Emerging binary (4 of 57) cat/pkg-1.0"
+* Phase(name)                         – ">>> Unpacking …", "Copying …"
+* SubstepProgress(done, total)        – ninja "[12/345]" / cmake "[ 40%]"
+* Completed(index, total, package)    – ">>> Completed (3 of 57) cat/pkg-1.0"
+
+Run as a script to benchmark the parser on a recorded emerge log:
+
+    python3 emerge_parser.py /var/log/emerge-build.log
+"""
+
+# ——— Standard library ———
+import re
+from collections import deque, namedtuple
+
+ANSI_RE = re.compile(r"\x1B\[[0-?]*[ -/]*[@-~]")
+
+EVENT_RE = re.compile(
+    r">>> (?:"
+    r"(?P<start>Emerging|Installing|Unmerging|Completed)(?: binary)? \(\s*(?P<index>\d+)\s+of\s+(?P<total>\d+)\s*\)\s+(?P<pkg>\S+)"
+    r"|(?P<phase>Unpacking|Compiling|Testing|Installing|Running postinst|Completed|Emerging)"
+    r")"
+    r"|\[\s*(?P<done>\d+)\s*(?:/|of)\s*(?P<count>\d+)\s*\]\s"
+    r"|\[\s*(?P<pct>\d{1,3})\s*%\]\s"
+    r"|(?P<copy>Copying)"
+)
+
+# GUI text for every phase name
+PHASE_TEXT = {
+    "Emerging": "Emerging...",
+    "Unpacking": "Unpacking...",
+    "Compiling": "Compiling...",
+    "Testing": "Testing...",
+    "Installing": "Installing...",
+    "Running postinst": "Running postinst...",
+    "Unmerging": "Unmerging...",
+    "Copying": "Copying...",
+    "Completed": "Completed!",
+}
+
+
+class EmergeStart(namedtuple("EmergeStart", "index total package action")):
+    """Package *index* of *total* starts ("Emerging"/"Installing"/"Unmerging")."""
+
+    @property
+    def fraction(self):
+        return self.index / self.total if self.total else 0.0
+
+
+Phase = namedtuple("Phase", "name")
+Completed = namedtuple("Completed", "index total package")
+
+
+class SubstepProgress(namedtuple("SubstepProgress", "done total")):
+    """Build-system counter of the current package; total 100 for percents."""
+
+    @property
+    def fraction(self):
+        return min(self.done / self.total, 1.0) if self.total else 0.0
+
+
+def strip_ansi(line):
+    """Remove colour/cursor escape sequences (only scans when present)."""
+    return ANSI_RE.sub("", line) if "\x1b" in line else line
+
+
+def parse_line(line):
+    """Return the event described by one line of emerge output, or None."""
+    if ">>>" not in line and "[" not in line and "Copying" not in line:
+        return None
+    m = EVENT_RE.search(strip_ansi(line))
+    if m is None:
+        return None
+
+    start = m.group("start")
+    if start:
+        index, total = int(m.group("index")), int(m.group("total"))
+        package = m.group("pkg").split("::")[0].rstrip(".")
+        if start == "Completed":
+            return Completed(index, total, package)
+        return EmergeStart(index, total, package, start)
+
+    phase = m.group("phase")
+    if phase:
+        return Completed(None, None, None) if phase == "Completed" else Phase(phase)
+
+    if m.group("done"):
+        total = int(m.group("count"))
+        return SubstepProgress(int(m.group("done")), total) if total else None
+
+    if m.group("pct"):
+        return SubstepProgress(int(m.group("pct")), 100)
+
+    return Phase("Copying")
+
+
+# share of one package's slot in the overall bar once a phase is reached
+PHASE_WEIGHT = {
+    "Unpacking": 0.2,
+    "Compiling": 0.4,
+    "Testing": 0.6,
+    "Installing": 0.8,
+    "Running postinst": 1.0,
+    "Completed": 1.0,
+}
+
+
+class EmergeTracker:
+    """
+    Incremental state of one emerge run.  feed() every output line (O(1)
+    per line) and read index/total/package, the current phase, the last
+    build counter of that phase (substep) and the overall fraction.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.index = self.total = 0
+        self.package = self.action = self.phase = self.substep = None
+
+    def feed(self, line):
+        """Update the state from *line*; return its event (or None)."""
+        event = parse_line(line)
+        if event is None:
+            return None
+        if isinstance(event, EmergeStart):
+            self.index, self.total, self.package, self.action = event
+            self.phase = "Installing" if event.action == "Installing" else None
+            self.substep = None
+        elif isinstance(event, SubstepProgress):
+            self.substep = event
+        elif isinstance(event, Completed):
+            self.phase, self.substep = "Completed", None
+        else:
+            self.phase, self.substep = event.name, None
+        return event
+
+    def feed_lines(self, lines):
+        """feed() a batch of lines; return the events found in it."""
+        feed = self.feed
+        return [e for e in map(feed, lines) if e is not None]
+
+    @property
+    def fraction(self):
+        """Overall progress: finished packages plus the current one's phase."""
+        if not self.total:
+            return 0.0
+        done = self.index - 1 + PHASE_WEIGHT.get(self.phase, 0.0)
+        return min(max(done / self.total, 0.0), 1.0)
+
+    @property
+    def phase_text(self):
+        return PHASE_TEXT.get(self.phase or self.action, "")
+
+
+# failure signatures; the substrings are the cheap pre-filter
+FAILURE_HINTS = ("autounmask-write", "necessary to proceed", "build.log")
+FAILURE_RE = re.compile(
+    r"(?P<autounmask>perhaps you need --autounmask-write|use changes are necessary to proceed)"
+    r"|(?P<build_log>/var/tmp/portage/\S+/temp/build\.log)",
+    re.IGNORECASE,
+)
+TAIL_BYTES = 64 * 1024
+
+
+class FailureWatch:
+    """
+    Streaming check of emerge output for what the error handling needs:
+    autounmask / USE-change hints and the path of the failed build.log.
+    Only the last *tail_bytes* of output are kept (for the error dialog),
+    so memory stays flat however long the run is.
+    """
+
+    def __init__(self, tail_bytes=TAIL_BYTES):
+        self.tail_bytes = tail_bytes
+        self.reset()
+
+    def reset(self):
+        self.autounmask = False
+        self.build_log = None
+        self._tail = deque()
+        self._tail_size = 0
+
+    def feed(self, line):
+        self._tail.append(line)
+        self._tail_size += len(line) + 1
+        while self._tail_size > self.tail_bytes and len(self._tail) > 1:
+            self._tail_size -= len(self._tail.popleft()) + 1
+
+        if not any(hint in line for hint in FAILURE_HINTS):
+            return
+        for m in FAILURE_RE.finditer(line):
+            if m.group("autounmask"):
+                self.autounmask = True
+            else:
+                self.build_log = m.group("build_log")      # the last one wins
+
+    def tail(self, lines=None):
+        """The kept output (or only its last *lines* lines) as text."""
+        kept = list(self._tail)
+        return "\n".join(kept[-lines:] if lines else kept)
+
+
+def main(argv=None):
+    """Command-line micro-benchmark: parse a log and print the throughput."""
+    import argparse
+    import time
+    from collections import Counter
+
+    ap = argparse.ArgumentParser(description="Benchmark the emerge output parser")
+    ap.add_argument("log", help="recorded emerge output (e.g. from script(1))")
+    ap.add_argument("--repeat", type=int, default=3, help="take the best of N runs")
+    args = ap.parse_args(argv)
+
+    with open(args.log, "r", encoding="utf-8", errors="replace") as f:
+        lines = f.readlines()
+    size = sum(len(line) for line in lines)
+
+    best = None
+    for _ in range(args.repeat):
+        counts = Counter()
+        tracker = EmergeTracker()
+        started = time.perf_counter()
+        for line in lines:
+            event = tracker.feed(line)
+            if event is not None:
+                counts[type(event).__name__] += 1
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    print(f"{len(lines)} lines, {size / 1e6:.1f} MB in {best:.3f} s: "
+          f"{len(lines) / best / 1e6:.2f} M lines/s, {size / best / 1e6:.1f} MB/s")
+    for name, n in sorted(counts.items()):
+        print(f"  {name:16} {n}")
+
+
+if __name__ == "__main__":
+    main()
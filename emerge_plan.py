@@ -0,0 +1,28 @@
+"""
+emerge_plan.py
+--------------
+Planning of the emerge transactions of an installation.
+
+Every emerge process pays for a full dependency calculation – minutes
+with overlays enabled.  merge() combines package sets that can be
+resolved together into one argument list (options united, atoms
+deduplicated in order), so e.g. the @world update and the selected
+programs become a single transaction, in which emerge --jobs (see
+hw_tuning.py) overlaps independent builds.  Options must use the
+--opt=value form.
+"""
+
+
+def merge(*package_sets):
+    """
+    Merge emerge argument strings into one transaction:
+    merge("--update --deep @world", "app-misc/foo") →
+    "--update --deep @world app-misc/foo".
+    """
+    options, atoms = [], []
+    for package_set in package_sets:
+        for token in package_set.split():
+            bucket = options if token.startswith("-") else atoms
+            if token not in bucket:
+                bucket.append(token)
+    return " ".join(options + atoms)
@@ -0,0 +1,166 @@
+"""
+http_transport.py
+-----------------
+Pluggable HTTP transports used by the Stage3 fetch layer.
+
+A transport has one method, ``open(url, headers=None)``, returning a
+response usable as a context manager with ``status``, ``getheader()``
+and ``read(n)``.  KeepAliveTransport keeps idle connections per host, so
+the manifest, DIGESTS and all Range segments of one Stage3 download share
+a few warm (TLS) connections instead of a cold handshake per request.
+UrllibTransport is the plain urllib fallback (proxies from the
+environment, one connection per request); default_transport() picks it
+whenever a proxy is configured, since the pool connects directly.
+"""
+
+# ——— Standard library ———
+import http.client
+import ssl
+import threading
+import urllib.request
+from urllib.parse import urljoin, urlsplit
+
+DEFAULT_TIMEOUT = 30
+MAX_REDIRECTS = 5
+DRAIN_LIMIT = 64 * 1024     # leftover body read to keep a connection reusable
+
+
+class UrllibTransport:
+    """One urllib request per open(); honours *_proxy environment variables."""
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT):
+        self.timeout = timeout
+
+    def open(self, url, headers=None):
+        req = urllib.request.Request(url, headers=headers or {})
+        return urllib.request.urlopen(req, timeout=self.timeout)
+
+    def close(self):
+        pass
+
+
+def default_transport(timeout=DEFAULT_TIMEOUT):
+    """KeepAliveTransport, or UrllibTransport when *_proxy is set."""
+    if urllib.request.getproxies():
+        return UrllibTransport(timeout)
+    return KeepAliveTransport(timeout)
+
+
+class _PooledResponse:
+    """http.client response that hands its connection back to the pool."""
+
+    def __init__(self, transport, key, conn, resp):
+        self._transport = transport
+        self._key = key
+        self._conn = conn
+        self._resp = resp
+        self.status = resp.status
+
+    def getheader(self, name, default=None):
+        return self._resp.getheader(name, default)
+
+    def read(self, amt=None):
+        return self._resp.read(amt)
+
+    def close(self):
+        if self._conn is None:
+            return
+        resp, conn, self._conn = self._resp, self._conn, None
+        reusable = not resp.will_close
+        if reusable and not resp.isclosed():
+            # small remainder (e.g. the 1-byte probe) – drain it and reuse
+            if resp.length is not None and resp.length <= DRAIN_LIMIT:
+                try:
+                    resp.read()
+                except (OSError, http.client.HTTPException):
+                    reusable = False
+            else:
+                reusable = False
+        if reusable:
+            self._transport._release(self._key, conn)
+        else:
+            resp.close()
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        self.close()
+
+
+class KeepAliveTransport:
+    """
+    Thread-safe pool of persistent HTTP/HTTPS connections, keyed by
+    (scheme, host, port).  Follows redirects; a pooled connection the
+    server already closed is transparently replaced once.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT):
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._ssl = ssl.create_default_context()
+
+    def open(self, url, headers=None):
+        headers = dict(headers or {})
+        for _ in range(MAX_REDIRECTS + 1):
+            resp = self._request(url, headers)
+            location = resp.getheader("Location")
+            if resp.status in (301, 302, 303, 307, 308) and location:
+                resp.close()
+                url = urljoin(url, location)
+                continue
+            if resp.status >= 400:
+                resp.close()
+                raise http.client.HTTPException(f"HTTP {resp.status} for {url}")
+            return resp
+        raise http.client.HTTPException(f"Too many redirects for {url}")
+
+    def close(self):
+        with self._lock:
+            conns = [c for pool in self._idle.values() for c in pool]
+            self._idle.clear()
+        for conn in conns:
+            conn.close()
+
+    # ------------------------------------------------------------------
+    def _request(self, url, headers):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        conn, reused = self._acquire(key)
+        try:
+            conn.request("GET", path, headers=headers)
+            resp = conn.getresponse()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            if not reused:
+                raise
+            # idle keep-alive connection timed out on the server – retry fresh
+            conn = self._new_connection(key)
+            conn.request("GET", path, headers=headers)
+            resp = conn.getresponse()
+        return _PooledResponse(self, key, conn, resp)
+
+    def _acquire(self, key):
+        with self._lock:
+            pool = self._idle.get(key)
+            if pool:
+                return pool.pop(), True
+        return self._new_connection(key), False
+
+    def _release(self, key, conn):
+        with self._lock:
+            self._idle.setdefault(key, []).append(conn)
+
+    def _new_connection(self, key):
+        scheme, host, port = key
+        if scheme == "https":
+            return http.client.HTTPSConnection(
+                host, port, timeout=self.timeout, context=self._ssl
+            )
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
@@ -0,0 +1,348 @@
+"""
+hw_tuning.py
+------------
+Build settings derived from the hardware the installation runs on.
+
+detect() reads /proc/cpuinfo, /proc/meminfo and the cgroup limits of
+this process (a container or a systemd slice may grant fewer CPUs or
+less memory than the machine has), resolves what -march=native means
+through ``gcc -march=native -Q --help=target``, and returns a
+BuildProfile:
+
+* make jobs – one per CPU, but at most one per MEM_PER_JOB of memory,
+  so that a many-core machine with little RAM does not swap or OOM;
+* emerge --jobs / --load-average – parallel packages only when there is
+  memory for them, the load limit keeps the CPU from oversubscription;
+* heavy jobs – MAKEOPTS for HEAVY_PACKAGES (chromium, firefox, llvm…),
+  written to package.env, where one compile job needs several GiB;
+* tmpfs – how large a RAM-backed PORTAGE_TMPDIR may be (half of the
+  memory, 0 below TMPFS_MIN); packages whose build directory is known to
+  be larger (TMPDIR_NEEDS) are sent back to disk through package.env.
+  A full tmpfs holds its memory, so all job counts above are sized from
+  the memory left next to it (without_tmpfs() when it is not used);
+* level – x86-64 micro-architecture level of the CPU (x86-64-v3 or plain
+  x86-64), which selects the matching official binary package host.
+
+Run as a script to print the profile of the current machine.
+"""
+
+# ——— Standard library ———
+import math
+import os
+import re
+import subprocess
+from collections import namedtuple
+
+GIB = 1024 ** 3
+MEM_PER_JOB = 2 * GIB           # typowy kompilator C/C++
+HEAVY_MEM_PER_JOB = 4 * GIB     # duże projekty C++ / LTO
+MEM_PER_EMERGE_JOB = 4 * GIB
+MAX_EMERGE_JOBS = 4
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+HEAVY_PACKAGES = (
+    "www-client/chromium",
+    "www-client/firefox",
+    "mail-client/thunderbird",
+    "net-libs/webkit-gtk",
+    "dev-qt/qtwebengine",
+    "llvm-core/llvm",
+    "llvm-core/clang",
+    "sys-devel/llvm",
+    "sys-devel/clang",
+    "sys-devel/gcc",
+    "dev-lang/rust",
+    "net-libs/nodejs",
+    "app-office/libreoffice",
+)
+HEAVY_ENV = "gentoo-helper-heavy.conf"      # /etc/portage/env/<HEAVY_ENV>
+
+TMPFS_MIN = 4 * GIB
+# przybliżony rozmiar katalogu budowania (GiB) – te pakiety mogą nie
+# zmieścić się w tmpfs; pozostałe mieszczą się w TMPFS_MIN
+TMPDIR_NEEDS = {
+    "www-client/chromium": 20,
+    "dev-lang/rust": 14,
+    "dev-qt/qtwebengine": 10,
+    "app-office/libreoffice": 10,
+    "www-client/firefox": 9,
+    "mail-client/thunderbird": 9,
+    "net-libs/webkit-gtk": 7,
+    "llvm-core/clang": 6,
+    "sys-devel/clang": 6,
+    "llvm-core/llvm": 5,
+    "sys-devel/llvm": 5,
+    "sys-devel/gcc": 4,
+}
+NOTMPFS_ENV = "gentoo-helper-notmpfs.conf"  # /etc/portage/env/<NOTMPFS_ENV>
+NOTMPFS_DIR = "/var/tmp/notmpfs"
+
+# flagi /proc/cpuinfo wymagane przez x86-64-v3 (v2 zawiera się w v3)
+X86_64_V3_FLAGS = {
+    "cx16", "lahf_lm", "popcnt", "sse4_1", "sse4_2", "ssse3",
+    "avx", "avx2", "bmi1", "bmi2", "f16c", "fma", "abm", "movbe", "xsave",
+}
+
+MARCH_RE = re.compile(r"^\s*-march=\s*(\S+)", re.M)
+MTUNE_RE = re.compile(r"^\s*-mtune=\s*(\S+)", re.M)
+
+
+CpuInfo = namedtuple("CpuInfo", "model logical physical flags")
+
+
+def _read(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def read_cpuinfo(path="/proc/cpuinfo"):
+    """Model name, logical CPUs, physical cores and flags from /proc/cpuinfo."""
+    model, logical, cores, flags = "", 0, set(), frozenset()
+    phys = core = None
+    for line in (_read(path) or "").splitlines() + [""]:
+        key, _, value = line.partition(":")
+        key, value = key.strip(), value.strip()
+        if key == "processor":
+            logical += 1
+        elif key == "model name" and not model:
+            model = value
+        elif key == "flags" and not flags:
+            flags = frozenset(value.split())
+        elif key == "physical id":
+            phys = value
+        elif key == "core id":
+            core = value
+        elif not key:                   # koniec bloku jednego procesora
+            if core is not None:
+                cores.add((phys, core))
+            phys = core = None
+    logical = logical or os.cpu_count() or 1
+    return CpuInfo(model, logical, len(cores) or logical, flags)
+
+
+def isa_level(flags):
+    """x86-64-v3 when the CPU has every v3 feature, else plain x86-64."""
+    return "x86-64-v3" if X86_64_V3_FLAGS <= set(flags) else "x86-64"
+
+
+def read_meminfo(path="/proc/meminfo"):
+    """Return (MemTotal, MemAvailable) in bytes."""
+    values = {}
+    for line in (_read(path) or "").splitlines():
+        key, _, rest = line.partition(":")
+        fields = rest.split()
+        if fields and fields[0].isdigit():
+            values[key] = int(fields[0]) * 1024
+    total = values.get("MemTotal") or os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    return total, values.get("MemAvailable", total)
+
+
+def _own_cgroups():
+    """controller → cgroup path of this process ("" = unified hierarchy)."""
+    paths = {}
+    for line in (_read("/proc/self/cgroup") or "").splitlines():
+        parts = line.split(":", 2)
+        if len(parts) != 3:
+            continue
+        for ctrl in parts[1].split(",") if parts[1] else [""]:
+            paths[ctrl] = parts[2]
+    return paths
+
+
+def _ancestors(root, path):
+    """root/path, then each parent directory up to root."""
+    path = path.strip("/")
+    while True:
+        yield os.path.join(root, path) if path else root
+        if not path:
+            return
+        path = os.path.dirname(path)
+
+
+def cgroup_limits(root=CGROUP_ROOT):
+    """Return (cpus, memory bytes) the cgroup allows; None = unlimited."""
+    paths = _own_cgroups()
+    cpu_limits, mem_limits = [], []
+
+    if "" in paths and not ("cpu" in paths or "memory" in paths):       # cgroup v2
+        for d in _ancestors(root, paths[""]):
+            quota = (_read(os.path.join(d, "cpu.max")) or "max").split()
+            if quota[0] != "max" and len(quota) == 2:
+                cpu_limits.append(int(quota[0]) / int(quota[1]))
+            mem = _read(os.path.join(d, "memory.max"))
+            if mem and mem.isdigit():
+                mem_limits.append(int(mem))
+    else:                                                               # cgroup v1
+        for d in _ancestors(os.path.join(root, "cpu"), paths.get("cpu", paths.get("cpu,cpuacct", "/"))):
+            quota = _read(os.path.join(d, "cpu.cfs_quota_us"))
+            period = _read(os.path.join(d, "cpu.cfs_period_us"))
+            if quota and period and int(quota) > 0:
+                cpu_limits.append(int(quota) / int(period))
+        for d in _ancestors(os.path.join(root, "memory"), paths.get("memory", "/")):
+            mem = _read(os.path.join(d, "memory.limit_in_bytes"))
+            if mem and mem.isdigit() and int(mem) < 1 << 60:           # 2^63 ≈ bez limitu
+                mem_limits.append(int(mem))
+
+    cpus = max(1, math.ceil(min(cpu_limits))) if cpu_limits else None
+    return cpus, (min(mem_limits) if mem_limits else None)
+
+
+def native_target(gcc="gcc"):
+    """Return (march, mtune) that -march=native resolves to, or (None, None)."""
+    try:
+        out = subprocess.run(
+            [gcc, "-march=native", "-mtune=native", "-Q", "--help=target"],
+            capture_output=True, text=True, timeout=20,
+        ).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None, None
+    march, mtune = MARCH_RE.search(out), MTUNE_RE.search(out)
+    return (march.group(1) if march else None), (mtune.group(1) if mtune else None)
+
+
+class BuildProfile(namedtuple(
+        "BuildProfile", "model cpus memory level march mtune make_jobs heavy_jobs emerge_jobs load tmpfs")):
+    """
+    Result of detect(); memory and tmpfs (0 = too little RAM) in bytes,
+    load = --load-average / make -l.
+    """
+
+    @property
+    def makeopts(self):
+        return f"-j{self.make_jobs} -l{self.load}"
+
+    @property
+    def heavy_makeopts(self):
+        return f"-j{self.heavy_jobs} -l{self.load}"
+
+    @property
+    def emerge_default_opts(self):
+        return f"--jobs={self.emerge_jobs} --load-average={self.load}"
+
+    def without_tmpfs(self):
+        """The profile with PORTAGE_TMPDIR on disk: jobs sized from all memory."""
+        if not self.tmpfs:
+            return self
+        make_jobs, heavy_jobs, emerge_jobs = job_counts(self.cpus, self.memory)
+        return self._replace(make_jobs=make_jobs, heavy_jobs=heavy_jobs,
+                             emerge_jobs=emerge_jobs, tmpfs=0)
+
+    def with_jobs(self, jobs):
+        """
+        The profile for *jobs* cores set by the user: make -j, the load limit
+        (never above the CPU count) and emerge --jobs (half of them) follow
+        the value; heavy jobs and emerge jobs never grow past the detected ones.
+        """
+        try:
+            jobs = max(1, int(str(jobs).strip()))
+        except ValueError:
+            return self
+        return self._replace(
+            make_jobs=jobs,
+            heavy_jobs=min(self.heavy_jobs, jobs),
+            emerge_jobs=max(1, min(self.emerge_jobs, jobs // 2)),
+            load=min(self.load, jobs),
+        )
+
+    def heavy_env(self):
+        """Contents of /etc/portage/env/<HEAVY_ENV>."""
+        return f'MAKEOPTS="{self.heavy_makeopts}"'
+
+    def package_env(self):
+        """Lines for /etc/portage/package.env mapping HEAVY_PACKAGES to HEAVY_ENV."""
+        return "\n".join(f"{atom} {HEAVY_ENV}" for atom in HEAVY_PACKAGES)
+
+    @property
+    def tmpfs_size(self):
+        """tmpfs size= option, whole GiB."""
+        return f"{self.tmpfs // GIB}G"
+
+    def tmpfs_fallback(self):
+        """HEAVY packages whose build directory does not fit into the tmpfs."""
+        return [atom for atom, gib in TMPDIR_NEEDS.items() if gib * GIB > self.tmpfs]
+
+    def notmpfs_env(self):
+        """Contents of /etc/portage/env/<NOTMPFS_ENV>."""
+        return f'PORTAGE_TMPDIR="{NOTMPFS_DIR}"'
+
+    def notmpfs_package_env(self):
+        return "\n".join(f"{atom} {NOTMPFS_ENV}" for atom in self.tmpfs_fallback())
+
+    def summary(self):
+        return "\n".join([
+            f"CPU: {self.model or '?'} – {self.cpus} CPU",
+            f"RAM: {self.memory / GIB:.1f} GiB",
+            f"-march={self.march}  -mtune={self.mtune}  ({self.level})",
+            f"MAKEOPTS=\"{self.makeopts}\"  (package.env, heavy packages: \"{self.heavy_makeopts}\")",
+            f"EMERGE_DEFAULT_OPTS=\"{self.emerge_default_opts}\"",
+            f"PORTAGE_TMPDIR tmpfs: {self.tmpfs_size if self.tmpfs else '–'}",
+        ])
+
+
+def job_counts(cpus, memory):
+    """(make jobs, heavy make jobs, emerge jobs) for *cpus* and *memory* bytes."""
+    make_jobs = max(1, min(cpus, memory // MEM_PER_JOB))
+    heavy_jobs = max(1, min(make_jobs, memory // HEAVY_MEM_PER_JOB))
+    emerge_jobs = max(1, min(cpus // 2, memory // MEM_PER_EMERGE_JOB, MAX_EMERGE_JOBS))
+    return int(make_jobs), int(heavy_jobs), int(emerge_jobs)
+
+
+def detect(gcc="gcc"):
+    cpu = read_cpuinfo()
+    total, _available = read_meminfo()
+    cg_cpus, cg_mem = cgroup_limits()
+
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        cpus = cpu.logical
+    if cg_cpus:
+        cpus = min(cpus, cg_cpus)
+    memory = min(total, cg_mem) if cg_mem else total
+
+    tmpfs = memory // 2 // GIB * GIB
+    if tmpfs < TMPFS_MIN:
+        tmpfs = 0
+    # pełny tmpfs zajmuje RAM – kompilatory dostają tylko resztę
+    make_jobs, heavy_jobs, emerge_jobs = job_counts(cpus, memory - tmpfs)
+    march, mtune = native_target(gcc)
+
+    return BuildProfile(
+        model=cpu.model,
+        cpus=cpus,
+        memory=memory,
+        level=isa_level(cpu.flags),
+        march=march or "native",
+        mtune=mtune or march or "native",
+        make_jobs=make_jobs,
+        heavy_jobs=heavy_jobs,
+        emerge_jobs=emerge_jobs,
+        load=cpus,
+        tmpfs=tmpfs,
+    )
+
+
+def main(argv=None):
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Print the build profile of this machine")
+    ap.add_argument("--gcc", default="gcc", help="compiler used to resolve -march=native")
+    args = ap.parse_args(argv)
+    profile = detect(args.gcc)
+    print(profile.summary())
+    print()
+    print(f"# /etc/portage/env/{HEAVY_ENV}")
+    print(profile.heavy_env())
+    print("# /etc/portage/package.env")
+    print(profile.package_env())
+    if profile.tmpfs:
+        print(f"# tmpfs {profile.tmpfs_size}; /etc/portage/env/{NOTMPFS_ENV}")
+        print(profile.notmpfs_env())
+        print(profile.notmpfs_package_env())
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,7 @@ DEST="/opt/Gento_Helper"
 
 # Tworzenie katalogu
 sudo mkdir -p "$DEST"
-sudo cp -r assets languages prog com.gento.helper.policy install.sh LICENSE GentooHelper.desktop README.md disk_utils.py steps_openrc_desktop_profile.py steps_systemd_desktop_profile.py main.py wizard.py "$DEST/"
+sudo cp -r assets languages prog com.gento.helper.policy install.sh LICENSE GentooHelper.desktop README.md binpkg.py ccache_setup.py disk_utils.py emerge_parser.py emerge_plan.py hw_tuning.py http_transport.py install_log.py log_view.py mirrors.py progress_dispatch.py pty_reader.py run_journal.py stage3_cache.py stage3_download.py stage3_extract.py stage3_fetcher.py stage3_verify.py step_graph.py steps_openrc_desktop_profile.py steps_systemd_desktop_profile.py main.py wizard.py "$DEST/"
 
 # PolicyKit
 sudo cp com.gento.helper.policy /usr/share/polkit-1/actions/
@@ -0,0 +1,232 @@
+"""
+install_log.py
+--------------
+Persistent, compressed log of one installation.
+
+Every step's output is appended to ``install-<date>.log.gz`` as gzip
+members of at most MEMBER_SECONDS / MEMBER_BYTES of output each
+(concatenated members are still one valid gzip file, so ``zcat``/``zless``
+show the whole run), and ``install-<date>.index.json`` records per step:
+label, command, the byte ranges of its members, exit code, start time,
+duration and line count.  A failed step can thus be decompressed on its
+own without reading the rest of the log, and a crash loses at most the
+last few seconds of output of every step running at that moment.
+
+Colour escapes are stripped, compressed and written on a background
+thread; the step runner only puts batches of lines on a queue and never
+waits for I/O.
+
+Run as a script to inspect a log:
+
+    python3 install_log.py /mnt/gentoo/var/log/gentoo-helper/install-….log.gz --failed
+"""
+
+# ——— Standard library ———
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+import zlib
+from datetime import datetime
+
+# ——— Local modules ———
+from emerge_parser import strip_ansi
+
+LOG_DIR = "/mnt/gentoo/var/log/gentoo-helper"
+COMPRESS_LEVEL = 6
+GZIP_WBITS = 31             # zlib: 16 + 15 → gzip container
+MEMBER_SECONDS = 2.0        # a step's member is closed and written after this…
+MEMBER_BYTES = 1024 * 1024  # …or this much text, whichever comes first
+
+
+def index_path(log_path):
+    return log_path[:-len(".log.gz")] + ".index.json"
+
+
+class InstallLog:
+    """
+    key = begin_step(label, cmd) → write(lines, key)… → end_step(rc, key),
+    then close().  All calls return immediately; the work is done by a
+    writer thread.
+
+    Steps may overlap (see step_graph.py).  Each step compresses into
+    its own gzip member, which is closed and written out every
+    MEMBER_SECONDS (or MEMBER_BYTES of text) and when the step ends, so
+    the members of overlapping steps interleave in the file and a step's
+    output is the list of byte ranges in its index entry.
+    """
+
+    def __init__(self, directory=LOG_DIR, level=COMPRESS_LEVEL):
+        os.makedirs(directory, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.path = os.path.join(directory, f"install-{stamp}.log.gz")
+        self.index_path = index_path(self.path)
+        self.level = level
+        self.steps = []
+        self._file = open(self.path, "ab")
+        self._keys = itertools.count(1)
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._writer, daemon=True)
+        self._thread.start()
+
+    # ——— called from the step runner ———
+    def begin_step(self, label, cmd=""):
+        key = next(self._keys)
+        self._queue.put(("begin", key, label, cmd, time.time(), time.monotonic()))
+        return key
+
+    def write(self, lines, key):
+        if lines:
+            self._queue.put(("data", key, lines))
+
+    def end_step(self, rc, key):
+        self._queue.put(("end", key, rc, time.monotonic()))
+
+    def close(self):
+        """Flush everything still queued and wait for the writer."""
+        self._queue.put(None)
+        self._thread.join()
+
+    # ——— writer thread ———
+    def _writer(self):
+        # key → [step, compressor | None, compressed chunks, text bytes, member start]
+        self._open = {}
+        failed = False
+        while True:
+            try:
+                msg = self._queue.get(timeout=MEMBER_SECONDS)
+            except queue.Empty:
+                msg = ("tick", None)        # quiet steps still reach the file
+            if msg is None:
+                break
+            if failed:
+                continue
+            try:
+                changed = self._handle(msg)
+                if self._write_due(time.monotonic()) or changed:
+                    self._file.flush()
+                    self._save_index()
+            except OSError as e:
+                print(f"[warn] Install log {self.path}: {e}")
+                failed = True
+        try:
+            if not failed:
+                for key in list(self._open):        # steps without end_step
+                    self._handle(("end", key, None, time.monotonic()))
+                self._file.flush()
+                self._save_index()
+            self._file.close()
+        except OSError as e:
+            print(f"[warn] Install log {self.path}: {e}")
+
+    def _handle(self, msg):
+        """Apply one queue message; True when the index has to be saved."""
+        kind, key = msg[0], msg[1]
+        if kind == "begin":
+            _, _, label, cmd, wall, mono = msg
+            step = {
+                "label": label, "cmd": cmd, "ranges": [],
+                "rc": None, "started": wall, "duration": 0.0,
+                "lines": 0, "_mono": mono,
+            }
+            self.steps.append(step)
+            self._open[key] = [step, None, [], 0, 0.0]
+            return True
+
+        entry = self._open.get(key)
+        if entry is None:
+            return False
+        step = entry[0]
+        if kind == "data":
+            lines = msg[2]
+            step["lines"] += len(lines)
+            text = "\n".join(map(strip_ansi, lines)) + "\n"
+            data = text.encode("utf-8", "replace")
+            if entry[1] is None:
+                entry[1] = zlib.compressobj(self.level, zlib.DEFLATED, GZIP_WBITS)
+                entry[4] = time.monotonic()
+            entry[2].append(entry[1].compress(data))
+            entry[3] += len(data)
+            return False
+        if kind == "end":
+            _, _, rc, mono_end = msg
+            self._write_member(entry)
+            step["rc"] = rc
+            step["duration"] = round(mono_end - step.pop("_mono"), 3)
+            del self._open[key]
+            return True
+        return False
+
+    def _write_due(self, now):
+        """Close and write the members that are old or large enough."""
+        written = False
+        for entry in self._open.values():
+            if entry[1] is not None and (
+                    entry[3] >= MEMBER_BYTES or now - entry[4] >= MEMBER_SECONDS):
+                self._write_member(entry)
+                written = True
+        return written
+
+    def _write_member(self, entry):
+        step, comp, chunks = entry[0], entry[1], entry[2]
+        if comp is None:
+            return
+        chunks.append(comp.flush())
+        offset = self._file.tell()
+        for data in chunks:
+            self._file.write(data)
+        step["ranges"].append([offset, self._file.tell() - offset])
+        entry[1:] = [None, [], 0, 0.0]
+
+    def _save_index(self):
+        steps = [{k: v for k, v in step.items() if not k.startswith("_")}
+                 for step in self.steps]
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"log": os.path.basename(self.path), "steps": steps}, f, indent=1)
+        os.replace(tmp, self.index_path)
+
+
+def load_index(log_path):
+    with open(index_path(log_path), "r", encoding="utf-8") as f:
+        return json.load(f)["steps"]
+
+
+def read_step(log_path, step):
+    """Return the decompressed output of one index entry (all its members)."""
+    parts = []
+    with open(log_path, "rb") as f:
+        for offset, length in step["ranges"]:
+            f.seek(offset)
+            parts.append(zlib.decompress(f.read(length), GZIP_WBITS))
+    return b"".join(parts).decode("utf-8", "replace")
+
+
+def main(argv=None):
+    """Command-line viewer: list steps, or print one step / the failed ones."""
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Inspect a Gentoo Helper install log")
+    ap.add_argument("log", help="install-*.log.gz")
+    ap.add_argument("--step", type=int, help="print the output of step N (1-based)")
+    ap.add_argument("--failed", action="store_true",
+                    help="print the output of failed and unfinished steps")
+    args = ap.parse_args(argv)
+
+    steps = load_index(args.log)
+    if args.step or args.failed:
+        chosen = [steps[args.step - 1]] if args.step else [s for s in steps if s["rc"] != 0]
+        for step in chosen:
+            print(f"===== {step['label']} (rc={step['rc']}) =====")
+            print(read_step(args.log, step), end="")
+        return
+
+    for n, step in enumerate(steps, 1):
+        print(f"{n:3d}  rc={str(step['rc']):>4}  {step['duration']:8.1f} s  "
+              f"{step['lines']:7d} lines  {step['label']}")
+
+
+if __name__ == "__main__":
+    main()
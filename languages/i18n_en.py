@@ -85,6 +85,13 @@ MESSAGES = {
     "step_generate_locales": "Generate locales",
     "step_eselect_locale": "Set locale via eselect",
     "step_sync_portage": "Sync Portage",
+    "step_heavy_env": "Build limits for heavy packages (package.env)",
+    "step_tmpfs": "Build directory in RAM (tmpfs)",
+    "step_tmpfs_umount": "Release the RAM build directory",
+    "step_binpkg": "Binary packages (binhost)",
+    "step_accelerated": "Accelerated install (official binhost)",
+    "step_ccache": "Compiler cache (ccache)",
+    "step_prefetch": "Download source archives (background)",
     "step_update_world": "Update system (world)",
     "step_config_makeconf_final": "Final make.conf configuration",
     "step_extra_cflags": "Set EXTRA_CFLAGS",
@@ -142,5 +149,21 @@ MESSAGES = {
     "missing_package": _("Package {pkg} not found."),
     "install_prompt": _("Do you want to install the {pkg} package?"),
     "install_failed": _("Installation of package {pkg} failed."),
+    "chk_stream_stage3": _("Extract while downloading (no tarball on disk)"),
+    "btn_save_log": _("Save full log…"),
+    "install_resumed": _("Resuming the previous installation – completed steps are skipped (↷)."),
+    "step_retry": _("↻ {label}: retry {attempt} in {delay} s"),
+    "install_aborted": _("Installation stopped: step “{label}” failed (rc={rc}). Fix the problem and start the installation again – completed steps will be skipped."),
+    "install_error": _("Installation stopped by an error: {error}"),
+    "hw_profile": _("Build profile (detected hardware)"),
+    "opt_tmpfs": _("Build in RAM (tmpfs PORTAGE_TMPDIR)"),
+    "opt_ccache": _("Compiler cache (ccache)"),
+    "ccache_report": _("ccache: {hits} of {calls} compilations served from the cache ({rate:.0f} %)"),
+    "opt_binpkg": _("Binary packages:"),
+    "binpkg_off": _("off – build everything from source"),
+    "binpkg_use": _("use the binhost"),
+    "binpkg_build": _("use the binhost and add new builds to it"),
+    "binpkg_report": _("Binary packages: {binaries} of {total} installed from binaries, ~{hours} h {minutes} min of compilation avoided"),
+    "opt_accelerated": _("Accelerated install (heavy packages from the official binhost)"),
 
 }
@@ -85,6 +85,13 @@ MESSAGES = {
     "step_generate_locales": _("Generowanie locale"),
     "step_eselect_locale": _("Ustawienie locale przez eselect"),
     "step_sync_portage": _("Synchronizacja Portage"),
+    "step_heavy_env": _("Limity kompilacji dużych pakietów (package.env)"),
+    "step_tmpfs": _("Katalog budowania w RAM (tmpfs)"),
+    "step_tmpfs_umount": _("Zwolnienie katalogu budowania w RAM"),
+    "step_binpkg": _("Pakiety binarne (binhost)"),
+    "step_accelerated": _("Przyspieszona instalacja (oficjalny binhost)"),
+    "step_ccache": _("Pamięć podręczna kompilatora (ccache)"),
+    "step_prefetch": _("Pobieranie źródeł w tle"),
     "step_update_world": _("Aktualizacja systemu (world)"),
     "step_config_makeconf_final": _("Konfiguracja pliku make.conf (ostateczna)"),
     "step_extra_cflags": _("Ustawienie EXTRA_CFLAGS"),
@@ -142,5 +149,22 @@ MESSAGES = {
     ), 
     "missing_package": _("Nie znaleziono pakietu {pkg}."),
     "install_prompt": _("Czy chcesz zainstalować pakiet {pkg}?"),
-    "install_failed": _("Instalacja pakietu {pkg} nie powiodła się."),                              
+    "install_failed": _("Instalacja pakietu {pkg} nie powiodła się."),
+    "chk_stream_stage3": _("Rozpakowuj w trakcie pobierania (bez archiwum na dysku)"),
+    "btn_save_log": _("Zapisz pełny log…"),
+    "install_resumed": _("Wznawiam poprzednią instalację – ukończone kroki są pomijane (↷)."),
+    "step_retry": _("↻ {label}: ponowna próba {attempt} za {delay} s"),
+    "install_aborted": _("Instalacja przerwana: krok „{label}” nie powiódł się (rc={rc}). Usuń przyczynę i uruchom instalację ponownie – ukończone kroki zostaną pominięte."),
+    "install_error": _("Instalacja przerwana przez błąd: {error}"),
+    "hw_profile": _("Profil kompilacji (wykryty sprzęt)"),
+    "opt_tmpfs": _("Kompilacja w RAM (tmpfs jako PORTAGE_TMPDIR)"),
+    "opt_ccache": _("Pamięć podręczna kompilatora (ccache)"),
+    "ccache_report": _("ccache: {hits} z {calls} kompilacji z pamięci podręcznej ({rate:.0f} %)"),
+    "opt_binpkg": _("Pakiety binarne:"),
+    "binpkg_off": _("wyłączone – wszystko ze źródeł"),
+    "binpkg_use": _("używaj binhosta"),
+    "binpkg_build": _("używaj binhosta i dodawaj do niego nowe kompilacje"),
+    "binpkg_report": _("Pakiety binarne: {binaries} z {total} zainstalowanych z binariów, zaoszczędzono ~{hours} h {minutes} min kompilacji"),
+    "opt_accelerated": _("Przyspieszona instalacja (ciężkie pakiety z oficjalnego binhosta)"),
+
 }
@@ -0,0 +1,114 @@
+"""
+log_view.py
+-----------
+Bounded log widget for the installation view.
+
+RingLogView keeps only the last *capacity* lines in its Gtk.TextBuffer:
+lines are appended in batches (one insert per batch), and once the
+buffer grows 10 % past the capacity the oldest lines are cut in a single
+delete.  It only scrolls when the user is already at the bottom, so
+reading older output is not interrupted.  Every line is also written to a
+spill file, from which save() streams the complete log – including the
+lines that were already evicted from the view.  The spill file lives on
+the target disk (next to the install log); /tmp of the live medium is
+RAM-backed and is only used while the target is not mounted.
+
+The capacity comes from GENTOO_HELPER_LOG_LINES (default 5000 lines).
+"""
+
+# ——— Standard library ———
+import os
+import shutil
+import tempfile
+
+# ——— Third-party ———
+import gi
+gi.require_version("Gtk", "3.0")
+from gi.repository import Gtk
+
+# ——— Local modules ———
+from install_log import LOG_DIR
+
+CAPACITY_ENV = "GENTOO_HELPER_LOG_LINES"
+DEFAULT_CAPACITY = 5000
+FOLLOW_SLACK_PX = 24        # "at the bottom" tolerance when deciding to scroll
+COPY_CHUNK = 1024 * 1024
+TARGET_ROOT = "/mnt/gentoo"
+
+
+def capacity_from_env():
+    try:
+        return max(100, int(os.environ[CAPACITY_ENV]))
+    except (KeyError, ValueError):
+        return DEFAULT_CAPACITY
+
+
+def spill_dir():
+    """LOG_DIR when the target is mounted, else None (default temp dir)."""
+    if not os.path.ismount(TARGET_ROOT):
+        return None
+    try:
+        os.makedirs(LOG_DIR, exist_ok=True)
+    except OSError as e:
+        print(f"[warn] Log w pamięci – brak katalogu {LOG_DIR}: {e}")
+        return None
+    return LOG_DIR
+
+
+class RingLogView(Gtk.ScrolledWindow):
+    """ScrolledWindow + read-only TextView holding the last *capacity* lines."""
+
+    def __init__(self, capacity=None):
+        super().__init__()
+        self.capacity = capacity or capacity_from_env()
+        self._slack = max(self.capacity // 10, 1)
+
+        self.view = Gtk.TextView(editable=False, wrap_mode=Gtk.WrapMode.WORD)
+        self.buffer = self.view.get_buffer()
+        # right gravity: the mark stays at the very end while we insert
+        self._end = self.buffer.create_mark(None, self.buffer.get_end_iter(), False)
+        self.add(self.view)
+
+        self._spill = tempfile.TemporaryFile(
+            mode="w+", encoding="utf-8", errors="replace", prefix="gentoo-helper-log-",
+            dir=spill_dir(),
+        )
+        self.lines = 0          # lines currently in the view
+        self.evicted = 0        # lines only left in the spill file
+        self.connect("destroy", lambda *_: self._spill.close())
+
+    # ------------------------------------------------------------------
+    def append(self, text):
+        self.append_lines([text])
+
+    def append_lines(self, lines):
+        """Append a batch of lines with one insert, trimming the oldest."""
+        if not lines:
+            return
+        text = "\n".join(lines) + "\n"
+        self._spill.write(text)
+
+        adj = self.get_vadjustment()
+        follow = adj.get_value() + adj.get_page_size() >= adj.get_upper() - FOLLOW_SLACK_PX
+
+        self.buffer.insert(self.buffer.get_end_iter(), text)
+        self.lines += text.count("\n")
+
+        if self.lines > self.capacity + self._slack:
+            drop = self.lines - self.capacity
+            self.buffer.delete(self.buffer.get_start_iter(), self.buffer.get_iter_at_line(drop))
+            self.lines -= drop
+            self.evicted += drop
+
+        if follow:
+            self.view.scroll_to_mark(self._end, 0.0, False, 0.0, 1.0)
+
+    def save(self, path):
+        """Stream the complete log (evicted lines included) into *path*."""
+        self._spill.flush()
+        self._spill.seek(0)
+        try:
+            with open(path, "w", encoding="utf-8") as out:
+                shutil.copyfileobj(self._spill, out, COPY_CHUNK)
+        finally:
+            self._spill.seek(0, os.SEEK_END)
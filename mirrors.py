@@ -0,0 +1,86 @@
+"""
+mirrors.py
+----------
+Latency-based ranking of Gentoo mirrors.
+
+Every candidate is probed concurrently: a TCP connect to the mirror host
+followed by a small ranged GET of a Stage3 manifest.  The fastest mirror
+serves the Stage3 download and the top few end up in GENTOO_MIRRORS of
+the generated make.conf.
+"""
+
+# ——— Standard library ———
+import http.client
+import os
+import socket
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+# Mirrors tried when GENTOO_HELPER_MIRRORS does not name any.
+# The first entries are the historical defaults of the wizard.
+CANDIDATE_MIRRORS = [
+    "http://ftp.vectranet.pl/gentoo/",
+    "https://mirror.init7.net/gentoo/",
+    "https://distfiles.gentoo.org/",
+    "https://ftp.fau.de/gentoo/",
+    "https://mirror.leaseweb.com/gentoo/",
+    "https://gentoo.osuosl.org/",
+    "https://mirrors.mit.edu/gentoo-distfiles/",
+    "https://mirror.aarnet.edu.au/pub/gentoo/",
+    "https://ftp.jaist.ac.jp/pub/Linux/Gentoo/",
+]
+MIRRORS_ENV = "GENTOO_HELPER_MIRRORS"
+PROBE_PATH = "releases/amd64/autobuilds/latest-stage3-amd64-desktop-openrc.txt"
+PROBE_BYTES = 4096
+PROBE_TIMEOUT = 3.0
+MAKECONF_MIRRORS = 3
+
+
+def candidates():
+    """Return the mirror list from GENTOO_HELPER_MIRRORS or the defaults."""
+    env = os.environ.get(MIRRORS_ENV, "").split()
+    return [m if m.endswith("/") else m + "/" for m in env] or list(CANDIDATE_MIRRORS)
+
+
+def probe_mirror(base, timeout=PROBE_TIMEOUT, path=PROBE_PATH):
+    """
+    Return the time in seconds to connect to *base* and fetch the first
+    PROBE_BYTES of *path* from it, or None if the mirror is unusable.
+    """
+    parts = urlsplit(base)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    started = time.monotonic()
+    try:
+        # raw TCP connect first: cheap way to drop dead hosts quickly –
+        # only without a proxy, which may be the sole way out
+        if not urllib.request.getproxies():
+            with socket.create_connection((parts.hostname, port), timeout=timeout):
+                pass
+        req = urllib.request.Request(
+            base + path, headers={"Range": f"bytes=0-{PROBE_BYTES - 1}"}
+        )
+        with urllib.request.urlopen(req, timeout=timeout) as r:
+            if r.status not in (200, 206):
+                return None
+            r.read(PROBE_BYTES)
+    except (OSError, ValueError, http.client.HTTPException):
+        # BadStatusLine, IncompleteRead… – one broken mirror must not stop the ranking
+        return None
+    return time.monotonic() - started
+
+
+def rank_mirrors(bases=None, timeout=PROBE_TIMEOUT):
+    """
+    Probe *bases* (default: candidates()) concurrently and return the
+    reachable ones ordered fastest first.  If none answers, the input
+    order is returned unchanged so callers always get a usable list.
+    """
+    bases = list(bases or candidates())
+    with ThreadPoolExecutor(max_workers=len(bases)) as pool:
+        timings = list(pool.map(lambda b: probe_mirror(b, timeout), bases))
+    ranked = [b for t, b in sorted(
+        (t, b) for t, b in zip(timings, bases) if t is not None
+    )]
+    return ranked or bases
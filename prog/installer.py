@@ -1,8 +1,13 @@
 #!/usr/bin/env python3
-import gi, subprocess, threading, multiprocessing, re
+import gi, subprocess, threading, multiprocessing
 gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk, GLib
 import os
+import sys
+# wspólne moduły Gentoo Helpera leżą katalog wyżej (obok wizard.py)
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from emerge_parser import EmergeStart, EmergeTracker, FailureWatch
+from progress_dispatch import ProgressDispatcher
 # –– włącz ciemny motyw, jeśli temat na to pozwala
 settings = Gtk.Settings.get_default()
 if settings is not None:                       # działa tylko, gdy DISPLAY jest aktywny
@@ -10,6 +15,8 @@ if settings is not None:                       # działa tylko, gdy DISPLAY jest
 class Installer:
     def __init__(self, parent_window):
         self.parent = parent_window
+        # emerge parsowany w wątku roboczym, GUI dostaje tylko ostatni stan widgetów
+        self._ui = ProgressDispatcher()
 
     def validate_password(self, pwd, result_queue):
         proc = subprocess.run(
@@ -54,6 +61,8 @@ class Installer:
         return None
 
     def run_with_progress(self, cmd, password, on_update, on_finish, on_error):
+        # on_update(line) działa w wątku roboczym: parsuje linię i wysyła do GUI
+        # wyłącznie ostatni stan widgetów przez self._ui.set()
         def worker():
             # 1) jeśli jesteśmy już rootem (np. w chroocie), pomijamy sudo
             if os.geteuid() == 0:
@@ -84,9 +93,13 @@ class Installer:
                 proc.stdin.flush()
 
             for line in proc.stdout:
-                GLib.idle_add(on_update, line.rstrip("\n"))
+                on_update(line.rstrip("\n"))
             ret = proc.wait()
-            GLib.idle_add(on_finish if ret == 0 else lambda: on_error(f"Proces zakończył się z kodem {ret}"))
+
+            def done():
+                self._ui.flush_now()        # ostatni stan widgetów przed on_finish/on_error
+                return on_finish() if ret == 0 else on_error(f"Proces zakończył się z kodem {ret}")
+            GLib.idle_add(done)
 
         threading.Thread(target=worker, daemon=True).start()
 
@@ -121,7 +134,8 @@ class Installer:
     def install_packages_with_args(self, pkgs, extra_args):
         # reset następnej listy pakietów, żeby nie pętlić po finish
         self._next_pkgs   = []
-        self._last_output = []
+        # sygnatury błędów wykrywane w locie + tylko ogon outputu
+        self._watch = FailureWatch()
         # detect uninstall mode
         is_uninstall = "-C" in extra_args
         # detect sync mode (emerge --sync bez pakietów)
@@ -166,55 +180,37 @@ class Installer:
         vbox.pack_start(current_pkg_label, False, False, 5)
         dlg.show_all()
 
-        # define phases
-        phases = ["Unpacking source","Compiling","Testing","Installing","Running postinst"]
-        current_idx=0; current_tot=0; current_phase_idx=0; file_frac=0.0; file_dir=1
+        # wspólny parser emerge (emerge_parser.py) – stan całego przebiegu
+        tracker = EmergeTracker()
+        file_frac=0.0; file_dir=1
+        ui = self._ui
 
         def on_update(line):
-            self._last_output.append(line)
-            nonlocal current_idx, current_tot, current_phase_idx, file_frac, file_dir, sync_frac, sync_dir
-            pkg = ""
-            # 1) schowaj zawsze file_progress na wejściu
-            file_progress.hide()
-
-            # 2) wykryj fazę emerge
-            m_ph = re.search(
-                r">>> (Unpacking source|Compiling|Testing|Installing|Running postinst)",
-                line
-            ) 
-            if m_ph:
-                phase = m_ph.group(1)
-                current_phase_idx = phases.index(phase)
-                phase_label.set_text(phase)
-
-            # 3) wykryj postęp pakietowy (install vs. uninstall)
-            if is_uninstall:
-                m_pkg = re.search(
-                    r">>> Unmerging\s*\((\d+) of (\d+)\)\s+(.+)",
-                    line
-                )
-            else:
-                m_pkg = re.search(
-                    r">>> (?:Emerging|Installing)\s*\((\d+) of (\d+)\)\s+(.+)",
-                    line
-                )
-            if m_pkg:
-                idx, tot, pkg = m_pkg.groups()
-                current_idx, current_tot = int(idx), int(tot)
+            # wątek roboczy – widgety tylko przez ui.set() (najnowsza wartość wygrywa)
+            self._watch.feed(line)
+            nonlocal file_frac, file_dir
+
+            # 1) faza / pakiet (x of y) / licznik [n/m] – jeden regex na linię
+            event = tracker.feed(line)
+            if event is not None and tracker.phase:
+                ui.set(phase_label, "set_text", tracker.phase)
+            if isinstance(event, EmergeStart):
                 # Update only the current package atom label
-                current_pkg_label.set_text(pkg)
+                ui.set(current_pkg_label, "set_text", event.package)
+
+            # 2) file_progress widoczny tylko w fazie Compiling (i gdy znamy liczbę pakietów)
+            compiling = tracker.total > 0 and tracker.phase == "Compiling"
+            ui.set(file_progress, "set_visible", compiling)
 
             # jeśli jeszcze nie mamy liczby pakietów, nic nie rób
-            if current_tot == 0:
+            if tracker.total == 0:
                 return False
 
-            # 4) zawsze pokazuj file_progress w fazie Compiling i pulsuj, gdy brak [n/m]
-            m_file = re.search(r"\[(\d+)\s*/\s*(\d+)\]", line)
-            if current_phase_idx == 1:
-                file_progress.show()
-                if m_file:
-                    f_idx, f_tot = map(int, m_file.groups())
-                    file_frac = f_idx / f_tot
+            # 3) w fazie Compiling pulsuj, gdy brak [n/m]
+            sub = tracker.substep
+            if compiling:
+                if sub:
+                    file_frac = sub.fraction
                 else:
                     # symulacja aktywności: zwiększ/zmniejsz fraction
                     file_frac += 0.02 * file_dir
@@ -224,19 +220,17 @@ class Installer:
                     elif file_frac <= 0.0:
                         file_frac = 0.0
                         file_dir = 1
-                file_progress.set_fraction(file_frac)
+                ui.set(file_progress, "set_fraction", file_frac)
 
-            # 5) oblicz główny ułamek paska: segment = (phase+1)/#phases
-            ph_frac = (current_phase_idx + 1) / len(phases)
-            frac = ((current_idx - 1) + ph_frac) / current_tot
-            progress.set_fraction(frac)
+            # 4) główny pasek: ukończone pakiety + faza bieżącego
+            ui.set(progress, "set_fraction", tracker.fraction)
 
-            # 6) aktualizuj etykietę
+            # 5) aktualizuj etykietę
             action = "Unmerging" if is_uninstall else "Installing"
-            label = f"[{current_idx}/{current_tot}] {action} {pkg}"
-            if current_phase_idx == 1 and m_file:
-                label += f" ({f_idx}/{f_tot})"
-            pkg_label.set_text(label)
+            label = f"[{tracker.index}/{tracker.total}] {action} {tracker.package}"
+            if tracker.phase == "Compiling" and sub:
+                label += f" ({sub.done}/{sub.total})"
+            ui.set(pkg_label, "set_text", label)
 
             return False
 
@@ -252,20 +246,17 @@ class Installer:
             return False
 
         def on_error(msg):
-            # zbierz cały output emerge
-            full = "\n".join(self._last_output).lower()
-
-            # 1) autounmask tylko przy odpowiednim błędzie
-            if ("perhaps you need --autounmask-write" in full
-                or "use changes are necessary to proceed" in full):
+            # 1) autounmask tylko przy odpowiednim błędzie (wykryte w locie)
+            if self._watch.autounmask:
                 pkg = pkgs[0]
                 # zrób autounmask
                 subprocess.run(["emerge", "--autounmask-write", pkg], check=False)
                 subprocess.run("yes | etc-update --automode -3",
                                shell=True, check=False)
 
-                # zresetuj log i pasek postępu
-                self._last_output.clear()
+                # zresetuj log, parser i pasek postępu
+                self._watch.reset()
+                tracker.reset()
                 progress.set_fraction(0.0)
                 status_label.set_text(f"Autounmask i ponowna instalacja {pkg}…")
 
@@ -277,21 +268,23 @@ class Installer:
                 return False
 
             # 2) jeżeli jest build.log → pokaż je i zamknij dialog
-            logs = re.findall(r'(/var/tmp/portage/\S+/temp/build\.log)', full)
-            if logs:
+            if self._watch.build_log:
                 dlg.destroy()
-                log_path = logs[-1]
+                log_path = self._watch.build_log
                 # ... reszta Twojego kodu pokazywania build.log ...
                 return False
 
             # 3) w pozostałych przypadkach – zamknij dialog i pokaż błąd
+            #    (z ostatnimi liniami outputu)
             dlg.destroy()
-            Gtk.MessageDialog(
+            err = Gtk.MessageDialog(
                 parent=self.parent,
                 modal=True,
                 message_type=Gtk.MessageType.ERROR,
                 text=msg
-            ).run()
+            )
+            err.format_secondary_text(self._watch.tail(20))
+            err.run()
             GLib.idle_add(self.parent.populate_package_list)
             return False
 
@@ -309,7 +302,7 @@ class Installer:
         self._next_pkgs = next_pkgs or []
 
         # przygotuj output i – jeżeli nie jesteśmy rootem – ewentualne sudo
-        self._last_output = []
+        self._watch = FailureWatch()
         if os.geteuid() == 0:
             # już rootem (w chroocie): nie używamy sudo
             pwd = None
@@ -356,8 +349,9 @@ class Installer:
         sync_dir = 1
 
         def on_update(line):
+            # wątek roboczy – pasek aktualizowany przez dispatcher
             nonlocal sync_frac, sync_dir
-            self._last_output.append(line)
+            self._watch.feed(line)
 
             # pulsuj pasek
             sync_frac += 0.03 * sync_dir
@@ -365,7 +359,7 @@ class Installer:
                 sync_frac = 1.0; sync_dir = -1
             elif sync_frac <= 0.0:
                 sync_frac = 0.0; sync_dir = 1
-            progress.set_fraction(sync_frac)
+            self._ui.set(progress, "set_fraction", sync_frac)
             return False
 
         def on_finish():
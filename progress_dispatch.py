@@ -0,0 +1,89 @@
+"""
+progress_dispatch.py
+--------------------
+Rate-limited delivery of GUI updates from worker threads.
+
+Calling GLib.idle_add() for every line of emerge output floods the GTK
+main loop.  A ProgressDispatcher instead collects updates and flushes
+them from a single GLib timeout at most *fps* times per second:
+
+* set(widget, "set_fraction", 0.4) – coalesced per (widget, method);
+  a newer value replaces one that was not shown yet.
+* each(func, *items) – every item is delivered, in order, on the next
+  flush (stateful consumers such as an output parser).
+* batch(func, *items) – like each(), but func receives the list of items
+  collected since the last flush (e.g. log lines).
+
+Whatever the output rate, at most one dispatcher source is queued in the
+main loop at a time.
+"""
+
+# ——— Standard library ———
+import threading
+
+# ——— Third-party ———
+import gi
+gi.require_version("GLib", "2.0")
+from gi.repository import GLib
+
+DEFAULT_FPS = 30
+
+
+class ProgressDispatcher:
+    def __init__(self, fps=DEFAULT_FPS):
+        self.interval_ms = max(1, int(1000 / fps))
+        self._lock = threading.Lock()
+        self._pending = {}          # key → (callable, args); insertion = order
+        self._scheduled = False
+
+    # ------------------------------------------------------------------
+    def set(self, widget, method, *args):
+        """Schedule widget.method(*args), superseding a pending call."""
+        key = ("set", widget, method)
+        with self._lock:
+            # re-insert so the flush order follows the order of last updates
+            self._pending.pop(key, None)
+            self._pending[key] = (getattr(widget, method), args)
+            self._schedule()
+
+    def each(self, func, *items):
+        """Schedule func(item) for every item; nothing is dropped."""
+        self._queue(("each", func), items)
+
+    def batch(self, func, *items):
+        """Schedule func([items…]) with all items queued before the flush."""
+        self._queue(("batch", func), items)
+
+    def flush_now(self):
+        """Deliver everything pending (must be called on the main loop)."""
+        self._flush()
+
+    # ------------------------------------------------------------------
+    def _queue(self, key, new_items):
+        with self._lock:
+            entry = self._pending.pop(key, None)
+            items = entry[1] if entry else []
+            items.extend(new_items)
+            self._pending[key] = (key[1], items)
+            self._schedule()
+
+    def _schedule(self):
+        # caller holds self._lock
+        if not self._scheduled:
+            self._scheduled = True
+            GLib.timeout_add(self.interval_ms, self._flush)
+
+    def _flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._scheduled = False
+        for key, (func, args) in pending.items():
+            mode = key[0]
+            if mode == "each":
+                for item in args:
+                    func(item)
+            elif mode == "batch":
+                func(args)
+            else:
+                func(*args)
+        return False
@@ -0,0 +1,90 @@
+"""
+pty_reader.py
+-------------
+Batched reading of a child's output through a pseudo-terminal.
+
+Instead of one text-mode readline() per line, the master side of the pty
+is made non-blocking and drained with large os.read() calls whenever the
+selector reports it readable.  Bytes are decoded incrementally (a UTF-8
+sequence split between two reads is kept for the next one) and split into
+lines in bulk, so a chatty build produces one batch per wake-up instead
+of one Python round-trip per line.
+"""
+
+# ——— Standard library ———
+import codecs
+import errno
+import os
+import pty
+import selectors
+import subprocess
+
+READ_SIZE = 64 * 1024
+MAX_BATCH_BYTES = 1024 * 1024       # hand over a batch at least every 1 MiB
+
+
+def spawn(cmd):
+    """
+    Start *cmd* with stdout/stderr on a new pty; return (proc, master_fd).
+    The caller reads master_fd (see read_batches) and closes it.
+    """
+    master_fd, slave_fd = pty.openpty()
+    try:
+        proc = subprocess.Popen(cmd, stdout=slave_fd, stderr=slave_fd)
+    except Exception:
+        os.close(master_fd)
+        raise
+    finally:
+        os.close(slave_fd)
+    return proc, master_fd
+
+
+def read_batches(fd, read_size=READ_SIZE):
+    """
+    Yield lists of complete lines (without line endings) read from *fd*
+    until EOF – or EIO, which is how a pty reports that the child side
+    was closed.  "\\r\\n" and lone "\\r" count as line breaks, like
+    text-mode readline().  Does not close *fd*.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    os.set_blocking(fd, False)
+    pending = ""
+    eof = False
+
+    with selectors.DefaultSelector() as sel:
+        sel.register(fd, selectors.EVENT_READ)
+        while not eof:
+            sel.select()
+            chunks = []
+            size = 0
+            # drain everything that is already there – fewer, larger batches
+            while size < MAX_BATCH_BYTES:
+                try:
+                    data = os.read(fd, read_size)
+                except BlockingIOError:
+                    break
+                except OSError as e:
+                    if e.errno != errno.EIO:
+                        raise
+                    data = b""
+                if not data:
+                    eof = True
+                    break
+                chunks.append(data)
+                size += len(data)
+
+            text = pending + decoder.decode(b"".join(chunks), final=eof)
+            hold = ""
+            if not eof and text.endswith("\r"):
+                # may be the first half of "\r\n" – decide with the next read
+                text, hold = text[:-1], "\r"
+            lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+            tail = lines.pop()              # unfinished last line ("" after "\n")
+            if eof:
+                if tail:
+                    lines.append(tail)
+                pending = ""
+            else:
+                pending = tail + hold
+            if lines:
+                yield lines
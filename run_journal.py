@@ -0,0 +1,101 @@
+"""
+run_journal.py
+--------------
+Checkpoint journal of the installation steps, kept inside the target
+system so that it survives a crash or reboot of the live medium.
+
+Each step is identified by the SHA-256 of its command (plus a counter
+for identical commands).  When a step finishes successfully it is
+recorded; on the next run the same step – same command, so the same
+user/CPU/locale choices – is skipped and the installation resumes at the
+first step that never completed.  Changing a wizard setting changes the
+command and therefore re-runs the step.
+
+A re-run step may undo what later steps did to the same resource – the
+make.conf step rewrites the file, dropping the lines the binpkg/ccache
+steps appended – so completed steps sharing a resource with a re-run
+step are re-run too.  Steps marked ``always`` (mounts) never count as
+completed.
+"""
+
+# ——— Standard library ———
+import hashlib
+import json
+import os
+import threading
+import time
+
+JOURNAL_PATH = "/mnt/gentoo/var/lib/gentoo-helper/run-journal.json"
+
+
+def step_keys(steps):
+    """Stable key per step: command hash, numbered when a command repeats."""
+    seen = {}
+    keys = []
+    for step in steps:
+        digest = hashlib.sha256(step.cmd.encode("utf-8")).hexdigest()
+        seen[digest] = seen.get(digest, 0) + 1
+        keys.append(f"{digest}:{seen[digest]}")
+    return keys
+
+
+class RunJournal:
+    """Completed steps of an installation, persisted after every step."""
+
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._keys = []
+        self._redo = set()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.completed = json.load(f).get("completed", {})
+        except (OSError, ValueError):
+            self.completed = {}
+
+    def bind(self, steps):
+        """
+        Attach the step list of this run (computes the step keys and the
+        completed steps that must run again); returns how many are skipped.
+        """
+        self._keys = step_keys(steps)
+        self._redo = set()
+        dirty = set()
+        for i, step in enumerate(steps):
+            rerun = self._keys[i] not in self.completed
+            if step.always or (not rerun and step.resources and step.resources & dirty):
+                self._redo.add(i)
+                rerun = True
+            if rerun and step.resources and not step.always:
+                dirty |= step.resources
+        return sum(1 for i in range(len(steps)) if self.is_done(i))
+
+    def is_done(self, index):
+        return index not in self._redo and self._keys[index] in self.completed
+
+    def record(self, index, step, rc, duration):
+        """Checkpoint a finished step; only successful steps are kept."""
+        if rc != 0:
+            return
+        with self._lock:
+            self.completed[self._keys[index]] = {
+                "label": step.label,
+                "finished": time.time(),
+                "duration": round(duration, 1),
+            }
+            self._save()
+
+    def reset(self):
+        with self._lock:
+            self.completed = {}
+            self._save()
+
+    def _save(self):
+        # caller holds self._lock
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"completed": self.completed}, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
@@ -0,0 +1,144 @@
+"""
+stage3_cache.py
+---------------
+Local, content-addressed cache of Stage3 tarballs shared across installs.
+
+Tarballs are stored as ``objects/<sha512>.tar.xz`` under the cache root,
+keyed by the SHA-512 published in the tarball's DIGESTS file, and evicted
+least-recently-used once the cache grows past its size limit.  Small text
+lookups (the latest-*.txt manifest, DIGESTS) are remembered with a TTL so
+that repeated installs of the same release do not touch the network.
+
+The cache is off unless GENTOO_HELPER_STAGE3_CACHE points at a directory
+(e.g. a persistent partition of the live medium or a NAS mount).
+"""
+
+# ——— Standard library ———
+import http.client
+import json
+import os
+import threading
+import time
+
+CACHE_ENV = "GENTOO_HELPER_STAGE3_CACHE"
+MAX_SIZE_ENV = "GENTOO_HELPER_STAGE3_CACHE_GB"
+DEFAULT_MAX_BYTES = 8 * 1024 ** 3
+MANIFEST_TTL = 6 * 3600                 # seconds
+
+
+class Stage3Cache:
+    """Size-bounded LRU store of verified Stage3 tarballs."""
+
+    def __init__(self, root, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.objects = os.path.join(root, "objects")
+        self.incoming = os.path.join(root, "incoming")
+        self._manifests = os.path.join(root, "manifests.json")
+        self._lock = threading.Lock()
+        os.makedirs(self.objects, exist_ok=True)
+        os.makedirs(self.incoming, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        """Return the configured cache, or None when caching is disabled."""
+        root = os.environ.get(CACHE_ENV, "").strip()
+        if not root:
+            return None
+        try:
+            max_bytes = int(float(os.environ[MAX_SIZE_ENV]) * 1024 ** 3)
+        except (KeyError, ValueError):
+            max_bytes = DEFAULT_MAX_BYTES
+        try:
+            return cls(root, max_bytes)
+        except OSError as e:
+            print(f"[warn] Stage3 cache {root} unusable: {e}")
+            return None
+
+    # ------------------------------------------------------------------
+    def object_path(self, digest):
+        return os.path.join(self.objects, f"{digest}.tar.xz")
+
+    def incoming_path(self, filename):
+        """Where a tarball is downloaded before it is verified and added."""
+        return os.path.join(self.incoming, filename)
+
+    def lookup(self, digest):
+        """Return the cached tarball for *digest* (and mark it used) or None."""
+        path = self.object_path(digest)
+        try:
+            os.utime(path)                    # mtime = last use, drives LRU
+        except FileNotFoundError:
+            return None
+        return path
+
+    def add(self, digest, path):
+        """
+        Move the verified tarball *path* into the cache; return its new path.
+        Evicts least-recently-used tarballs to stay under max_bytes.
+        """
+        dest = self.object_path(digest)
+        os.replace(path, dest)
+        os.utime(dest)
+        self.evict(keep=dest)
+        return dest
+
+    def contains(self, path):
+        return os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.objects)
+
+    def evict(self, keep=None):
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.objects):
+                p = os.path.join(self.objects, name)
+                try:
+                    st = os.stat(p)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, p))
+            total = sum(size for _, size, _ in entries)
+            for _mtime, size, p in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if p == keep:
+                    continue
+                try:
+                    os.remove(p)
+                    total -= size
+                except OSError:
+                    pass
+
+    # ------------------------------------------------------------------
+    def remember(self, key, fetch, ttl=MANIFEST_TTL):
+        """
+        Return the text cached under *key* if younger than *ttl* seconds,
+        otherwise call fetch(), store and return its result.  A stale entry
+        is still returned when fetch() fails (offline reinstall).
+        """
+        with self._lock:
+            data = self._load_manifests()
+        entry = data.get(key)
+        if entry and time.time() - entry["time"] < ttl:
+            return entry["value"]
+        try:
+            value = fetch()
+        except (OSError, http.client.HTTPException):
+            # KeepAliveTransport reports HTTP 4xx/5xx as HTTPException
+            if entry:
+                return entry["value"]
+            raise
+        with self._lock:
+            data = self._load_manifests()
+            data[key] = {"value": value, "time": time.time()}
+            tmp = self._manifests + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp, self._manifests)
+        return value
+
+    def _load_manifests(self):
+        try:
+            with open(self._manifests, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
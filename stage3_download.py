@@ -0,0 +1,328 @@
+"""
+stage3_download.py
+------------------
+Parallel, ranged HTTP download engine for Stage3 tarballs.
+
+The file is split into fixed-size byte ranges which are fetched over
+several concurrent connections and written straight into a preallocated
+file with pwrite().  Servers that do not honour ``Range`` fall back to a
+single sequential stream.
+
+While downloading, data goes to ``<dest>.part`` and the completed ranges
+are recorded in a small JSON journal (``<dest>.part.json``).  A later run
+validates the journal against the server's size/ETag and fetches only
+the missing ranges; the ``.part`` file is renamed to *dest* once complete.
+"""
+
+# ——— Standard library ———
+import http.client
+import json
+import os
+import threading
+import time
+
+# ——— Local modules ———
+from http_transport import default_transport
+
+DEFAULT_CONNECTIONS = 4
+SEGMENT_SIZE = 8 * 1024 * 1024        # 8 MiB per Range request
+CHUNK_SIZE = 256 * 1024               # read() size inside one segment
+SEGMENT_RETRIES = 3
+PROGRESS_INTERVAL = 0.25              # seconds between on_progress calls
+
+
+class DownloadError(RuntimeError):
+    """Raised when the download cannot be completed."""
+
+
+def probe(url, transport):
+    """
+    Return (total_size, accepts_ranges, etag) for *url*.
+
+    Uses a one-byte ranged GET instead of HEAD – some mirrors answer HEAD
+    differently from GET.  total_size is 0 when the server does not say.
+    """
+    with transport.open(url, {"Range": "bytes=0-0"}) as r:
+        etag = r.getheader("ETag") or ""
+        if r.status == 206:
+            # Content-Range: bytes 0-0/123456
+            crange = r.getheader("Content-Range") or ""
+            total = crange.rpartition("/")[2]
+            if total.isdigit():
+                return int(total), True, etag
+            return 0, False, etag
+        return int(r.getheader("Content-Length") or 0), False, etag
+
+
+def part_paths(dest):
+    """Return (partial_file, journal_file) used while *dest* is downloading."""
+    return dest + ".part", dest + ".part.json"
+
+
+class SegmentJournal:
+    """
+    On-disk record of completed byte ranges of a partial download.
+
+    The journal is rewritten atomically (tmp + fsync + rename) after every
+    finished segment, once the caller has synced the segment's data, so
+    after a crash it never claims data that is not on disk.
+    """
+
+    def __init__(self, path, url, size, etag, segment_size):
+        self.path = path
+        self.meta = {"url": url, "size": size, "etag": etag,
+                     "segment_size": segment_size}
+        self.completed = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, url, size, etag, segment_size):
+        """
+        Return a journal for the given download.  Ranges recorded earlier
+        are kept only if size, ETag and segment size still match the server.
+        """
+        journal = cls(path, url, size, etag, segment_size)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return journal
+        if (data.get("size") == size
+                and data.get("segment_size") == segment_size
+                and (data.get("etag") or "") == (etag or "")):
+            journal.completed = {tuple(r) for r in data.get("completed", [])}
+        return journal
+
+    def mark_done(self, start, end):
+        with self._lock:
+            self.completed.add((start, end))
+            self._save()
+
+    def _save(self):
+        data = dict(self.meta, completed=sorted(self.completed))
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def bytes_done(self):
+        return sum(end - start + 1 for start, end in self.completed)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def split_ranges(total, segment_size=SEGMENT_SIZE):
+    """Return a list of inclusive (start, end) byte ranges covering *total*."""
+    return [
+        (start, min(start + segment_size, total) - 1)
+        for start in range(0, total, segment_size)
+    ]
+
+
+class RangedDownloader:
+    """
+    Download *url* into *dest* using up to *connections* parallel Range
+    requests.
+
+    on_progress(done, total, rate) is called from worker threads at most
+    every PROGRESS_INTERVAL seconds (and once at the end); *rate* is the
+    aggregate throughput in bytes per second.  GTK callers must marshal it
+    to the main loop themselves (GLib.idle_add).
+
+    With resume=True (default) an interrupted download continues from its
+    journal instead of starting from zero.
+
+    An optional *hasher* (stage3_verify.StreamHasher) receives every chunk
+    as it is written, so the digest is ready when the download ends.
+
+    All requests go through *transport* (http_transport); by default a
+    KeepAliveTransport (UrllibTransport behind a proxy), so each worker
+    reuses its connection between segments.
+    """
+
+    def __init__(self, url, dest, *, connections=DEFAULT_CONNECTIONS,
+                 segment_size=SEGMENT_SIZE, on_progress=None, transport=None,
+                 resume=True, hasher=None, progress_interval=PROGRESS_INTERVAL):
+        self.url = url
+        self.dest = dest
+        self.part, self.journal_path = part_paths(dest)
+        self.resume = resume
+        self.hasher = hasher
+        self.connections = max(1, int(connections))
+        self.segment_size = segment_size
+        self.on_progress = on_progress
+        self.progress_interval = progress_interval
+        self.transport = transport or default_transport()
+
+        self.total = 0
+        self.done = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._errors = []
+        self._pending = []
+        self._journal = None
+        self._resumed = 0                 # bytes taken over from the journal
+        self._started = 0.0
+        self._last_report = 0.0
+
+    # ------------------------------------------------------------------
+    def run(self):
+        """Perform the download; return the number of bytes written."""
+        self.total, ranges_ok, etag = probe(self.url, self.transport)
+        self._started = time.monotonic()
+
+        if not ranges_ok or not self.total:
+            self._download_single()
+        else:
+            self._download_ranged(etag)
+
+        os.replace(self.part, self.dest)
+        if self._journal:
+            self._journal.remove()
+        self._report(force=True)
+        return self.done
+
+    # ------------------------------------------------------------------
+    def _add_progress(self, n):
+        with self._lock:
+            self.done += n
+        self._report()
+
+    def _report(self, force=False):
+        if not self.on_progress:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_report < self.progress_interval:
+                return
+            self._last_report = now
+            done = self.done
+        elapsed = max(now - self._started, 1e-6)
+        self.on_progress(done, self.total, (done - self._resumed) / elapsed)
+
+    # ------------------------------------------------------------------
+    def _download_single(self):
+        """Plain sequential download – servers without Range support."""
+        with self.transport.open(self.url) as r, open(self.part, "wb") as f:
+            if not self.total:
+                self.total = int(r.getheader("Content-Length") or 0)
+            while True:
+                chunk = r.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+                if self.hasher:
+                    self.hasher.update(chunk)
+                self._add_progress(len(chunk))
+
+    def _download_ranged(self, etag):
+        if self.resume and os.path.exists(self.part):
+            self._journal = SegmentJournal.load(
+                self.journal_path, self.url, self.total, etag, self.segment_size
+            )
+        else:
+            self._journal = SegmentJournal(
+                self.journal_path, self.url, self.total, etag, self.segment_size
+            )
+        if not self._journal.completed:
+            # nothing trustworthy on disk – start from a clean file
+            for stale in (self.part, self.journal_path):
+                if os.path.exists(stale):
+                    os.remove(stale)
+        self.done = self._resumed = self._journal.bytes_done()
+
+        fd = os.open(self.part, os.O_RDWR | os.O_CREAT, 0o644)   # RDWR: hasher may pread()
+        try:
+            if os.fstat(fd).st_size != self.total:
+                self._preallocate(fd)
+            if self.hasher:
+                self.hasher.attach(fd)
+                for start, end in sorted(self._journal.completed):
+                    self.hasher.mark_written(start, end - start + 1)
+            self._pending = [
+                rng for rng in split_ranges(self.total, self.segment_size)
+                if rng not in self._journal.completed
+            ]
+            self._pending.reverse()           # pop() from the front of the file
+
+            workers = [
+                threading.Thread(target=self._worker, args=(fd,), daemon=True)
+                for _ in range(min(self.connections, len(self._pending)))
+            ]
+            for t in workers:
+                t.start()
+            for t in workers:
+                t.join()
+        finally:
+            os.close(fd)
+
+        if self._errors:
+            raise DownloadError(str(self._errors[0])) from self._errors[0]
+        if self.done != self.total:
+            raise DownloadError(
+                f"Downloaded {self.done} of {self.total} bytes from {self.url}"
+            )
+
+    def _preallocate(self, fd):
+        try:
+            os.posix_fallocate(fd, 0, self.total)
+        except (AttributeError, OSError):
+            # fs without fallocate (e.g. some FUSE mounts) – sparse file is fine
+            os.ftruncate(fd, self.total)
+
+    def _next_range(self):
+        with self._lock:
+            return self._pending.pop() if self._pending else None
+
+    def _worker(self, fd):
+        while not self._stop.is_set():
+            rng = self._next_range()
+            if rng is None:
+                return
+            for attempt in range(1, SEGMENT_RETRIES + 1):
+                try:
+                    self._fetch_range(fd, *rng)
+                    os.fsync(fd)        # data on disk before the journal says so
+                    self._journal.mark_done(*rng)
+                    break
+                except (OSError, http.client.HTTPException, DownloadError) as e:
+                    if attempt == SEGMENT_RETRIES or self._stop.is_set():
+                        self._errors.append(e)
+                        self._stop.set()
+                        return
+                    time.sleep(attempt)
+
+    def _fetch_range(self, fd, start, end):
+        """Fetch bytes start..end (inclusive) and pwrite them at *start*."""
+        written = 0
+        try:
+            with self.transport.open(self.url, {"Range": f"bytes={start}-{end}"}) as r:
+                if r.status != 206:
+                    raise DownloadError(
+                        f"Server ignored Range request (HTTP {r.status})"
+                    )
+                offset = start
+                while offset <= end:
+                    if self._stop.is_set():
+                        raise DownloadError("Download aborted")
+                    chunk = r.read(min(CHUNK_SIZE, end - offset + 1))
+                    if not chunk:
+                        raise DownloadError(
+                            f"Connection closed at byte {offset} (range {start}-{end})"
+                        )
+                    os.pwrite(fd, chunk, offset)
+                    if self.hasher:
+                        self.hasher.update_at(offset, chunk)
+                    offset += len(chunk)
+                    written += len(chunk)
+                    self._add_progress(len(chunk))
+        except BaseException:
+            # the range will be fetched again from its start – undo its share
+            self._add_progress(-written)
+            raise
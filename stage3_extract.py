@@ -0,0 +1,189 @@
+"""
+stage3_extract.py
+-----------------
+Unpacking of Stage3 tarballs into the target root.
+
+Decompression runs in a separate process – ``xz -T0`` or ``pixz`` when
+available, so multi-block archives decode on all cores – feeding a plain
+``tar xpf -``.  Without either tool the stream is decoded in Python with
+the lzma module.  Compressed bytes are pushed through the pipeline by the
+caller, which gives exact byte-level progress.
+
+extract_tarball() unpacks an archive already on disk; stream_extract()
+pipes the HTTP body straight into the same pipeline while it is still
+downloading, so network, decompression and disk writes overlap and no
+scratch space is needed for the archive itself.
+"""
+
+# ——— Standard library ———
+import lzma
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from collections import namedtuple
+
+# ——— Local modules ———
+from http_transport import UrllibTransport
+
+CHUNK_SIZE = 256 * 1024
+PROGRESS_INTERVAL = 0.25
+
+
+class ExtractError(RuntimeError):
+    """Raised when tar cannot unpack the archive."""
+
+
+class Throughput(namedtuple("Throughput", "bytes seconds")):
+    """Compressed bytes processed and wall time of one extraction."""
+
+    @property
+    def mb_per_s(self):
+        return self.bytes / 1e6 / max(self.seconds, 1e-6)
+
+
+def decoder_command():
+    """
+    Return the argv of the fastest available parallel xz decoder (reading
+    stdin, writing stdout), or None if only the Python fallback is left.
+    """
+    if shutil.which("xz"):
+        return ["xz", "-dc", "-T0"]
+    if shutil.which("pixz"):
+        return ["pixz", "-d"]
+    return None
+
+
+class TarPipeline:
+    """
+    ``decoder | tar xpf - -C dest_dir`` fed with compressed bytes via feed().
+    """
+
+    def __init__(self, dest_dir):
+        # stderr goes to a file: a chatty tar must never block on a full pipe
+        self._errlog = tempfile.TemporaryFile()
+        self._tar = subprocess.Popen(
+            ["tar", "xpf", "-", "-C", dest_dir],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=self._errlog,
+        )
+        self._decoder = None
+        self._lzma = None
+        cmd = decoder_command()
+        if cmd:
+            self._decoder = subprocess.Popen(
+                cmd,
+                stdin=subprocess.PIPE,
+                stdout=self._tar.stdin,
+                stderr=self._errlog,
+            )
+            self._tar.stdin.close()           # the decoder owns tar's stdin now
+            self._sink = self._decoder.stdin
+        else:
+            self._lzma = lzma.LZMADecompressor()
+            self._sink = self._tar.stdin
+
+    def feed(self, chunk):
+        if self._lzma:
+            chunk = self._lzma.decompress(chunk)
+        self._sink.write(chunk)
+
+    def close(self):
+        """Flush the pipeline and wait; raise ExtractError on failure."""
+        try:
+            self._sink.close()
+        except BrokenPipeError:
+            pass
+        rcs = [p.wait() for p in (self._decoder, self._tar) if p]
+        self._errlog.seek(0)
+        err = self._errlog.read().decode(errors="replace").strip()
+        self._errlog.close()
+        if any(rcs):
+            raise ExtractError(err or f"extraction exited with codes {rcs}")
+
+    def kill(self):
+        for p in (self._decoder, self._tar):
+            if p:
+                p.kill()
+                p.wait()
+        self._errlog.close()
+
+
+def _pump(read, total, dest_dir, on_progress, hasher=None,
+          progress_interval=PROGRESS_INTERVAL):
+    """Push chunks from read() through a TarPipeline, reporting progress."""
+    pipeline = TarPipeline(dest_dir)
+    done = 0
+    started = last = time.monotonic()
+    try:
+        while True:
+            chunk = read(CHUNK_SIZE)
+            if not chunk:
+                break
+            pipeline.feed(chunk)
+            if hasher:
+                hasher.update(chunk)
+            done += len(chunk)
+            now = time.monotonic()
+            if on_progress and now - last >= progress_interval:
+                last = now
+                on_progress(done, total, done / max(now - started, 1e-6))
+    except BrokenPipeError:
+        # tar/decoder died early – close() below reports their stderr
+        pass
+    except BaseException:
+        pipeline.kill()
+        raise
+    pipeline.close()
+
+    stats = Throughput(done, time.monotonic() - started)
+    if on_progress:
+        on_progress(done, total, done / max(stats.seconds, 1e-6))
+    return stats
+
+
+def remove_new_entries(dest_dir, keep):
+    """
+    Remove what an extraction added to *dest_dir*: every top-level entry
+    not in *keep* (names listed before it started).  Pre-existing entries –
+    mount points such as boot/ or lost+found/ – are left alone.
+    """
+    for name in set(os.listdir(dest_dir)) - set(keep):
+        path = os.path.join(dest_dir, name)
+        try:
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except OSError as e:
+            print(f"[warn] Nie można usunąć {path}: {e}")
+
+
+def extract_tarball(tarball, dest_dir, *, on_progress=None):
+    """
+    Unpack the .tar.xz *tarball* into *dest_dir*.
+
+    on_progress(done, total, rate) is called from the calling thread with
+    compressed bytes consumed.  Returns a Throughput.
+    """
+    with open(tarball, "rb") as f:
+        return _pump(f.read, os.fstat(f.fileno()).st_size, dest_dir, on_progress)
+
+
+def stream_extract(url, dest_dir, *, on_progress=None, transport=None,
+                   hasher=None, progress_interval=PROGRESS_INTERVAL):
+    """
+    Download *url* (through *transport*, see http_transport) and unpack it
+    into *dest_dir* in one pass.
+
+    on_progress(done, total, rate) is called from the calling thread with
+    compressed bytes received; *hasher* (optional) sees the same bytes.
+    Returns a Throughput.
+    """
+    transport = transport or UrllibTransport()
+    with transport.open(url) as r:
+        total = int(r.getheader("Content-Length") or 0)
+        return _pump(r.read, total, dest_dir, on_progress, hasher,
+                     progress_interval)
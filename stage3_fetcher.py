@@ -0,0 +1,228 @@
+"""
+stage3_fetcher.py
+-----------------
+Single fetch layer for Stage3 tarballs: manifest lookup, DIGESTS check,
+local cache, parallel/resumable download or download-and-extract stream.
+
+One Stage3Fetcher serves every variant (init system, desktop/minimal
+profile, architecture) and routes all of its requests through one
+transport, so the manifest request and the tarball requests reuse the
+same keep-alive connections.
+
+Run as a script to benchmark a fetch without the GUI:
+
+    python3 stage3_fetcher.py --init openrc --dest /var/tmp/stage3-bench
+"""
+
+# ——— Standard library ———
+import os
+from collections import namedtuple
+
+# ——— Local modules ———
+from http_transport import default_transport
+from mirrors import rank_mirrors
+from stage3_download import DEFAULT_CONNECTIONS, PROGRESS_INTERVAL, RangedDownloader
+from stage3_extract import remove_new_entries, stream_extract
+from stage3_verify import StreamHasher, VerifyError, check_signature, parse_digests, verify
+
+
+class Stage3Variant(namedtuple("Stage3Variant", "init profile arch")):
+    """
+    init: "openrc" | "systemd"; profile: "desktop" | "minimal"; arch: "amd64", …
+    """
+
+    def __new__(cls, init="openrc", profile="desktop", arch="amd64"):
+        return super().__new__(cls, init, profile, arch)
+
+    @property
+    def manifest_name(self):
+        # latest-stage3-amd64-desktop-openrc.txt / latest-stage3-amd64-openrc.txt
+        flavour = f"{self.profile}-" if self.profile != "minimal" else ""
+        return f"latest-stage3-{self.arch}-{flavour}{self.init}.txt"
+
+
+def parse_manifest(text):
+    """
+    Return the tarball path from a latest-*.txt manifest.
+
+    The file holds comments, sizes and a PGP signature – the first line
+    that is not a comment/armour/checksum line names the archive.
+    """
+    for raw in text.splitlines():
+        line = raw.strip()
+        if (not line or line.startswith("#") or line.startswith("-----")
+                or line.lower().startswith("md5")):
+            continue
+        rel_path = line.split()[0]
+        if rel_path.endswith(".tar.xz"):
+            return rel_path
+    raise RuntimeError("Nie znalazłem ścieżki do Stage3 w latest-*.txt")
+
+
+class Stage3Fetcher:
+    """
+    Fetch the latest Stage3 of *variant* from the first of *mirrors*.
+
+    on_progress(done, total, rate) fires from the calling thread at most
+    every *progress_interval* seconds.  *cache* is an optional
+    stage3_cache.Stage3Cache; *transport* defaults to
+    http_transport.default_transport().
+    """
+
+    def __init__(self, variant, mirrors=None, *, transport=None, cache=None,
+                 connections=DEFAULT_CONNECTIONS, on_progress=None,
+                 progress_interval=PROGRESS_INTERVAL):
+        self.variant = variant
+        self.mirrors = list(mirrors) if mirrors else rank_mirrors()
+        self.transport = transport or default_transport()
+        self.cache = cache
+        self.connections = connections
+        self.on_progress = on_progress
+        self.progress_interval = progress_interval
+        self._url = None
+        self._expected = None
+
+    # ------------------------------------------------------------------
+    @property
+    def base_url(self):
+        return f"{self.mirrors[0]}releases/{self.variant.arch}/autobuilds/"
+
+    def text(self, url):
+        """GET *url* as text – via the cache's TTL store when configured."""
+        def fetch():
+            with self.transport.open(url) as r:
+                return r.read().decode(errors="replace")
+        return self.cache.remember(url, fetch) if self.cache else fetch()
+
+    def tarball_url(self):
+        if self._url is None:
+            manifest = self.text(self.base_url + self.variant.manifest_name)
+            self._url = self.base_url + parse_manifest(manifest)
+        return self._url
+
+    def expected_digests(self):
+        """
+        {algo: hex} for the tarball from its DIGESTS file; the clearsigned
+        file is checked with gpg when possible.
+        """
+        if self._expected is None:
+            url = self.tarball_url()
+            text = self.text(url + ".DIGESTS")
+            signed = check_signature(text)
+            if signed is False:
+                raise VerifyError("Nieprawidłowy podpis PGP pliku DIGESTS")
+            if signed is None:
+                print("[warn] Nie można sprawdzić podpisu DIGESTS (brak gpg lub klucza)")
+            expected = parse_digests(text, os.path.basename(url))
+            if not expected:
+                raise VerifyError(f"Brak sum SHA512/BLAKE2B dla {os.path.basename(url)}")
+            self._expected = expected
+        return self._expected
+
+    def cache_key(self):
+        expected = self.expected_digests()
+        return expected.get("sha512") or expected.get("blake2b")
+
+    def cached(self):
+        """Path of the verified tarball in the local cache, or None."""
+        return self.cache.lookup(self.cache_key()) if self.cache else None
+
+    # ------------------------------------------------------------------
+    def fetch(self, dest_dir):
+        """
+        Return the path of a verified tarball: from the cache, or freshly
+        downloaded (into the cache if configured, else into *dest_dir*).
+        """
+        cached = self.cached()
+        if cached:
+            return cached
+
+        url = self.tarball_url()
+        expected = self.expected_digests()
+        name = os.path.basename(url)
+        dest = self.cache.incoming_path(name) if self.cache else os.path.join(dest_dir, name)
+
+        hasher = StreamHasher()
+        RangedDownloader(
+            url, dest,
+            connections=self.connections,
+            transport=self.transport,
+            hasher=hasher,
+            on_progress=self.on_progress,
+            progress_interval=self.progress_interval,
+        ).run()
+        try:
+            verify(hasher, expected)
+        except VerifyError:
+            try:
+                os.remove(dest)
+            except OSError:
+                pass
+            raise
+        if self.cache:
+            dest = self.cache.add(self.cache_key(), dest)
+        return dest
+
+    def stream(self, dest_dir):
+        """
+        Download and unpack straight into *dest_dir*; the digest is checked
+        at the end (raises VerifyError).  Returns a Throughput.
+
+        The tree is unverified until the very end, so on any failure the
+        entries the archive added to *dest_dir* are removed again.
+        """
+        hasher = StreamHasher()
+        expected = self.expected_digests()
+        keep = os.listdir(dest_dir)
+        try:
+            stats = stream_extract(
+                self.tarball_url(), dest_dir,
+                transport=self.transport,
+                hasher=hasher,
+                on_progress=self.on_progress,
+                progress_interval=self.progress_interval,
+            )
+            verify(hasher, expected)
+        except BaseException:
+            remove_new_entries(dest_dir, keep)
+            raise
+        return stats
+
+    def close(self):
+        self.transport.close()
+
+
+def main(argv=None):
+    """Command-line benchmark: fetch one Stage3 and print the throughput."""
+    import argparse
+    import time
+
+    from stage3_cache import Stage3Cache
+
+    ap = argparse.ArgumentParser(description="Fetch a Stage3 tarball (benchmark)")
+    ap.add_argument("--init", default="openrc", choices=("openrc", "systemd"))
+    ap.add_argument("--profile", default="desktop", choices=("desktop", "minimal"))
+    ap.add_argument("--arch", default="amd64")
+    ap.add_argument("--mirror", action="append", help="mirror base URL (repeatable)")
+    ap.add_argument("--connections", type=int, default=DEFAULT_CONNECTIONS)
+    ap.add_argument("--dest", default=".")
+    ap.add_argument("--stream", action="store_true", help="download-and-extract into --dest")
+    args = ap.parse_args(argv)
+
+    def progress(done, total, rate):
+        pct = f"{done * 100 // total:3d} %" if total else f"{done >> 20} MiB"
+        print(f"\r{pct}  {rate / 1e6:7.1f} MB/s", end="", flush=True)
+
+    fetcher = Stage3Fetcher(
+        Stage3Variant(args.init, args.profile, args.arch),
+        args.mirror, cache=Stage3Cache.from_env(),
+        connections=args.connections, on_progress=progress,
+    )
+    started = time.monotonic()
+    result = fetcher.stream(args.dest) if args.stream else fetcher.fetch(args.dest)
+    print(f"\n{result}  ({time.monotonic() - started:.1f} s)")
+    fetcher.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+stage3_verify.py
+----------------
+Integrity checks for Stage3 tarballs.
+
+StreamHasher computes SHA-512 and BLAKE2b from the very chunks the
+downloader writes, so verification needs no extra pass over the file.
+The expected values come from the ``<tarball>.DIGESTS`` file published
+next to every Stage3; when gpg and the Gentoo release key are available
+the clearsigned DIGESTS file itself is checked as well.
+"""
+
+# ——— Standard library ———
+import hashlib
+import os
+import shutil
+import subprocess
+import threading
+
+# header in the DIGESTS file → hashlib name
+DIGEST_HEADERS = {
+    "SHA512": "sha512",
+    "BLAKE2B": "blake2b",
+}
+DEFAULT_ALGORITHMS = ("sha512", "blake2b")
+MAX_BUFFER = 64 * 1024 * 1024
+
+
+class VerifyError(RuntimeError):
+    """Raised when a tarball does not match its published digests."""
+
+
+class StreamHasher:
+    """
+    Incremental multi-algorithm hasher fed with (offset, data) pairs in any
+    order – parallel Range workers finish out of order.
+
+    Chunks at the current frontier are hashed immediately; chunks ahead of
+    it are buffered up to *max_buffer* bytes.  Beyond that only their
+    position is remembered and the bytes are read back with pread() from
+    the file (still in the page cache) once the frontier reaches them.
+    A retried range may be re-sent with other chunk boundaries: bytes
+    below the frontier are skipped, only the part beyond it is kept.
+    """
+
+    def __init__(self, algorithms=DEFAULT_ALGORITHMS, max_buffer=MAX_BUFFER):
+        self._hashes = {name: hashlib.new(name) for name in algorithms}
+        self._lock = threading.Lock()
+        self._fd = None
+        self._frontier = 0
+        self._buffered = {}          # offset → bytes
+        self._buffered_size = 0
+        self._on_disk = {}           # offset → length, to be pread() later
+        self.max_buffer = max_buffer
+
+    def attach(self, fd):
+        """Give the hasher the fd of the file being written (for pread)."""
+        self._fd = fd
+
+    def mark_written(self, offset, length):
+        """Record bytes already on disk, e.g. ranges taken over on resume."""
+        with self._lock:
+            self._on_disk[offset] = max(length, self._on_disk.get(offset, 0))
+            self._advance()
+
+    def update_at(self, offset, data):
+        with self._lock:
+            if offset < self._frontier:
+                # segment retried – the part below the frontier is already hashed
+                data = data[self._frontier - offset:]
+                offset = self._frontier
+            if not data:
+                return
+            if offset == self._frontier:
+                self._consume(data)
+            else:
+                self._store(offset, data)
+            self._advance()
+
+    def update(self, data):
+        """Sequential feeding (single-stream download, pipeline mode)."""
+        self.update_at(self._frontier, data)
+
+    def hexdigests(self):
+        with self._lock:
+            return {name: h.hexdigest() for name, h in self._hashes.items()}
+
+    @property
+    def hashed_bytes(self):
+        return self._frontier
+
+    # ------------------------------------------------------------------
+    def _consume(self, data):
+        for h in self._hashes.values():
+            h.update(data)
+        self._frontier += len(data)
+
+    def _store(self, offset, data):
+        old = self._buffered.get(offset)
+        if old is not None:
+            if len(old) >= len(data):
+                return
+            del self._buffered[offset]
+            self._buffered_size -= len(old)
+        if self._buffered_size + len(data) <= self.max_buffer:
+            self._buffered[offset] = data
+            self._buffered_size += len(data)
+        else:
+            self._on_disk[offset] = max(len(data), self._on_disk.get(offset, 0))
+
+    def _trim(self):
+        """Cut entries the frontier has moved into down to their unhashed tail."""
+        for offset in [o for o in self._buffered if o < self._frontier]:
+            data = self._buffered.pop(offset)
+            self._buffered_size -= len(data)
+            if offset + len(data) > self._frontier:
+                self._store(self._frontier, data[self._frontier - offset:])
+        for offset in [o for o in self._on_disk if o < self._frontier]:
+            end = offset + self._on_disk.pop(offset)
+            if end > self._frontier:
+                length = end - self._frontier
+                self._on_disk[self._frontier] = max(length, self._on_disk.get(self._frontier, 0))
+
+    def _advance(self):
+        while True:
+            self._trim()
+            data = self._buffered.pop(self._frontier, None)
+            if data is not None:
+                self._buffered_size -= len(data)
+                self._consume(data)
+                continue
+            length = self._on_disk.pop(self._frontier, None)
+            if length is not None and self._fd is not None:
+                self._consume(os.pread(self._fd, length, self._frontier))
+                continue
+            if length is not None:
+                self._on_disk[self._frontier] = length
+            return
+
+
+def parse_digests(text, filename):
+    """
+    Return {hashlib_name: hexdigest} for *filename* from a DIGESTS file.
+
+    The file lists ``# <ALGO> HASH`` headers, each followed by
+    ``<hex>  <name>`` lines (also for the .CONTENTS files); PGP armour
+    lines are ignored.
+    """
+    found = {}
+    algo = None
+    for raw in text.splitlines():
+        line = raw.strip()
+        if line.startswith("#"):
+            parts = line.lstrip("#").split()
+            algo = DIGEST_HEADERS.get(parts[0].upper()) if parts else None
+            continue
+        if not algo or not line or line.startswith("-----") or ":" in line:
+            continue
+        fields = line.split()
+        if len(fields) == 2 and os.path.basename(fields[1]) == filename:
+            found[algo] = fields[0].lower()
+    return found
+
+
+def check_signature(digests_text):
+    """
+    Verify the clearsigned DIGESTS text with gpg.
+
+    Returns True (good signature), False (bad signature) or None when it
+    cannot be checked – gpg missing, file not signed or key not imported.
+    """
+    if "BEGIN PGP SIGNED MESSAGE" not in digests_text or not shutil.which("gpg"):
+        return None
+    proc = subprocess.run(
+        ["gpg", "--batch", "--verify", "-"],
+        input=digests_text.encode(),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    if proc.returncode == 0:
+        return True
+    if proc.returncode == 1:
+        return False
+    return None
+
+
+def verify(hasher, expected):
+    """
+    Compare a finished StreamHasher with *expected* ({algo: hex}).
+    Raises VerifyError on mismatch or when nothing could be compared.
+    """
+    actual = hasher.hexdigests()
+    common = [algo for algo in expected if algo in actual]
+    if not common:
+        raise VerifyError("DIGESTS file has no usable SHA512/BLAKE2B entry")
+    for algo in common:
+        if actual[algo] != expected[algo]:
+            raise VerifyError(
+                f"{algo.upper()} mismatch: expected {expected[algo]}, got {actual[algo]}"
+            )
@@ -0,0 +1,229 @@
+"""
+step_graph.py
+-------------
+Dependency-aware execution of the installation steps.
+
+A step declares the resources it touches – files such as
+"/etc/sudoers", or names such as "runlevels".  Steps that declare no
+resources are *exclusive*: they wait for every earlier step and every
+later step waits for them.  *Heavy* steps – commands that run emerge or
+genkernel as a command word (here-document bodies are data and do not
+count) – are always exclusive, so package builds stay strictly
+serialized.
+
+From that the list order becomes a DAG: a step depends on an earlier
+step when either of them is exclusive or their resources overlap.
+run_steps() starts every step whose dependencies are finished, so the
+small file-writing steps between two emerge runs (sudoers, .xinitrc,
+grub defaults, autologin…) execute concurrently.
+
+Every step also carries a failure Policy: CONTINUE (log and go on – the
+default), ABORT (stop the installation: nothing new is started and
+run_steps raises StepFailed), or retry(n, delay) – n more attempts with
+exponential backoff before falling back to abort/continue.  Network-bound
+commands (emerge --sync, --fetchonly) retry by default.
+
+A *background* step (e.g. the distfile prefetch) waits for its
+predecessors like any other step, but no later step waits for it: it
+keeps running next to the builds and occupies one worker slot.  When the
+run is aborted, on_abort() is asked to stop the background steps and
+run_steps() waits for them, so nothing outlives the run.
+
+A resumed installation may run a step again (run_journal.py), so steps
+that add lines to a file use append_block(): the lines are written
+between marker comments and replace the block an earlier run left.
+"""
+
+# ——— Standard library ———
+import re
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+MAX_PARALLEL = 4
+HEAVY_COMMANDS = ("emerge", "genkernel")
+NETWORK_COMMANDS = ("--sync", "--fetchonly", "emerge-webrsync")
+
+HEREDOC_RE = re.compile(r"<<-?\s*(['\"]?)(\w+)\1")
+# początek polecenia, opcjonalne przypisania VAR=… , potem nazwa programu
+COMMAND_RE = re.compile(
+    r"(?:^|[;&|({`])\s*(?:\w+=(?:\"[^\"]*\"|'[^']*'|\S*)\s+)*(%s)\b"
+    % "|".join(HEAVY_COMMANDS),
+    re.M,
+)
+
+
+class Policy(namedtuple("Policy", "on_failure retries delay")):
+    """
+    on_failure: "abort" | "continue", applied after *retries* extra
+    attempts spaced delay, 2·delay, 4·delay… seconds apart.
+    """
+
+
+ABORT = Policy("abort", 0, 0)
+CONTINUE = Policy("continue", 0, 0)
+
+
+def retry(retries=3, delay=30, then="abort"):
+    return Policy(then, retries, delay)
+
+
+class StepFailed(Exception):
+    """A step with an abort policy failed; the run was stopped."""
+
+    def __init__(self, index, step, rc):
+        super().__init__(f"{step.label}: rc={rc}")
+        self.index = index
+        self.step = step
+        self.rc = rc
+
+
+def command_text(cmd):
+    """*cmd* without the bodies of its here-documents."""
+    lines, end = [], None
+    for line in cmd.splitlines():
+        if end is not None:
+            if line.strip() == end:
+                end = None
+            continue
+        m = HEREDOC_RE.search(line)
+        if m:
+            end = m.group(2)
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def heavy_commands(cmd):
+    """The HEAVY_COMMANDS that *cmd* runs as commands (not as arguments)."""
+    return {m.group(1) for m in COMMAND_RE.finditer(command_text(cmd))}
+
+
+def is_heavy(cmd):
+    """True when *cmd* runs one of HEAVY_COMMANDS as a command."""
+    return bool(heavy_commands(cmd))
+
+
+class Step(namedtuple("Step", "label cmd resources policy background heavy always")):
+    """
+    resources: iterable of resource names, or None (default) for an
+    exclusive step.  An empty set means "touches nothing shared".
+    policy: what a non-zero exit status means (default: retry() for
+    network-bound commands, CONTINUE otherwise).
+    background: later steps do not wait for this one.
+    heavy: the step builds packages and runs alone (default: is_heavy(cmd));
+    its resources are kept, but do not make it concurrent.
+    always: run on every (resumed) run even if the journal has it as
+    completed – state that does not survive a reboot, such as mounts.
+    """
+
+    def __new__(cls, label, cmd, resources=None, policy=None, background=False,
+                heavy=None, always=False):
+        if resources is not None:
+            resources = frozenset(resources)
+        if policy is None:
+            policy = retry() if any(n in cmd for n in NETWORK_COMMANDS) else CONTINUE
+        if heavy is None:
+            heavy = is_heavy(cmd)
+        return super().__new__(cls, label, cmd, resources, policy,
+                               bool(background), bool(heavy), bool(always))
+
+    @property
+    def exclusive(self):
+        return self.resources is None or self.heavy
+
+
+def as_step(item):
+    """Accept Step objects as well as plain (label, cmd) tuples."""
+    return item if isinstance(item, Step) else Step(*item)
+
+
+def append_block(path, text, tag):
+    """
+    Shell command appending *text* to *path* between ``# BEGIN/END
+    gentoo-helper <tag>`` lines, after deleting that block if present.
+    The command ends with the here-document; append nothing after it.
+    """
+    begin, end = f"# BEGIN gentoo-helper {tag}", f"# END gentoo-helper {tag}"
+    return (f"{{ [ ! -e {path} ] || sed -i '/^{begin}$/,/^{end}$/d' {path}; }} && "
+            f"cat <<'EOF' >>{path}\n{begin}\n{text}\n{end}\nEOF")
+
+
+def dependencies(steps):
+    """Return, for every step, the set of indices of steps it must wait for."""
+    deps = []
+    for i, step in enumerate(steps):
+        needs = set()
+        for j in range(i - 1, -1, -1):
+            prev = steps[j]
+            if prev.background:
+                continue
+            if step.exclusive or prev.exclusive or step.resources & prev.resources:
+                needs.add(j)
+                if prev.exclusive:
+                    break       # everything before prev finished before prev
+        deps.append(needs)
+    return deps
+
+
+def run_steps(steps, run, max_parallel=MAX_PARALLEL, on_retry=None, on_abort=None):
+    """
+    Call run(index, step) → exit status for every step as soon as its
+    dependencies have finished, at most *max_parallel* at a time; ready
+    steps start in list order.  Failed steps are retried per their policy
+    (on_retry(index, step, attempt, delay) is called before each retry).
+    Returns the exit statuses in step order; raises StepFailed – after
+    the steps already running have finished – when an ABORT step fails.
+    Background steps still running at that point (or when run() raised)
+    are stopped through on_abort() and waited for; they are not retried.
+    """
+    steps = [as_step(s) for s in steps]
+    deps = dependencies(steps)
+    results = [None] * len(steps)
+    pending = list(range(len(steps)))
+    finished = set()
+    running = {}
+    failed = None
+    stop = threading.Event()
+
+    def attempt(i, step):
+        rc = run(i, step)
+        for n in range(1, step.policy.retries + 1):
+            if rc == 0 or stop.is_set():
+                break
+            delay = step.policy.delay * 2 ** (n - 1)
+            if on_retry:
+                on_retry(i, step, n, delay)
+            time.sleep(delay)
+            rc = run(i, step)
+        return rc
+
+    pool = ThreadPoolExecutor(max_workers=max_parallel)
+    try:
+        while running or (pending and failed is None):
+            if failed is not None and all(steps[i].background for i in running.values()):
+                break
+            for i in list(pending) if failed is None else ():
+                if len(running) >= max_parallel:
+                    break
+                if deps[i] <= finished:
+                    pending.remove(i)
+                    running[pool.submit(attempt, i, steps[i])] = i
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = running.pop(future)
+                results[i] = rc = future.result()
+                finished.add(i)
+                if rc and steps[i].policy.on_failure == "abort" and failed is None:
+                    failed = i
+                    stop.set()
+    finally:
+        if running:
+            # aborted, or run() raised – background steps must not outlive the run
+            stop.set()
+            if on_abort:
+                on_abort()
+        pool.shutdown(wait=True)
+    if failed is not None:
+        raise StepFailed(failed, steps[failed], results[failed])
+    return results
@@ -2,11 +2,30 @@
 # Definition of the installation steps sequence for OpenRC Desktop Profile
 
 from i18n import MESSAGES
+from binpkg import accelerated_command, setup_command as binpkg_setup
+from ccache_setup import CCACHE_DIR, config as ccache_config
+from emerge_plan import merge
+from hw_tuning import HEAVY_ENV, NOTMPFS_DIR, NOTMPFS_ENV
+from step_graph import ABORT, CONTINUE, Step, append_block, retry
 
-# Returns a list of steps (label, cmd) to be executed during an OpenRC Desktop Profile installation
+# Returns a list of steps (label, cmd) to be executed during an OpenRC Desktop Profile installation.
+# Step(label, cmd, resources) marks a step that only touches the listed files/resources –
+# such steps may run concurrently (see step_graph.py); plain tuples run exclusively.
+# policy= decides what a failure means: ABORT for steps the later builds depend on,
+# retry(n, delay) for network-bound steps; everything else logs the error and continues.
+# background=True steps (the distfile prefetch) run alongside the following steps.
+# always=True steps (the tmpfs mounts) run again when an interrupted install resumes.
 def get_openrc_steps(wizard, env_data, programy):
+    # jak najmniej transakcji emerge – każda liczy zależności od nowa (emerge_plan.py):
+    # eselect-repository razem z kernelem, programy razem z aktualizacją @world
+    kernel_pkgs = merge('sys-kernel/gentoo-sources sys-kernel/genkernel',
+                        'app-eselect/eselect-repository')
+    world_pkgs = merge('--update --deep --newuse @world', ' '.join(programy))
+    binpkg_cmd = binpkg_setup(wizard.BINPKG_MODE, wizard.BINPKG_SRC)
+    accel_cmd = accelerated_command(wizard.ACCEL_SRC) if wizard.ACCEL_SRC else ""
+
     steps = [
-        (
+        Step(
             f"{MESSAGES['step_export_vars']}  [OpenRC]",   # ← etykieta kroku
             (
                 f'export NASZUSER="{wizard.NASZUSER}" '
@@ -17,21 +36,22 @@ def get_openrc_steps(wizard, env_data, programy):
                 f'export NASZNVIDIA="{wizard.NASZNVIDIA}" '
                 f'export NASZAMD="{wizard.NASZAMD}" '
                 f'export NASZINTELIRIS="{wizard.NASZINTELIRIS}"'
-            )
+            ),
+            ()                                            # nic nie zapisuje
         ),
-        (MESSAGES["step_generate_locales"],
-         f"""cat <<'EOF'>> /etc/locale.gen
-{wizard.LOCALE}.UTF-8 UTF-8
-en_US.UTF-8 UTF-8
-EOF"""
+        Step(MESSAGES["step_generate_locales"],
+         append_block("/etc/locale.gen",
+                      f"{wizard.LOCALE}.UTF-8 UTF-8\nen_US.UTF-8 UTF-8", "locales"),
+         {"/etc/locale.gen"}
         ),
         (MESSAGES["step_eselect_locale"],
          f"locale-gen && eselect locale set {wizard.LOCALE}.utf8"
         ),
-        (MESSAGES["step_sync_portage"],
-         'env-update && source /etc/profile && emerge --sync'
+        Step(MESSAGES["step_sync_portage"],
+         'env-update && source /etc/profile && emerge --sync',
+         policy=retry(3, 30)
         ),
-        (MESSAGES["step_config_makeconf_final"],
+        Step(MESSAGES["step_config_makeconf_final"],
          f"""cat <<'EOF' >/etc/portage/make.conf
 CHOST="x86_64-pc-linux-gnu"
 COMMON_FLAGS="-march={wizard.NASZMARCH} -mtune={wizard.NASZMTUNE} -O3 -pipe -flto"
@@ -39,69 +59,143 @@ CFLAGS="${{COMMON_FLAGS}}"
 CXXFLAGS="${{COMMON_FLAGS}}"
 FCFLAGS="${{COMMON_FLAGS}}"
 FFLAGS="${{COMMON_FLAGS}}"
-MAKEOPTS="-j{wizard.NASZCOR}"
+MAKEOPTS="{wizard.tuning.makeopts}"
+EMERGE_DEFAULT_OPTS="{wizard.tuning.emerge_default_opts}"
 VIDEO_CARDS="{wizard.NASZINTEL} {wizard.NASZNVIDIA} {wizard.NASZAMD} {wizard.NASZINTELIRIS}"
 USE="alsa pulseaudio vulkan opengl -systend -gpm"
 ACCEPT_LICENSE="*"
 ACCEPT_KEYWORDS="~amd64"
 LC_MESSAGES="pl_PL.UTF-8"
 LINGUAS="pl"
-#FEATURES="ccache"
-#CCACHE_DIR="$HOME/.ccache"
-GENTOO_MIRRORS="http://ftp.vectranet.pl/gentoo/ https://mirror.init7.net/gentoo/"
-EOF"""
-        ),
-        (MESSAGES["step_extra_cflags"],
+GENTOO_MIRRORS="{wizard.NASZMIRRORS}"
+EOF""",
+         {"/etc/portage/make.conf"},
+         ABORT
+        ),
+        # mniej zadań make dla pakietów, którym jedno zadanie zjada kilka GiB RAM
+        Step(MESSAGES.get("step_heavy_env", "Build limits for heavy packages (package.env)"),
+         f"""mkdir -p /etc/portage/env /etc/portage/package.env && \\
+cat <<'EOF' >/etc/portage/env/{HEAVY_ENV}
+{wizard.tuning.heavy_env()}
+EOF
+cat <<'EOF' >/etc/portage/package.env/gentoo-helper
+{wizard.tuning.package_env()}
+EOF""",
+         {"/etc/portage/package.env"}
+        ),
+        # PORTAGE_TMPDIR w RAM; pakiety za duże na tmpfs budują się na dysku (package.env)
+        *([
+            Step(MESSAGES.get("step_tmpfs", "Build directory in RAM (tmpfs)"),
+             f"""mkdir -p /var/tmp/portage {NOTMPFS_DIR} /etc/portage/env /etc/portage/package.env && \\
+(mountpoint -q /var/tmp/portage || \\
+ mount -t tmpfs -o size={wizard.tuning.tmpfs_size},uid=portage,gid=portage,mode=775,noatime tmpfs /var/tmp/portage) && \\
+cat <<'EOF' >/etc/portage/env/{NOTMPFS_ENV}
+{wizard.tuning.notmpfs_env()}
+EOF
+cat <<'EOF' >/etc/portage/package.env/gentoo-helper-notmpfs
+{wizard.tuning.notmpfs_package_env()}
+EOF""",
+             {"/var/tmp/portage", "/etc/portage/package.env"}, always=True),
+        ] if wizard.USE_TMPFS else []),
+        # pakiety binarne: binhost (URL) albo katalog z hosta jako PKGDIR (binpkg.py)
+        *([
+            Step(MESSAGES.get("step_binpkg", "Binary packages (binhost)"),
+             binpkg_cmd,
+             {"/etc/portage/make.conf", "/etc/portage/binrepos.conf"}),
+        ] if binpkg_cmd else []),
+        # przyspieszona instalacja: ciężkie pakiety z oficjalnego binhosta (binpkg.py)
+        *([
+            Step(MESSAGES.get("step_accelerated", "Accelerated install (official binhost)"),
+             accel_cmd,
+             {"/etc/portage/make.conf", "/etc/portage/binrepos.conf"},
+             retry(2, 30, then="continue")),
+        ] if accel_cmd else []),
+        # ccache – katalog może być podmontowany z hosta (ccache_setup.py)
+        *([
+            Step(MESSAGES.get("step_ccache", "Compiler cache (ccache)"),
+             f"""FEATURES="-ccache" emerge --noreplace dev-util/ccache && \\
+mkdir -p {CCACHE_DIR} && \\
+cat <<'EOF' >{CCACHE_DIR}/ccache.conf &&
+{ccache_config(wizard.CCACHE_GB)}
+EOF
+chown -R portage:portage {CCACHE_DIR} && chmod 2775 {CCACHE_DIR} && \\
+CCACHE_DIR={CCACHE_DIR} ccache -z && \\
+""" + append_block("/etc/portage/make.conf",
+                   f'FEATURES="${{FEATURES}} ccache"\nCCACHE_DIR="{CCACHE_DIR}"', "ccache"),
+             {"/etc/portage/make.conf", CCACHE_DIR}),
+        ] if wizard.USE_CCACHE else []),
+        # distfiles dla kernela, @world i programów pobierają się w tle,
+        # równolegle z kompilacją (po make.conf – USE wpływa na zestaw pakietów)
+        Step(MESSAGES.get("step_prefetch", "Download source archives (background)"),
+         wizard._fetch_only(
+             kernel_pkgs,
+             '--update --deep --newuse @world',
+             ' '.join(programy),
+         ),
+         policy=CONTINUE,       # tylko przyspiesza – ponowienie rozwiązywałoby @world od nowa
+         background=True
+        ),
+        Step(MESSAGES["step_extra_cflags"],
          f"export EXTRA_CFLAGS=\"-march={wizard.NASZMARCH} -mtune={wizard.NASZMTUNE} -O3 -pipe -flto\" && \
-export EXTRA_CXXFLAGS=\"-march={wizard.NASZMARCH} -mtune={wizard.NASZMTUNE} -O3 -pipe -flto\""
-        ),
-        (MESSAGES["step_install_kernel"],
-         'emerge sys-kernel/gentoo-sources sys-kernel/genkernel'
-        ),
-        (MESSAGES["step_microcode"],
-         f"""cat <<'EOF' >>/etc/genkernel.conf
-MICROCODE="intel"
-SANDBOX="yes"
-MAKEOPTS="$(portageq envvar MAKEOPTS)"
-EOF"""
-        ),
-        (MESSAGES["step_link_linux"],
-         'ln -sf /usr/src/linux-* /usr/src/linux'
-        ),
-        (MESSAGES["step_genkernel"], 'genkernel all'),
+export EXTRA_CXXFLAGS=\"-march={wizard.NASZMARCH} -mtune={wizard.NASZMTUNE} -O3 -pipe -flto\"",
+         ()
+        ),
+        Step(MESSAGES["step_install_kernel"],
+         f'emerge {kernel_pkgs}',
+         policy=retry(2, 60)                           # distfiles → sieć
+        ),
+        Step(MESSAGES["step_microcode"],
+         append_block("/etc/genkernel.conf",
+                      'MICROCODE="intel"\nSANDBOX="yes"\nMAKEOPTS="$(portageq envvar MAKEOPTS)"',
+                      "microcode"),
+         {"/etc/genkernel.conf"},
+         ABORT
+        ),
+        Step(MESSAGES["step_link_linux"],
+         'ln -sf /usr/src/linux-* /usr/src/linux',
+         {"/usr/src/linux"},
+         ABORT
+        ),
+        Step(MESSAGES["step_genkernel"], 'genkernel all', policy=ABORT),
         (MESSAGES["step_env_update"], 'env-update && source /etc/profile'),
-        (MESSAGES["step_repo"], 'emerge app-eselect/eselect-repository'),
         (MESSAGES["step_eselect"], 'eselect repository enable guru steam-overlay'),
-        (MESSAGES["step_sync_overlays"], 'emerge --sync'),
-        (MESSAGES["step_update_world2"],
-         'env-update && source /etc/profile && emerge --update --deep --newuse @world'
-        ),
-        (MESSAGES["step_install_programs"], wizard._auto_emerge(' '.join(programy))),
-        (MESSAGES["step_useradd"],
-         f'useradd -m -G wheel,audio,video,input,tty -s /bin/bash {wizard.NASZUSER}'
-        ),
-        (MESSAGES["step_autostart_x"],
-         f"""cat <<'EOF' >> /home/{wizard.NASZUSER}/.bash_profile
-if [ -z \"$DISPLAY\" ] && [ \"$(tty)\" = \"/dev/tty1\" ]; then
-    sleep 5
-    exec startx
-fi
-EOF"""
+        # tylko nowe overlaye – drzewo gentoo czyta w tle prefetch
+        Step(MESSAGES["step_sync_overlays"], 'emerge --sync guru steam-overlay',
+         policy=retry(3, 30, then="continue")),       # overlaye są opcjonalne
+        (MESSAGES["step_install_programs"],
+         'env-update && source /etc/profile && ' + wizard._auto_emerge(world_pkgs)
         ),
         *([
-            (
+            Step(MESSAGES.get("step_tmpfs_umount", "Release the RAM build directory"),
+             '! mountpoint -q /var/tmp/portage || umount /var/tmp/portage',
+             {"/var/tmp/portage"}, always=True),
+        ] if wizard.USE_TMPFS else []),
+        Step(MESSAGES["step_useradd"],
+         f'useradd -m -G wheel,audio,video,input,tty -s /bin/bash {wizard.NASZUSER}',
+         policy=ABORT                                 # kolejne kroki piszą do /home/…
+        ),
+        Step(MESSAGES["step_autostart_x"],
+         append_block(f"/home/{wizard.NASZUSER}/.bash_profile",
+                      'if [ -z "$DISPLAY" ] && [ "$(tty)" = "/dev/tty1" ]; then\n'
+                      '    sleep 5\n'
+                      '    exec startx\n'
+                      'fi', "autostart-x"),
+         {f"/home/{wizard.NASZUSER}/.bash_profile"}
+        ),
+        *([
+            Step(
                 MESSAGES["step_set_desktop_env"],
                 f"""cat <<'EOF' >/home/{wizard.NASZUSER}/.xinitrc
 {env_data["start_cmd"]}
-EOF"""
+EOF""",
+                {f"/home/{wizard.NASZUSER}/.xinitrc"}
             ),
         ] if env_data["start_cmd"] else []),
-        (MESSAGES["step_sudoers"],
-         f"""cat <<'EOF' >>/etc/sudoers
-{wizard.NASZUSER} ALL=(ALL:ALL) ALL
-EOF"""
+        Step(MESSAGES["step_sudoers"],
+         append_block("/etc/sudoers", f"{wizard.NASZUSER} ALL=(ALL:ALL) ALL", "sudoers"),
+         {"/etc/sudoers"}
         ),
-        (MESSAGES["step_history"],
+        Step(MESSAGES["step_history"],
          f"""cat <<'EOF' >/home/{wizard.NASZUSER}/.bash_history
 sudo env-update && source /etc/profile && sudo emerge --update --deep --newuse @world &&
 sudo env-update && source /etc/profile && sudo emerge x11-drivers/xf86-video-intel x11-drivers/nvidia-drivers
@@ -109,21 +203,23 @@ sudo nmtui
 sudo nano /etc/portage/make.conf
 sudo ccache -M 100G
 sudo ccache -s
-EOF"""
-        ),
-        (MESSAGES["step_history_chown"],
-         f"chown {wizard.NASZUSER}:{wizard.NASZUSER} /home/{wizard.NASZUSER}/.bash_history"
-        ),
-        (MESSAGES["step_grub_time"],
-         f"""cat <<'EOF' >>/etc/default/grub
-GRUB_TIMEOUT=0
-GRUB_TIMEOUT_STYLE=hidden
-EOF"""
-        ),
-        (MESSAGES["step_dbus"], 'rc-update add dbus default'),
-        (MESSAGES["step_networkmanager"], 'rc-update add NetworkManager default'),
-        (MESSAGES["step_autologin"],
-         f'sed -i "s|^c1:.*agetty.*|c1:12345:respawn:/sbin/agetty --noclear -a {wizard.NASZUSER} 38400 tty1 linux|" /etc/inittab'
+EOF""",
+         {f"/home/{wizard.NASZUSER}/.bash_history"}
+        ),
+        Step(MESSAGES["step_history_chown"],
+         f"chown {wizard.NASZUSER}:{wizard.NASZUSER} /home/{wizard.NASZUSER}/.bash_history",
+         {f"/home/{wizard.NASZUSER}/.bash_history"}
+        ),
+        Step(MESSAGES["step_grub_time"],
+         append_block("/etc/default/grub",
+                      "GRUB_TIMEOUT=0\nGRUB_TIMEOUT_STYLE=hidden", "grub-timeout"),
+         {"/etc/default/grub"}
+        ),
+        Step(MESSAGES["step_dbus"], 'rc-update add dbus default', {"runlevels"}),
+        Step(MESSAGES["step_networkmanager"], 'rc-update add NetworkManager default', {"runlevels"}),
+        Step(MESSAGES["step_autologin"],
+         f'sed -i "s|^c1:.*agetty.*|c1:12345:respawn:/sbin/agetty --noclear -a {wizard.NASZUSER} 38400 tty1 linux|" /etc/inittab',
+         {"/etc/inittab"}
         ),
         ("Install Gentoo Helper", 'bash /gentoo_helper/install.sh'),
     ]
@@ -3,17 +3,35 @@
 # Gentoo 23.0 desktop profile already selected in the Stage3 tarball.
 
 from i18n import MESSAGES
+from binpkg import accelerated_command, setup_command as binpkg_setup
+from ccache_setup import CCACHE_DIR, config as ccache_config
+from emerge_plan import merge
+from hw_tuning import HEAVY_ENV, NOTMPFS_DIR, NOTMPFS_ENV
+from step_graph import ABORT, CONTINUE, Step, append_block, retry
 
 
 def get_systemd_steps(wizard, env_data, programy):
     """Return list[(label, command)] for a systemd install.
 
     Mirrors the OpenRC variant but swaps only init‑specific parts and
-    makes sure a rootless X session works out‑of‑the‑box.
+    makes sure a rootless X session works out‑of‑the‑box.  Entries built
+    with Step(label, cmd, resources) only touch the listed resources and
+    may run concurrently (see step_graph.py); policy= marks steps whose
+    failure aborts the run (ABORT) or which are retried (retry()); the
+    background prefetch step downloads distfiles while the builds run;
+    always=True steps (the tmpfs mounts) run again when an install resumes.
     """
 
+    # As few emerge transactions as possible (see emerge_plan.py):
+    # eselect-repository rides along with the kernel, the programs with @world.
+    kernel_pkgs = merge('sys-kernel/gentoo-sources sys-kernel/genkernel',
+                        'app-eselect/eselect-repository')
+    world_pkgs = merge('--update --deep --newuse @world', ' '.join(programy))
+    binpkg_cmd = binpkg_setup(wizard.BINPKG_MODE, wizard.BINPKG_SRC)
+    accel_cmd = accelerated_command(wizard.ACCEL_SRC) if wizard.ACCEL_SRC else ""
+
     steps = [
-        (
+        Step(
             f"{MESSAGES['step_export_vars']}  [systemd]",
             (
                 f'export NASZUSER="{wizard.NASZUSER}" '
@@ -24,22 +42,23 @@ def get_systemd_steps(wizard, env_data, programy):
                 f'export NASZNVIDIA="{wizard.NASZNVIDIA}" '
                 f'export NASZAMD="{wizard.NASZAMD}" '
                 f'export NASZINTELIRIS="{wizard.NASZINTELIRIS}"'
-            )
+            ),
+            ()                                            # nic nie zapisuje
         ),
-        (MESSAGES["step_generate_locales"],
-         f"""cat <<'EOF'>> /etc/locale.gen
-{wizard.LOCALE}.UTF-8 UTF-8
-en_US.UTF-8 UTF-8
-EOF"""),
+        Step(MESSAGES["step_generate_locales"],
+         append_block("/etc/locale.gen",
+                      f"{wizard.LOCALE}.UTF-8 UTF-8\nen_US.UTF-8 UTF-8", "locales"),
+         {"/etc/locale.gen"}),
         (MESSAGES["step_eselect_locale"],
          f"locale-gen && eselect locale set {wizard.LOCALE}.utf8"),
 
         # ── 3. First sync ──────────────────────────────────────────────────
-        (MESSAGES["step_sync_portage"],
-         'env-update && source /etc/profile && emerge --sync'),
+        Step(MESSAGES["step_sync_portage"],
+         'env-update && source /etc/profile && emerge --sync',
+         policy=retry(3, 30)),
 
         # ── 4. make.conf tuned for systemd + X ─────────────────────────────
-        (MESSAGES["step_config_makeconf_final"],
+        Step(MESSAGES["step_config_makeconf_final"],
          f"""cat <<'EOF' >/etc/portage/make.conf
 CHOST="x86_64-pc-linux-gnu"
 COMMON_FLAGS="-march={wizard.NASZMARCH} -mtune={wizard.NASZMTUNE} -O3 -pipe -flto"
@@ -47,7 +66,8 @@ CFLAGS="${{COMMON_FLAGS}}"
 CXXFLAGS="${{COMMON_FLAGS}}"
 FCFLAGS="${{COMMON_FLAGS}}"
 FFLAGS="${{COMMON_FLAGS}}"
-MAKEOPTS="-j{wizard.NASZCOR}"
+MAKEOPTS="{wizard.tuning.makeopts}"
+EMERGE_DEFAULT_OPTS="{wizard.tuning.emerge_default_opts}"
 VIDEO_CARDS="{wizard.NASZINTEL} {wizard.NASZNVIDIA} {wizard.NASZAMD} {wizard.NASZINTELIRIS}"
 INPUT_DEVICES="libinput"
 USE="alsa pulseaudio vulkan opengl systemd udev dbus -gpm"
@@ -55,53 +75,130 @@ ACCEPT_LICENSE="*"
 ACCEPT_KEYWORDS="~amd64"
 LC_MESSAGES="pl_PL.UTF-8"
 LINGUAS="pl"
-GENTOO_MIRRORS="http://ftp.vectranet.pl/gentoo/ https://mirror.init7.net/gentoo/"
-EOF"""),
+GENTOO_MIRRORS="{wizard.NASZMIRRORS}"
+EOF""",
+         {"/etc/portage/make.conf"}, ABORT),
+
+        # ── 4a. Fewer make jobs for packages that need GiBs per job ───────
+        Step(MESSAGES.get("step_heavy_env", "Build limits for heavy packages (package.env)"),
+         f"""mkdir -p /etc/portage/env /etc/portage/package.env && \\
+cat <<'EOF' >/etc/portage/env/{HEAVY_ENV}
+{wizard.tuning.heavy_env()}
+EOF
+cat <<'EOF' >/etc/portage/package.env/gentoo-helper
+{wizard.tuning.package_env()}
+EOF""",
+         {"/etc/portage/package.env"}),
+
+        # ── 4b. PORTAGE_TMPDIR on tmpfs, oversized packages stay on disk ──
+        *([
+            Step(MESSAGES.get("step_tmpfs", "Build directory in RAM (tmpfs)"),
+             f"""mkdir -p /var/tmp/portage {NOTMPFS_DIR} /etc/portage/env /etc/portage/package.env && \\
+(mountpoint -q /var/tmp/portage || \\
+ mount -t tmpfs -o size={wizard.tuning.tmpfs_size},uid=portage,gid=portage,mode=775,noatime tmpfs /var/tmp/portage) && \\
+cat <<'EOF' >/etc/portage/env/{NOTMPFS_ENV}
+{wizard.tuning.notmpfs_env()}
+EOF
+cat <<'EOF' >/etc/portage/package.env/gentoo-helper-notmpfs
+{wizard.tuning.notmpfs_package_env()}
+EOF""",
+             {"/var/tmp/portage", "/etc/portage/package.env"}, always=True),
+        ] if wizard.USE_TMPFS else []),
+
+        # ── 4c. Binary packages: binhost URL or host directory as PKGDIR ──
+        *([
+            Step(MESSAGES.get("step_binpkg", "Binary packages (binhost)"),
+             binpkg_cmd,
+             {"/etc/portage/make.conf", "/etc/portage/binrepos.conf"}),
+        ] if binpkg_cmd else []),
+        # ── 4d. Heavy packages from the official Gentoo binhost ───────────
+        *([
+            Step(MESSAGES.get("step_accelerated", "Accelerated install (official binhost)"),
+             accel_cmd,
+             {"/etc/portage/make.conf", "/etc/portage/binrepos.conf"},
+             retry(2, 30, then="continue")),
+        ] if accel_cmd else []),
+
+        # ── 4e. ccache (CCACHE_DIR possibly bind-mounted from the host) ───
+        *([
+            Step(MESSAGES.get("step_ccache", "Compiler cache (ccache)"),
+             f"""FEATURES="-ccache" emerge --noreplace dev-util/ccache && \\
+mkdir -p {CCACHE_DIR} && \\
+cat <<'EOF' >{CCACHE_DIR}/ccache.conf &&
+{ccache_config(wizard.CCACHE_GB)}
+EOF
+chown -R portage:portage {CCACHE_DIR} && chmod 2775 {CCACHE_DIR} && \\
+CCACHE_DIR={CCACHE_DIR} ccache -z && \\
+""" + append_block("/etc/portage/make.conf",
+                   f'FEATURES="${{FEATURES}} ccache"\nCCACHE_DIR="{CCACHE_DIR}"', "ccache"),
+             {"/etc/portage/make.conf", CCACHE_DIR}),
+        ] if wizard.USE_CCACHE else []),
+
+        # ── 4f. Distfiles for kernel, @world and programs, in the background ─
+        Step(MESSAGES.get("step_prefetch", "Download source archives (background)"),
+         wizard._fetch_only(
+             kernel_pkgs,
+             '--update --deep --newuse @world',
+             ' '.join(programy),
+         ),
+         policy=CONTINUE,                # best effort – a retry would resolve @world again
+         background=True),
 
         # ── 5. Extra C*FLAGS env for packages built outside emerge ────────
-        (MESSAGES["step_extra_cflags"],
+        Step(MESSAGES["step_extra_cflags"],
          f"export EXTRA_CFLAGS=\"-march={wizard.NASZMARCH} -mtune={wizard.NASZMTUNE} -O3 -pipe -flto\" && "
-         f"export EXTRA_CXXFLAGS=\"-march={wizard.NASZMARCH} -mtune={wizard.NASZMTUNE} -O3 -pipe -flto\""),
+         f"export EXTRA_CXXFLAGS=\"-march={wizard.NASZMARCH} -mtune={wizard.NASZMTUNE} -O3 -pipe -flto\"",
+         ()),
 
         # ── 6. Kernel & genkernel ─────────────────────────────────────────
-        (MESSAGES["step_install_kernel"],
-         'emerge sys-kernel/gentoo-sources sys-kernel/genkernel'),
-        (MESSAGES["step_microcode"],
-         """cat <<'EOF' >>/etc/genkernel.conf
-MICROCODE="intel"
-SANDBOX="yes"
-MAKEOPTS="$(portageq envvar MAKEOPTS)"
-EOF"""),
-        (MESSAGES["step_link_linux"], 'ln -sf /usr/src/linux-* /usr/src/linux'),
-        (MESSAGES["step_genkernel"],   'genkernel all'),
+        Step(MESSAGES["step_install_kernel"],
+         f'emerge {kernel_pkgs}',
+         policy=retry(2, 60)),
+        Step(MESSAGES["step_microcode"],
+         append_block("/etc/genkernel.conf",
+                      'MICROCODE="intel"\nSANDBOX="yes"\nMAKEOPTS="$(portageq envvar MAKEOPTS)"',
+                      "microcode"),
+         {"/etc/genkernel.conf"}, ABORT),
+        Step(MESSAGES["step_link_linux"], 'ln -sf /usr/src/linux-* /usr/src/linux', {"/usr/src/linux"}, ABORT),
+        Step(MESSAGES["step_genkernel"], 'genkernel all', policy=ABORT),
         (MESSAGES["step_env_update"],  'env-update && source /etc/profile'),
 
-        # ── 7. Portage overlays & @world update ───────────────────────────
-        (MESSAGES["step_repo"],          'emerge app-eselect/eselect-repository'),
+        # ── 7. Portage overlays ───────────────────────────────────────────
         (MESSAGES["step_eselect"],       'eselect repository enable guru steam-overlay'),
-        (MESSAGES["step_sync_overlays"], 'emerge --sync'),
-        (MESSAGES["step_update_world2"], 'env-update && source /etc/profile && emerge --update --deep --newuse @world'),
-
-        # ── 9. Extra user software (unchanged) ────────────────────────────
-        (MESSAGES["step_install_programs"], wizard._auto_emerge(' '.join(programy))),
+        # only the new repos: the background prefetch is reading ::gentoo
+        Step(MESSAGES["step_sync_overlays"], 'emerge --sync guru steam-overlay',
+             policy=retry(3, 30, then="continue")),
+
+        # ── 9. @world update + extra user software, one transaction ───────
+        (MESSAGES["step_install_programs"],
+         'env-update && source /etc/profile && ' + wizard._auto_emerge(world_pkgs)),
+        *([
+            Step(MESSAGES.get("step_tmpfs_umount", "Release the RAM build directory"),
+             '! mountpoint -q /var/tmp/portage || umount /var/tmp/portage',
+             {"/var/tmp/portage"}, always=True),
+        ] if wizard.USE_TMPFS else []),
 
         # ── 10. User & autostart ──────────────────────────────────────────
-        (MESSAGES["step_useradd"], f'useradd -m -G wheel,audio,video,input,tty -s /bin/bash {wizard.NASZUSER}'),
+        Step(MESSAGES["step_useradd"], f'useradd -m -G wheel,audio,video,input,tty -s /bin/bash {wizard.NASZUSER}',
+             policy=ABORT),
 #        (MESSAGES["step_autostart_x"], f"""cat <<'EOF' >> /home/{wizard.NASZUSER}/.bash_profile
 #if [ -z \"$DISPLAY\" ] && [ \"$(tty)\" = \"/dev/tty1\" ]; then
 #    exec startx
 #fi
 #EOF"""),
-        *([(
+        *([Step(
                 MESSAGES["step_set_desktop_env"],
                 f"""cat <<'EOF' >/home/{wizard.NASZUSER}/.xinitrc
 {env_data['start_cmd']}
-EOF"""
+EOF""",
+                {f"/home/{wizard.NASZUSER}/.xinitrc"}
         )] if env_data.get("start_cmd") else []),
 
         # ── 11. Sudoers & history ─────────────────────────────────────────
-        (MESSAGES["step_sudoers"], f"""echo '{wizard.NASZUSER} ALL=(ALL:ALL) ALL' >> /etc/sudoers"""),
-        (MESSAGES["step_history"],
+        Step(MESSAGES["step_sudoers"],
+             append_block("/etc/sudoers", f"{wizard.NASZUSER} ALL=(ALL:ALL) ALL", "sudoers"),
+             {"/etc/sudoers"}),
+        Step(MESSAGES["step_history"],
          f"""cat <<'EOF' >/home/{wizard.NASZUSER}/.bash_history
 sudo env-update && source /etc/profile && sudo emerge --update --deep --newuse @world &&
 sudo env-update && source /etc/profile && sudo emerge x11-drivers/xf86-video-intel x11-drivers/nvidia-drivers
@@ -109,29 +206,31 @@ sudo nmtui
 sudo nano /etc/portage/make.conf
 sudo ccache -M 100G
 sudo ccache -s
-EOF"""
+EOF""",
+         {f"/home/{wizard.NASZUSER}/.bash_history"}
         ),
-        (MESSAGES["step_history_chown"],
-         f"chown {wizard.NASZUSER}:{wizard.NASZUSER} /home/{wizard.NASZUSER}/.bash_history"
+        Step(MESSAGES["step_history_chown"],
+         f"chown {wizard.NASZUSER}:{wizard.NASZUSER} /home/{wizard.NASZUSER}/.bash_history",
+         {f"/home/{wizard.NASZUSER}/.bash_history"}
         ),
         # ── 12. GRUB tweak (timeout) ──────────────────────────────────────
-        (MESSAGES["step_grub_time"],
-         f"""cat <<'EOF' >>/etc/default/grub
-GRUB_TIMEOUT=0
-GRUB_TIMEOUT_STYLE=hidden
-EOF"""
+        Step(MESSAGES["step_grub_time"],
+         append_block("/etc/default/grub",
+                      "GRUB_TIMEOUT=0\nGRUB_TIMEOUT_STYLE=hidden", "grub-timeout"),
+         {"/etc/default/grub"}
         ),
         # ── 13. Enable core services ─────────────────────────────────────
 
-        (MESSAGES["step_networkmanager"], "systemctl enable NetworkManager.service"),
+        Step(MESSAGES["step_networkmanager"], "systemctl enable NetworkManager.service", {"systemd-units"}),
 
         # ── 14. Autologin drop‑in with runtime‑dir + xorg dirs ────────────
-        (MESSAGES["step_autologin"], f"""mkdir -p /etc/systemd/system/getty@tty1.service.d && cat <<'EOF' >/etc/systemd/system/getty@tty1.service.d/autologin.conf
+        Step(MESSAGES["step_autologin"], f"""mkdir -p /etc/systemd/system/getty@tty1.service.d && cat <<'EOF' >/etc/systemd/system/getty@tty1.service.d/autologin.conf
 [Service]
 ExecStart=
 ExecStart=-/sbin/agetty --autologin {wizard.NASZUSER} --noclear %I $TERM
 EOF
-"""),
+""",
+         {"/etc/systemd/system/getty@tty1.service.d"}),
         # ── 15. Gentoo Helper script -------------------------------------
         ("Install Gentoo Helper", 'bash /gentoo_helper/install.sh'),
     ]
@@ -0,0 +1,85 @@
+"""
+Shared fixtures: the helper modules live in the repository root, next to
+wizard.py, and are imported from there.
+"""
+
+# ——— Standard library ———
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """
+    Serves server.data.  With server.ranges it answers ``Range`` with 206,
+    otherwise always the whole body with 200.  server.drops maps a range
+    start to [bytes, times]: that many responses for the range are cut
+    after *bytes* bytes and the connection is closed.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *_args):
+        pass
+
+    def do_GET(self):
+        srv = self.server
+        data = srv.data
+        rng = self.headers.get("Range")
+        with srv.lock:
+            srv.requests.append(rng)
+        start = 0
+        if rng and srv.ranges:
+            first, _, last = rng[len("bytes="):].partition("-")
+            start, end = int(first), min(int(last), len(data) - 1)
+            body = data[start:end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        else:
+            body = data
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", srv.etag)
+        self.end_headers()
+
+        cut = None
+        with srv.lock:
+            drop = srv.drops.get(start)
+            if drop and drop[1] > 0 and len(body) > drop[0]:
+                drop[1] -= 1
+                cut = drop[0]
+        if cut is not None:
+            self.wfile.write(body[:cut])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def http_server():
+    """Factory: http_server(data, ranges=True) → (url, server)."""
+    servers = []
+
+    def start(data, ranges=True, etag='"v1"'):
+        srv = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+        srv.daemon_threads = True
+        srv.data = data
+        srv.ranges = ranges
+        srv.etag = etag
+        srv.drops = {}
+        srv.requests = []
+        srv.lock = threading.Lock()
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+        servers.append(srv)
+        return f"http://127.0.0.1:{srv.server_address[1]}/stage3.tar.xz", srv
+
+    yield start
+    for srv in servers:
+        srv.shutdown()
+        srv.server_close()
@@ -0,0 +1,168 @@
+"""
+binpkg: the make.conf/binrepos.conf the setup commands write (run in a
+scratch directory instead of the chroot) and the emerge.log report.
+"""
+
+# ——— Standard library ———
+import shlex
+import subprocess
+
+import pytest
+
+# ——— Local modules ———
+import binpkg
+from binpkg import (ACCELERATED_PACKAGES, OFFICIAL_ENV, accelerated_command,
+                    load_times, package_name, read_merges, report, save_times,
+                    setup_command)
+
+EMERGE_LOG = """\
+1700000000: Started emerge on: Nov 14, 2023 22:13:20
+1700000000:  *** emerge --update --deep --newuse @world
+1700000010:  >>> emerge (1 of 3) sys-libs/zlib-1.3-r1 to /
+1700000010:  === (1 of 3) Cleaning (sys-libs/zlib-1.3-r1::/var/db/repos/gentoo/sys-libs/zlib/zlib-1.3-r1.ebuild)
+1700000011:  === (1 of 3) Compiling/Merging (sys-libs/zlib-1.3-r1::/var/db/repos/gentoo/sys-libs/zlib/zlib-1.3-r1.ebuild)
+1700000070:  === (1 of 3) Merging (sys-libs/zlib-1.3-r1::/var/db/repos/gentoo/sys-libs/zlib/zlib-1.3-r1.ebuild)
+1700000072:  >>> AUTOCLEAN: sys-libs/zlib:0
+1700000075:  ::: completed emerge (1 of 3) sys-libs/zlib-1.3-r1 to /
+1700000080:  >>> emerge (2 of 3) www-client/firefox-128.0.3 to /
+1700000080:  === (2 of 3) Cleaning (www-client/firefox-128.0.3::/var/cache/binpkgs/www-client/firefox/firefox-128.0.3-1.gpkg.tar)
+1700000081:  === (2 of 3) Merging Binary (www-client/firefox-128.0.3::/var/cache/binpkgs/www-client/firefox/firefox-128.0.3-1.gpkg.tar)
+1700000140:  ::: completed emerge (2 of 3) www-client/firefox-128.0.3 to /
+1700000150:  >>> emerge (3 of 3) dev-lang/rust-1.79.0 to /
+1700000151:  === (3 of 3) Merging Binary (dev-lang/rust-1.79.0::/var/cache/binpkgs/dev-lang/rust/rust-1.79.0-1.gpkg.tar)
+1700000200:  ::: completed emerge (3 of 3) dev-lang/rust-1.79.0 to /
+1700000201:  *** exiting successfully.
+"""
+
+
+@pytest.fixture
+def emerge_log(tmp_path):
+    path = tmp_path / "emerge.log"
+    path.write_text(EMERGE_LOG)
+    return str(path)
+
+
+@pytest.fixture
+def target(tmp_path):
+    """Scratch stand-in for the chroot: etc/portage with a make.conf."""
+    root = tmp_path / "target"
+    (root / "etc/portage").mkdir(parents=True)
+    (root / "etc/portage/make.conf").write_text('COMMON_FLAGS="-O2 -pipe"\n')
+    return root
+
+
+def run_in(root, cmd):
+    """Run a setup command with / rewritten to *root*; return make.conf vars."""
+    cmd = (cmd.replace("/etc/portage", f"{root}/etc/portage")
+              .replace(f"mkdir -p {binpkg.PKGDIR}", f"mkdir -p {root}{binpkg.PKGDIR}"))
+    subprocess.run(["bash", "-c", cmd], check=True)
+    out = subprocess.run(
+        ["bash", "-c", f"FEATURES=; EMERGE_DEFAULT_OPTS=; "
+                       f". {shlex.quote(str(root))}/etc/portage/make.conf; "
+                       "echo \"$FEATURES\"; echo \"$EMERGE_DEFAULT_OPTS\"; echo \"$PKGDIR\""],
+        check=True, capture_output=True, text=True,
+    ).stdout.splitlines()
+    return out[0].split(), shlex.split(out[1]), out[2]
+
+
+def binrepos(root, name):
+    path = root / "etc/portage/binrepos.conf" / f"{name}.conf"
+    return dict(line.split(" = ", 1) for line in path.read_text().splitlines()[1:])
+
+
+@pytest.fixture(autouse=True)
+def no_official_override(monkeypatch):
+    monkeypatch.delenv(OFFICIAL_ENV, raising=False)
+
+
+def test_off_mode_writes_nothing():
+    assert setup_command("off", "/srv/binpkgs") == ""
+    assert setup_command("use", None) == ""
+
+
+def test_use_with_binhost_url(target):
+    features, opts, pkgdir = run_in(target, setup_command("use", "http://10.0.0.2:8000"))
+    assert features == ["getbinpkg"]
+    assert opts == ["--binpkg-respect-use=y", "--binpkg-changed-deps=y"]
+    assert pkgdir == binpkg.PKGDIR
+    conf = binrepos(target, binpkg.REPO_NAME)
+    assert conf["sync-uri"] == "http://10.0.0.2:8000"
+    assert conf["verify-signature"] == "false"
+
+
+def test_build_with_directory(target):
+    features, opts, _pkgdir = run_in(target, setup_command("build", "/srv/binpkgs"))
+    assert features == ["-binpkg-request-signature", "buildpkg"]
+    assert "--usepkg" in opts
+    assert not (target / "etc/portage/binrepos.conf").exists()
+
+
+def test_accelerated_official_binhost(target):
+    url = binpkg.official_source("x86-64-v3")
+    cmd = accelerated_command(url)
+    assert cmd.startswith("{ command -v getuto")
+    # getuto is not here – run only the part after the keyring setup
+    features, opts, _pkgdir = run_in(target, cmd.split("getuto && ", 1)[1])
+    assert features == ["getbinpkg"]
+    include = [o for o in opts if o.startswith("--usepkg-include=")]
+    assert include == [f"--usepkg-include={' '.join(ACCELERATED_PACKAGES)}"]
+    assert "--usepkg" not in opts
+    conf = binrepos(target, binpkg.OFFICIAL_REPO)
+    assert conf["sync-uri"].endswith("/x86-64-v3")
+    assert conf["verify-signature"] == "true"
+    assert conf["priority"] == "1"
+
+
+def test_accelerated_mirror_override_is_not_verified(target, monkeypatch):
+    monkeypatch.setenv(OFFICIAL_ENV, "http://mirror.lan/binpackages/x86-64")
+    cmd = accelerated_command(binpkg.official_source("x86-64"))
+    assert "getuto" not in cmd
+    run_in(target, cmd)
+    conf = binrepos(target, binpkg.OFFICIAL_REPO)
+    assert conf["sync-uri"] == "http://mirror.lan/binpackages/x86-64"
+    assert conf["verify-signature"] == "false"
+
+
+def test_accelerated_local_directory_stand_in(target, monkeypatch):
+    monkeypatch.setenv(OFFICIAL_ENV, "/srv/official-binpkgs")
+    src = binpkg.official_source("x86-64-v3")
+    assert src == "/srv/official-binpkgs"
+    features, opts, pkgdir = run_in(target, accelerated_command(src))
+    assert features == ["-binpkg-request-signature"]
+    assert "--usepkg" in opts
+    assert f"--usepkg-include={' '.join(ACCELERATED_PACKAGES)}" in opts
+    assert pkgdir == binpkg.PKGDIR
+    assert not (target / "etc/portage/binrepos.conf").exists()
+
+
+def test_package_name_strips_version():
+    assert package_name("sys-libs/zlib-1.3-r1") == "sys-libs/zlib"
+    assert package_name("dev-lang/python-3.12.4_p1") == "dev-lang/python"
+    assert package_name("www-client/firefox-128.0.3") == "www-client/firefox"
+
+
+def test_read_merges(emerge_log):
+    assert read_merges(emerge_log) == [
+        ("sys-libs/zlib-1.3-r1", False, 65),
+        ("www-client/firefox-128.0.3", True, 60),
+        ("dev-lang/rust-1.79.0", True, 50),
+    ]
+    assert [cpv for cpv, _b, _s in read_merges(emerge_log, since=1700000100)] == [
+        "dev-lang/rust-1.79.0"]
+    assert read_merges(emerge_log + ".missing") == []
+
+
+def test_report_counts_avoided_build_time(emerge_log):
+    merges = read_merges(emerge_log)
+    # exact cpv first, then the package name (another version built earlier)
+    times = {"www-client/firefox-128.0.3": 3600, "dev-lang/rust": 1800}
+    assert report(merges, times) == (2, 3, 5400)
+    assert report(merges, {}) == (2, 3, 0)
+
+
+def test_save_and_load_times_keep_source_builds_only(emerge_log, tmp_path):
+    save_times(str(tmp_path), read_merges(emerge_log))
+    assert load_times(str(tmp_path)) == {
+        "sys-libs/zlib-1.3-r1": 65,
+        "sys-libs/zlib": 65,
+    }
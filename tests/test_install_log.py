@@ -0,0 +1,119 @@
+"""
+InstallLog: per-step gzip members of overlapping steps, the index that
+locates them and what is on disk before close() (a crashed run).
+"""
+
+# ——— Standard library ———
+import gzip
+import json
+import time
+
+import pytest
+
+# ——— Local modules ———
+import install_log
+from install_log import InstallLog, load_index, read_step
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_sequential_steps(tmp_path):
+    log = InstallLog(str(tmp_path))
+    a = log.begin_step("a", "echo a")
+    log.write(["\x1b[32mone\x1b[0m", "two"], a)
+    log.end_step(0, a)
+    b = log.begin_step("b", "false")
+    log.write(["three"], b)
+    log.end_step(1, b)
+    log.close()
+
+    steps = load_index(log.path)
+    assert [(s["label"], s["cmd"], s["rc"], s["lines"]) for s in steps] == [
+        ("a", "echo a", 0, 2), ("b", "false", 1, 1)]
+    assert read_step(log.path, steps[0]) == "one\ntwo\n"
+    assert read_step(log.path, steps[1]) == "three\n"
+    with gzip.open(log.path, "rt") as f:
+        assert f.read() == "one\ntwo\nthree\n"
+
+
+def test_overlapping_steps_interleave(tmp_path, monkeypatch):
+    monkeypatch.setattr(install_log, "MEMBER_BYTES", 16)
+    log = InstallLog(str(tmp_path))
+    bg = log.begin_step("prefetch")
+    fg = log.begin_step("kernel")
+    expected = {"prefetch": "", "kernel": ""}
+    for n in range(20):
+        for key, label in ((bg, "prefetch"), (fg, "kernel")):
+            line = f"{label} line {n:02d}"
+            log.write([line], key)
+            expected[label] += line + "\n"
+    log.end_step(0, fg)
+    log.end_step(0, bg)
+    log.close()
+
+    steps = {s["label"]: s for s in load_index(log.path)}
+    assert len(steps["prefetch"]["ranges"]) > 1
+    assert len(steps["kernel"]["ranges"]) > 1
+    for label, text in expected.items():
+        assert read_step(log.path, steps[label]) == text
+    with gzip.open(log.path, "rt") as f:
+        whole = f.read()
+    assert sorted(whole.splitlines()) == sorted("".join(expected.values()).splitlines())
+
+
+def test_output_reaches_disk_before_the_step_ends(tmp_path, monkeypatch):
+    monkeypatch.setattr(install_log, "MEMBER_SECONDS", 0.1)
+    log = InstallLog(str(tmp_path))
+    bg = log.begin_step("prefetch")
+    fg = log.begin_step("kernel")
+    log.write(["fetching"], bg)
+    log.write(["make bzImage"], fg)
+    try:
+        # nothing ended – as after a crash, the index and file already hold both
+        def both_written():
+            try:
+                with open(log.index_path, encoding="utf-8") as f:
+                    steps = json.load(f)["steps"]
+            except (OSError, ValueError):
+                return False
+            return len(steps) == 2 and all(s["ranges"] for s in steps)
+        assert wait_for(both_written)
+        steps = {s["label"]: s for s in load_index(log.path)}
+        assert steps["kernel"]["rc"] is None
+        assert read_step(log.path, steps["kernel"]) == "make bzImage\n"
+        assert read_step(log.path, steps["prefetch"]) == "fetching\n"
+    finally:
+        log.close()
+
+
+def test_unfinished_steps_are_closed_without_rc(tmp_path):
+    log = InstallLog(str(tmp_path))
+    key = log.begin_step("world")
+    log.write(["emerging"], key)
+    log.close()
+    (step,) = load_index(log.path)
+    assert step["rc"] is None
+    assert read_step(log.path, step) == "emerging\n"
+
+
+@pytest.mark.parametrize("argv, printed", [
+    (["--failed"], ["===== b (rc=1) =====", "three", "===== c (rc=None) =====", "four"]),
+    (["--step", "1"], ["===== a (rc=0) =====", "one"]),
+])
+def test_main_prints_failed_and_unfinished(tmp_path, capsys, argv, printed):
+    log = InstallLog(str(tmp_path))
+    for label, text, rc in (("a", "one", 0), ("b", "three", 1), ("c", "four", None)):
+        key = log.begin_step(label)
+        log.write([text], key)
+        if rc is not None:
+            log.end_step(rc, key)
+    log.close()
+    install_log.main([log.path] + argv)
+    assert capsys.readouterr().out.splitlines() == printed
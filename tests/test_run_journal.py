@@ -0,0 +1,110 @@
+"""
+RunJournal: which steps a resumed run skips – completed steps, minus
+always-steps and steps dirtied by a re-run step sharing a resource.
+"""
+
+# ——— Local modules ———
+from run_journal import RunJournal, step_keys
+from step_graph import Step, run_steps
+
+
+def install(journal, steps):
+    """Bind *steps* and run the ones not done, like the wizard does."""
+    journal.bind(steps)
+    ran = []
+
+    def run(i, step):
+        if journal.is_done(i):
+            return 0
+        ran.append(step.label)
+        journal.record(i, step, 0, 0.0)
+        return 0
+
+    run_steps(steps, run, max_parallel=1)     # list order, easy to assert
+    return ran
+
+
+def steps_with(makeconf="COMMON_FLAGS=-O2"):
+    return [
+        Step("mount", "mount --rbind /dev /mnt/gentoo/dev", resources=(), always=True),
+        Step("make.conf", f"echo {makeconf} >/etc/portage/make.conf",
+             resources={"make.conf"}),
+        Step("ccache", "echo FEATURES=ccache >>/etc/portage/make.conf",
+             resources={"make.conf"}),
+        Step("locale", "locale-gen", resources={"locale"}),
+        Step("hostname", "echo gentoo >/etc/hostname", resources={"hostname"}),
+    ]
+
+
+def test_step_keys_number_repeated_commands():
+    keys = step_keys([Step("a", "true"), Step("b", "false"), Step("c", "true")])
+    assert keys[0].endswith(":1") and keys[2].endswith(":2")
+    assert keys[0].split(":")[0] == keys[2].split(":")[0] != keys[1].split(":")[0]
+
+
+def test_fresh_journal_runs_everything(tmp_path):
+    journal = RunJournal(str(tmp_path / "journal.json"))
+    assert install(journal, steps_with()) == [
+        "mount", "make.conf", "ccache", "locale", "hostname"]
+
+
+def test_resume_skips_completed_but_not_always_steps(tmp_path):
+    path = str(tmp_path / "journal.json")
+    install(RunJournal(path), steps_with())
+    journal = RunJournal(path)              # fresh process, same journal file
+    assert journal.bind(steps_with()) == 4
+    assert install(journal, steps_with()) == ["mount"]
+
+
+def test_resume_after_interruption_continues_at_first_missing_step(tmp_path):
+    path = str(tmp_path / "journal.json")
+    install(RunJournal(path), steps_with()[:3])
+    assert install(RunJournal(path), steps_with()) == ["mount", "locale", "hostname"]
+
+
+def test_changed_step_dirties_later_steps_on_the_same_resource(tmp_path):
+    path = str(tmp_path / "journal.json")
+    install(RunJournal(path), steps_with())
+    ran = install(RunJournal(path), steps_with("COMMON_FLAGS=-O3"))
+    # make.conf is rewritten, so the ccache line appended to it goes again;
+    # locale/hostname do not touch make.conf and stay skipped
+    assert ran == ["mount", "make.conf", "ccache"]
+
+
+def test_always_steps_do_not_dirty_their_resources(tmp_path):
+    path = str(tmp_path / "journal.json")
+    steps = [
+        Step("bind", "mount --bind /var/cache/ccache x", resources={"make.conf"},
+             always=True),
+        Step("ccache", "echo FEATURES=ccache >>/etc/portage/make.conf",
+             resources={"make.conf"}),
+    ]
+    install(RunJournal(path), steps)
+    assert install(RunJournal(path), steps) == ["bind"]
+
+
+def test_failed_steps_are_not_recorded(tmp_path):
+    path = str(tmp_path / "journal.json")
+    steps = steps_with()
+    journal = RunJournal(path)
+    journal.bind(steps)
+    journal.record(3, steps[3], 1, 1.0)
+    journal.record(4, steps[4], 0, 1.0)
+    journal = RunJournal(path)
+    journal.bind(steps)
+    assert [journal.is_done(i) for i in range(len(steps))] == [
+        False, False, False, False, True]
+
+
+def test_reset_forgets_everything(tmp_path):
+    path = str(tmp_path / "journal.json")
+    journal = RunJournal(path)
+    install(journal, steps_with())
+    journal.reset()
+    assert RunJournal(path).bind(steps_with()) == 0
+
+
+def test_unreadable_journal_starts_empty(tmp_path):
+    path = tmp_path / "journal.json"
+    path.write_text("{not json")
+    assert RunJournal(str(path)).bind(steps_with()) == 0
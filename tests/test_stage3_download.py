@@ -0,0 +1,163 @@
+"""
+RangedDownloader + StreamHasher against a local http.server stand-in
+(tests/conftest.py) that honours – or ignores – ``Range``.
+"""
+
+# ——— Standard library ———
+import hashlib
+import os
+
+import pytest
+
+# ——— Local modules ———
+import stage3_download
+from stage3_download import DownloadError, RangedDownloader, part_paths
+from stage3_verify import StreamHasher, VerifyError, parse_digests, verify
+
+SIZE = 2 * 1024 * 1024
+SEGMENT = 256 * 1024
+
+
+@pytest.fixture(scope="module")
+def payload():
+    return os.urandom(SIZE)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    # segment retries sleep 1 s, 2 s… – not needed against localhost
+    monkeypatch.setattr(stage3_download.time, "sleep", lambda _s: None)
+
+
+def digests_text(data, name="stage3.tar.xz"):
+    return "\n".join([
+        "# SHA512 HASH",
+        f"{hashlib.sha512(data).hexdigest()}  {name}",
+        "# BLAKE2B HASH",
+        f"{hashlib.blake2b(data).hexdigest()}  {name}",
+    ])
+
+
+def download(url, dest, **kwargs):
+    hasher = StreamHasher()
+    done = RangedDownloader(url, dest, segment_size=SEGMENT, hasher=hasher, **kwargs).run()
+    return done, hasher
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_ranged_download(http_server, payload, tmp_path):
+    url, srv = http_server(payload)
+    dest = str(tmp_path / "stage3.tar.xz")
+
+    done, hasher = download(url, dest, connections=4)
+
+    assert done == SIZE
+    assert read(dest) == payload
+    assert not any(os.path.exists(p) for p in part_paths(dest))
+    # probe + one request per segment
+    assert sum(1 for r in srv.requests if r and r != "bytes=0-0") == SIZE // SEGMENT
+    assert hasher.hashed_bytes == SIZE
+    verify(hasher, parse_digests(digests_text(payload), "stage3.tar.xz"))
+
+
+def test_server_without_range_falls_back_to_one_stream(http_server, payload, tmp_path):
+    url, srv = http_server(payload, ranges=False)
+    dest = str(tmp_path / "stage3.tar.xz")
+
+    done, hasher = download(url, dest)
+
+    assert done == SIZE
+    assert read(dest) == payload
+    assert len(srv.requests) == 2           # probe + the single stream
+    verify(hasher, parse_digests(digests_text(payload), "stage3.tar.xz"))
+
+
+def test_dropped_segment_is_retried_and_hashed(http_server, payload, tmp_path):
+    url, srv = http_server(payload)
+    srv.drops[0] = [100000, 1]              # first try of segment 0 breaks mid-way
+    dest = str(tmp_path / "stage3.tar.xz")
+
+    done, hasher = download(url, dest, connections=4)
+
+    assert done == SIZE
+    assert read(dest) == payload
+    assert srv.requests.count(f"bytes=0-{SEGMENT - 1}") == 2
+    assert hasher.hashed_bytes == SIZE
+    verify(hasher, parse_digests(digests_text(payload), "stage3.tar.xz"))
+
+
+def test_interrupted_download_resumes_from_journal(http_server, payload, tmp_path):
+    url, srv = http_server(payload)
+    failing = 5 * SEGMENT
+    srv.drops[failing] = [1000, stage3_download.SEGMENT_RETRIES]
+    dest = str(tmp_path / "stage3.tar.xz")
+    part, journal = part_paths(dest)
+
+    with pytest.raises(DownloadError):
+        download(url, dest, connections=1)
+    assert os.path.exists(part) and os.path.exists(journal)
+    assert not os.path.exists(dest)
+
+    srv.requests.clear()
+    done, hasher = download(url, dest, connections=2)
+
+    assert done == SIZE
+    assert read(dest) == payload
+    fetched = {r for r in srv.requests if r and r != "bytes=0-0"}
+    # segments finished before the failure are taken from the .part file
+    assert all(int(r[len("bytes="):].partition("-")[0]) >= failing for r in fetched)
+    assert hasher.hashed_bytes == SIZE
+    verify(hasher, parse_digests(digests_text(payload), "stage3.tar.xz"))
+
+
+def test_changed_etag_discards_the_journal(http_server, payload, tmp_path):
+    url, srv = http_server(payload)
+    srv.drops[3 * SEGMENT] = [1000, stage3_download.SEGMENT_RETRIES]
+    dest = str(tmp_path / "stage3.tar.xz")
+    with pytest.raises(DownloadError):
+        download(url, dest, connections=1)
+
+    srv.etag = '"v2"'                       # new tarball under the same name
+    srv.requests.clear()
+    done, hasher = download(url, dest)
+
+    assert read(dest) == payload
+    assert f"bytes=0-{SEGMENT - 1}" in srv.requests
+    verify(hasher, parse_digests(digests_text(payload), "stage3.tar.xz"))
+
+
+def test_digest_mismatch_is_reported(payload):
+    hasher = StreamHasher()
+    hasher.update(payload)
+    expected = parse_digests(digests_text(payload[:-1] + bytes([payload[-1] ^ 1])), "stage3.tar.xz")
+    with pytest.raises(VerifyError):
+        verify(hasher, expected)
+
+
+def test_digests_without_usable_entry(payload):
+    hasher = StreamHasher()
+    hasher.update(payload)
+    with pytest.raises(VerifyError):
+        verify(hasher, parse_digests(digests_text(payload), "other.tar.xz"))
+
+
+@pytest.mark.parametrize("max_buffer", [stage3_download.SEGMENT_SIZE * 8, SEGMENT])
+def test_hasher_accepts_retried_chunks_across_the_frontier(payload, tmp_path, max_buffer):
+    path = tmp_path / "stage3.tar.xz"
+    path.write_bytes(payload)
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        hasher = StreamHasher(max_buffer=max_buffer)
+        hasher.attach(fd)                                   # spilled chunks are pread()
+        hasher.update_at(0, payload[:100000])
+        hasher.update_at(SEGMENT, payload[SEGMENT:])        # later segments arrive first
+        for offset in range(0, SEGMENT, 65536):             # segment 0 again, other chunking
+            hasher.update_at(offset, payload[offset:offset + 65536])
+    finally:
+        os.close(fd)
+    assert hasher.hashed_bytes == SIZE
+    assert hasher.hexdigests()["sha512"] == hashlib.sha512(payload).hexdigest()
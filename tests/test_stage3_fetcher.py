@@ -0,0 +1,63 @@
+"""
+Stage3Fetcher.stream(): download-and-extract into the target root, and
+what is left there when the digest does not match.
+"""
+
+# ——— Standard library ———
+import hashlib
+import io
+import tarfile
+
+import pytest
+
+# ——— Local modules ———
+from http_transport import UrllibTransport
+from stage3_fetcher import Stage3Fetcher, Stage3Variant
+from stage3_verify import VerifyError
+
+
+@pytest.fixture(scope="module")
+def stage3():
+    """A tiny .tar.xz laid out like a Stage3."""
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:xz") as tar:
+        for name, data in (("etc/portage/make.conf", b'COMMON_FLAGS="-O2"\n'),
+                           ("bin/true", b"\x7fELF"),
+                           ("boot/.keep", b"")):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+def fetcher_for(url, expected):
+    fetcher = Stage3Fetcher(Stage3Variant(), ["http://unused.invalid/"],
+                            transport=UrllibTransport())
+    fetcher._url, fetcher._expected = url, expected       # skip manifest/DIGESTS
+    return fetcher
+
+
+@pytest.fixture
+def target(tmp_path):
+    root = tmp_path / "gentoo"
+    (root / "boot").mkdir(parents=True)            # mount point of the ESP
+    (root / "lost+found").mkdir()
+    return root
+
+
+def test_stream_extracts_and_verifies(http_server, stage3, target):
+    url, _srv = http_server(stage3)
+    fetcher = fetcher_for(url, {"sha512": hashlib.sha512(stage3).hexdigest()})
+    stats = fetcher.stream(str(target))
+    assert stats.bytes == len(stage3)
+    assert (target / "etc/portage/make.conf").read_bytes() == b'COMMON_FLAGS="-O2"\n'
+    assert (target / "bin/true").exists()
+
+
+def test_digest_mismatch_removes_the_extracted_tree(http_server, stage3, target):
+    url, _srv = http_server(stage3)
+    fetcher = fetcher_for(url, {"sha512": "0" * 128})
+    with pytest.raises(VerifyError):
+        fetcher.stream(str(target))
+    # only what was there before is left; boot/ (pre-existing) stays
+    assert sorted(p.name for p in target.iterdir()) == ["boot", "lost+found"]
@@ -0,0 +1,273 @@
+"""
+step_graph: dependency edges between install steps, the order in which
+run_steps() starts them and the failure policies, with fake run
+callables instead of chroot.
+"""
+
+# ——— Standard library ———
+import subprocess
+import threading
+
+import pytest
+
+# ——— Local modules ———
+import step_graph
+from step_graph import (ABORT, CONTINUE, Step, StepFailed, append_block,
+                        dependencies, heavy_commands, is_heavy, retry, run_steps)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    # retry() waits 30 s, 60 s… between attempts – record instead of sleeping
+    slept = []
+    monkeypatch.setattr(step_graph.time, "sleep", slept.append)
+    return slept
+
+
+def recorder():
+    """run callable that records (event, index) and always succeeds."""
+    log = []
+    lock = threading.Lock()
+
+    def run(i, step):
+        with lock:
+            log.append(("start", i))
+        with lock:
+            log.append(("end", i))
+        return 0
+    return run, log
+
+
+def test_heavy_detection_ignores_arguments_and_heredocs():
+    assert is_heavy("emerge -uDN @world")
+    assert is_heavy("FEATURES='-sandbox' MAKEOPTS=\"-j4\" emerge foo")
+    assert is_heavy("mount /boot && genkernel all")
+    assert not is_heavy("echo emerge")
+    assert not is_heavy("cat <<'EOF' >/etc/portage/make.conf &&\nemerge\nEOF\ntrue")
+    assert heavy_commands("emerge sys-kernel/gentoo-sources && genkernel all") == {
+        "emerge", "genkernel"}
+
+
+def test_exclusive_steps_are_barriers():
+    steps = [
+        Step("a", "true", resources={"x"}),
+        Step("b", "true"),                      # exclusive
+        Step("c", "true", resources={"y"}),
+        Step("d", "true", resources={"z"}),
+    ]
+    assert dependencies(steps) == [set(), {0}, {1}, {1}]
+
+
+def test_shared_resources_serialise_disjoint_ones_do_not():
+    steps = [
+        Step("a", "true", resources={"make.conf"}),
+        Step("b", "true", resources={"locale"}),
+        Step("c", "true", resources={"make.conf", "locale"}),
+        Step("d", "true", resources=()),
+    ]
+    assert dependencies(steps) == [set(), set(), {0, 1}, set()]
+
+
+def test_heavy_step_keeps_resources_but_runs_alone():
+    step = Step("world", "emerge -uDN @world", resources={"portage"})
+    assert step.heavy and step.exclusive
+    assert step.resources == {"portage"}
+    after = Step("hostname", "true", resources={"hostname"})
+    assert dependencies([step, after]) == [set(), {0}]
+
+
+def test_nothing_waits_for_a_background_step():
+    steps = [
+        Step("sync", "true"),
+        Step("prefetch", "true", background=True),
+        Step("world", "emerge -uDN @world"),
+    ]
+    assert dependencies(steps) == [set(), {0}, {0}]
+
+
+def test_run_steps_respects_dependencies():
+    steps = [
+        Step("a", "true", resources={"x"}),
+        Step("b", "true", resources={"y"}),
+        Step("c", "true"),
+        Step("d", "true", resources={"x"}),
+    ]
+    run, log = recorder()
+    assert run_steps(steps, run, max_parallel=2) == [0, 0, 0, 0]
+    order = [i for event, i in log if event == "start"]
+    ends = [i for event, i in log if event == "end"]
+    assert sorted(order) == [0, 1, 2, 3]
+    # c waits for a and b, d waits for c
+    assert order.index(2) > ends.index(0) and order.index(2) > ends.index(1)
+    assert order.index(3) > ends.index(2)
+
+
+def test_run_steps_runs_independent_steps_concurrently():
+    both = threading.Barrier(2, timeout=5)
+
+    def run(i, step):
+        both.wait()             # deadlocks (BrokenBarrierError) if serialised
+        return 0
+
+    steps = [Step("a", "true", resources={"x"}), Step("b", "true", resources={"y"})]
+    assert run_steps(steps, run, max_parallel=2) == [0, 0]
+
+
+def test_run_steps_accepts_plain_tuples():
+    run, log = recorder()
+    assert run_steps([("a", "true"), ("b", "true")], run) == [0, 0]
+    assert log == [("start", 0), ("end", 0), ("start", 1), ("end", 1)]
+
+
+def scripted(results):
+    """run callable returning the next exit status from results[i] per call."""
+    calls = []
+    lock = threading.Lock()
+
+    def run(i, step):
+        with lock:
+            calls.append(i)
+            return results[i].pop(0) if isinstance(results[i], list) else results[i]
+    return run, calls
+
+
+def test_continue_failure_does_not_stop_the_run():
+    steps = [Step("a", "true", policy=CONTINUE), Step("b", "true")]
+    run, calls = scripted({0: 1, 1: 0})
+    assert run_steps(steps, run) == [1, 0]
+    assert calls == [0, 1]
+
+
+def test_abort_failure_raises_and_skips_later_steps():
+    steps = [Step("a", "true"), Step("b", "true", policy=ABORT), Step("c", "true")]
+    run, calls = scripted({0: 0, 1: 2, 2: 0})
+    with pytest.raises(StepFailed) as exc:
+        run_steps(steps, run)
+    assert (exc.value.index, exc.value.rc) == (1, 2)
+    assert exc.value.step.label == "b"
+    assert calls == [0, 1]
+
+
+def test_abort_waits_for_steps_already_running():
+    release = threading.Event()
+    ran = []
+
+    def run(i, step):
+        if i == 0:
+            release.wait(5)
+            ran.append(i)
+            return 0
+        release.set()
+        return 1
+
+    steps = [Step("a", "true", resources={"x"}),
+             Step("b", "true", resources={"y"}, policy=ABORT)]
+    with pytest.raises(StepFailed):
+        run_steps(steps, run, max_parallel=2)
+    assert ran == [0]
+
+
+def test_retry_backs_off_until_success(no_backoff):
+    steps = [Step("sync", "true", policy=retry(retries=3, delay=10))]
+    run, calls = scripted({0: [1, 1, 0]})
+    retries = []
+    assert run_steps(steps, run, on_retry=lambda *a: retries.append(a[2:])) == [0]
+    assert calls == [0, 0, 0]
+    assert no_backoff == [10, 20]
+    assert retries == [(1, 10), (2, 20)]
+
+
+def test_retry_then_abort_after_last_attempt(no_backoff):
+    steps = [Step("sync", "true", policy=retry(retries=2, delay=1)), Step("b", "true")]
+    run, calls = scripted({0: 1, 1: 0})
+    with pytest.raises(StepFailed):
+        run_steps(steps, run)
+    assert calls == [0, 0, 0]
+    assert no_backoff == [1, 2]
+
+
+def test_retry_then_continue():
+    steps = [Step("fetch", "true", policy=retry(retries=1, delay=1, then="continue")),
+             Step("b", "true")]
+    run, calls = scripted({0: 1, 1: 0})
+    assert run_steps(steps, run) == [1, 0]
+    assert calls == [0, 0, 1]
+
+
+def test_network_commands_default_to_retry():
+    assert Step("sync", "emerge --sync").policy == retry()
+    assert Step("prefetch", "emerge --fetchonly @world").policy == retry()
+    assert Step("locale", "locale-gen").policy == CONTINUE
+
+
+def test_background_step_runs_beside_later_steps():
+    started = threading.Event()
+    finish = threading.Event()
+
+    def run(i, step):
+        if step.background:
+            started.set()
+            finish.wait(5)
+            return 0
+        assert started.wait(5)
+        if i == 2:
+            finish.set()
+        return 0
+
+    steps = [Step("prefetch", "true", background=True),
+             Step("a", "true"), Step("b", "true")]
+    assert run_steps(steps, run, max_parallel=2) == [0, 0, 0]
+
+
+def test_abort_stops_and_waits_for_background_steps():
+    finish = threading.Event()
+    aborted = []
+    stopped = []
+
+    def run(i, step):
+        if step.background:
+            stopped.append(finish.wait(5))
+        return 1
+
+    def on_abort():
+        aborted.append(True)
+        finish.set()
+
+    steps = [Step("prefetch", "true", background=True, policy=retry()),
+             Step("world", "true", policy=ABORT)]
+    with pytest.raises(StepFailed) as exc:
+        run_steps(steps, run, max_parallel=2, on_abort=on_abort)
+    assert exc.value.index == 1
+    assert aborted == [True]
+    # the background step was stopped (not left running) and not retried
+    assert stopped == [True]
+
+
+def test_no_abort_callback_on_success():
+    aborted = []
+    run, _calls = scripted({0: 0, 1: 0})
+    steps = [Step("prefetch", "true", background=True), Step("a", "true")]
+    assert run_steps(steps, run, on_abort=lambda: aborted.append(True)) == [0, 0]
+    assert aborted == []
+
+
+def test_append_block_replaces_the_block_of_an_earlier_run(tmp_path):
+    path = tmp_path / "sudoers"
+    path.write_text("root ALL=(ALL:ALL) ALL\n")
+    for user in ("jan", "jan", "ola"):
+        cmd = append_block(str(path), f"{user} ALL=(ALL:ALL) ALL", "sudoers")
+        assert not is_heavy(cmd)
+        subprocess.run(["bash", "-c", cmd], check=True)
+    assert path.read_text() == (
+        "root ALL=(ALL:ALL) ALL\n"
+        "# BEGIN gentoo-helper sudoers\n"
+        "ola ALL=(ALL:ALL) ALL\n"
+        "# END gentoo-helper sudoers\n"
+    )
+
+
+def test_append_block_creates_a_missing_file(tmp_path):
+    path = tmp_path / "genkernel.conf"
+    cmd = append_block(str(path), 'MAKEOPTS="$(portageq envvar MAKEOPTS)"', "microcode")
+    subprocess.run(["bash", "-c", cmd], check=True)
+    assert 'MAKEOPTS="$(portageq envvar MAKEOPTS)"' in path.read_text()
@@ -10,14 +10,28 @@ import locale
 import atexit
 import shutil
 import threading
+import time
 import subprocess
-import multiprocessing
+import traceback
 from pathlib import Path
 from datetime import datetime
 import re
-import pty
 import gi
+import binpkg
+import ccache_setup
 from disk_utils import list_disks, list_partitions
+from emerge_parser import EmergeTracker, strip_ansi
+from hw_tuning import detect as detect_hardware
+from install_log import InstallLog
+from log_view import RingLogView
+from mirrors import MAKECONF_MIRRORS, rank_mirrors
+from progress_dispatch import ProgressDispatcher
+from run_journal import RunJournal
+from pty_reader import read_batches, spawn as spawn_pty
+from stage3_cache import Stage3Cache
+from step_graph import StepFailed, as_step, heavy_commands, run_steps
+from stage3_extract import extract_tarball
+from stage3_fetcher import Stage3Fetcher, Stage3Variant
 import shutil
 gi.require_version("Gtk", "3.0")
 from gi.repository import Gtk, Gdk, GdkPixbuf, GLib, Pango
@@ -142,6 +156,8 @@ class SetupWizardWindow(Gtk.Window):
     def __init__(self):
         self.timer_running = False
         self.verbose_gui = False
+        self.stage3_cache = Stage3Cache.from_env()
+        self._ui = ProgressDispatcher()
         self.DESKTOP_ENVS = {
             i18n.MESSAGES["env_none"]: {
                 "packages": "",
@@ -829,11 +845,17 @@ class SetupWizardWindow(Gtk.Window):
 
         btn_systemd = Gtk.Button(label="Pobierz Stage3 systemd")
         btn_systemd.connect("clicked", self._download_systemd)
+
+        # rozpakowywanie w locie – bez archiwum na dysku docelowym
+        cb_stream = Gtk.CheckButton(label=i18n.MESSAGES.get(
+            "chk_stream_stage3", "Extract while downloading (no tarball on disk)"))
+        cb_stream.set_active(getattr(self, "stream_stage3", False))
+        cb_stream.connect("toggled", lambda b: setattr(self, "stream_stage3", b.get_active()))
         ### ————————————————
 
         # pack widgets
         for w in (lbl, info,            # teksty
-                  btn_openrc, btn_systemd,  # nowe
+                  btn_openrc, btn_systemd, cb_stream,  # nowe
                   btn_start, btn_enter):    # stare
             self.step_box.pack_start(w, False, False, 0)
         self.step_box.show_all()
@@ -900,57 +922,21 @@ class SetupWizardWindow(Gtk.Window):
         proc = subprocess.Popen(cmd, cwd="/mnt/gentoo")
         GLib.child_watch_add(GLib.PRIORITY_DEFAULT, proc.pid, self._after_links)
 
-    # ---------- URL do najnowszego stage3-openrc ----------
-    def _latest_stage3_openrc_url(self):
-        """
-        Zwraca pełny URL do najświeższego archiwum Stage3-OpenRC (amd64-desktop).
+    def _ranked_mirrors(self):
+        """Mirrors ordered by measured latency; probed once per session."""
+        if getattr(self, "_mirror_ranking", None) is None:
+            self._mirror_ranking = rank_mirrors()
+            print("[info] mirrory:", " ".join(self._mirror_ranking))
+        return self._mirror_ranking
 
-        Plik latest-*.txt zawiera komentarze, rozmiary i podpis PGP – bierzemy
-        pierwszą nie-pustą linię, która NIE zaczyna się od '#', '-----' ani 'MD5',
-        a następnie pierwszy token przed spacją.
-        """
-        import urllib.request
-        base = "https://distfiles.gentoo.org/releases/amd64/autobuilds/"
-
-        txt = urllib.request.urlopen(
-            base + "latest-stage3-amd64-desktop-openrc.txt",
-            timeout=10
-        ).read().decode(errors="replace")
-
-        for raw in txt.splitlines():
-            line = raw.strip()
-            if (not line or line.startswith("#") or line.startswith("-----")
-                    or line.lower().startswith("md5")):
-                continue                    # pomiń komentarze / PGP / sumy
-            rel_path = line.split()[0]      # token przed spacją = ścieżka
-            if rel_path.endswith(".tar.xz"):
-                return base + rel_path
-
-        raise RuntimeError("Nie znalazłem ścieżki do Stage3 w latest-*.txt")
-
-    # ---------- URL do najnowszego stage3-systemd ----------
-    def _latest_stage3_systemd_url(self):
-        import urllib.request
-        base = "https://distfiles.gentoo.org/releases/amd64/autobuilds/"
-        txt = urllib.request.urlopen(
-            base + "latest-stage3-amd64-desktop-systemd.txt",
-            timeout=10
-        ).read().decode(errors="replace")
-
-        for raw in txt.splitlines():
-            line = raw.strip()
-            if (not line or line.startswith("#") or line.startswith("-----")
-                    or line.lower().startswith("md5")):
-                continue
-            rel_path = line.split()[0]
-            if rel_path.endswith(".tar.xz"):
-                return base + rel_path
-        raise RuntimeError("Nie znalazłem ścieżki do Stage3-systemd")
-
-    # ---------------- pobieranie Stage3 (OpenRC) ----------------
+    # ---------------- pobieranie Stage3 (OpenRC / systemd) ----------------
     def _download_openrc(self, _btn):
-        from pathlib import Path
-        import urllib.request, threading, os
+        self._download_stage3("openrc", "OpenRC")
+
+    def _download_systemd(self, _btn):
+        self._download_stage3("systemd", "systemd")
+
+    def _download_stage3(self, init, title):
         # 1) – upewnij się, że /mnt/gentoo jest podmontowane
         self._ensure_mounted(self.root_part, "/mnt/gentoo")
 
@@ -966,7 +952,7 @@ class SetupWizardWindow(Gtk.Window):
         # 4) – wyczyść panel i pokaż TYLKO pasek
         self.step_box.foreach(lambda w: self.step_box.remove(w))
 
-        lbl = Gtk.Label(label="Pobieranie Stage3 (OpenRC)…")
+        lbl = Gtk.Label(label=f"Pobieranie Stage3 ({title})…")
         lbl.get_style_context().add_class("h3")
         lbl.set_xalign(0)
 
@@ -980,101 +966,56 @@ class SetupWizardWindow(Gtk.Window):
             self.step_box.pack_start(w, False, False, 10)
         self.step_box.show_all()
 
-        # 5) – pobieranie w tle
-        url = self._latest_stage3_openrc_url()
-        dest = os.path.join("/mnt/gentoo", os.path.basename(url))
-
-        def worker():
-            try:
-                with urllib.request.urlopen(url) as r, open(dest, "wb") as f:
-                    total = int(r.getheader("Content-Length", "0") or 0)
-                    done  = 0
-                    blk   = 65536          # większy blok = mniej zrywań
-                    last_pct = -1
-
-                    while True:
-                        chunk = r.read(blk)
-                        if not chunk:
-                            break
-                        f.write(chunk)
-                        done += len(chunk)
-
-                        if total:
-                            pct = int(done * 100 / total)
-                            if pct > last_pct:          # tylko gdy rośnie
-                                last_pct = pct
-                                frac = pct / 100
-                                GLib.idle_add(self.progress_bar.set_fraction, frac)
-                                GLib.idle_add(self.progress_bar.set_text, f"{pct} %")
-                        else:
-                            GLib.idle_add(self.progress_bar.pulse)
-
-
-                # pobrane – przechodzimy do rozpakowywania
-                #GLib.idle_add(self.progress_label.set_text, "Rozpakowywanie…")
-                GLib.idle_add(self.progress_bar.set_text, i18n.MESSAGES["extracting_text"])
-                GLib.idle_add(self._extract_stage3, dest)
-
-            except Exception as e:
-                GLib.idle_add(self._error_dialog, f"Błąd pobierania:\n{e}")
-
-        threading.Thread(target=worker, daemon=True).start()
-
-    # ---------------- pobieranie Stage3 (systemd) ----------------
-    def _download_systemd(self, _btn):
-        from pathlib import Path
-        import urllib.request, threading, os
-        self._ensure_mounted(self.root_part, "/mnt/gentoo")
-
-        if Path("/mnt/gentoo/system.txt").exists():
-            return self._finish_stage3()
-
-        prev = self._find_stage3()
-        if prev:
-            return self._extract_stage3(prev)
-
-        self.step_box.foreach(lambda w: self.step_box.remove(w))
-
-        lbl = Gtk.Label(label="Pobieranie Stage3 (systemd)…")
-        lbl.get_style_context().add_class("h3")
-        lbl.set_xalign(0)
-
-        self.progress_bar.set_fraction(0)
-        self.progress_bar.set_show_text(True)
-        self.progress_bar.set_text("0 %")
-        self.progress_bar.show()
-
-        for w in (lbl, self.progress_label, self.progress_bar):
-            self.step_box.pack_start(w, False, False, 10)
-        self.step_box.show_all()
-
-        url  = self._latest_stage3_systemd_url()
-        dest = os.path.join("/mnt/gentoo", os.path.basename(url))
+        # 5) – pobieranie w tle (wybór mirrora też – sondowanie trwa chwilę)
+        threading.Thread(target=self._stage3_worker, args=(init,), daemon=True).start()
 
-        def worker():
-            try:
-                with urllib.request.urlopen(url) as r, open(dest, "wb") as f:
-                    total = int(r.getheader("Content-Length") or 0)
-                    done = 0; blk = 65536; last_pct = -1
-                    while True:
-                        chunk = r.read(blk)
-                        if not chunk:
-                            break
-                        f.write(chunk); done += len(chunk)
-                        if total:
-                            pct = int(done*100/total)
-                            if pct > last_pct:
-                                last_pct = pct
-                                GLib.idle_add(self.progress_bar.set_fraction, pct/100)
-                                GLib.idle_add(self.progress_bar.set_text, f"{pct} %")
-                        else:
-                            GLib.idle_add(self.progress_bar.pulse)
-                GLib.idle_add(self.progress_bar.set_text, i18n.MESSAGES["extracting_text"])
-                GLib.idle_add(self._extract_stage3, dest)
-            except Exception as e:
-                GLib.idle_add(self._error_dialog, f"Błąd pobierania:\n{e}")
+    def _stage3_worker(self, init):
+        """
+        Background part of _download_stage3: take the verified tarball from
+        the local cache or download it (or stream it straight into
+        /mnt/gentoo) and continue with _extract_stage3/_finish_stage3.
+        """
+        fetcher = None
+        try:
+            fetcher = Stage3Fetcher(
+                Stage3Variant(init), self._ranked_mirrors(),
+                cache=self.stage3_cache,
+                on_progress=lambda *a: self._ui.set(self, "_show_transfer_progress", *a)
+            )
+            cached = fetcher.cached()
+            if getattr(self, "stream_stage3", False) and not cached:
+                # tu nie da się sprawdzić sumy przed rozpakowaniem – przy
+                # błędzie stream() usuwa rozpakowane drzewo, a Stage3 nie
+                # jest oznaczany jako gotowy
+                fetcher.stream("/mnt/gentoo")
+                Path("/mnt/gentoo/system.txt").touch()
+                GLib.idle_add(self._finish_stage3)
+                return
+
+            tarball = cached or fetcher.fetch("/mnt/gentoo")
+
+            # pobrane i sprawdzone – przechodzimy do rozpakowywania
+            GLib.idle_add(self.progress_bar.set_text, i18n.MESSAGES["extracting_text"])
+            GLib.idle_add(self._extract_stage3, tarball)
 
-        threading.Thread(target=worker, daemon=True).start()
+        except Exception as e:
+            GLib.idle_add(self._error_dialog, f"Błąd pobierania:\n{e}")
+        finally:
+            if fetcher:
+                fetcher.close()
+
+    def _show_transfer_progress(self, done, total, rate, bar=None):
+        """Update a Stage3 bar (download/extract) with percentage and MB/s."""
+        bar = bar or self.progress_bar
+        speed = f"{rate / 1e6:.1f} MB/s"
+        if total:
+            pct = int(done * 100 / total)
+            bar.set_fraction(done / total)
+            bar.set_text(f"{pct} %  ·  {speed}")
+        else:
+            bar.pulse()
+            bar.set_text(speed)
+        return False
 
     def _after_links(self, _pid, _status):
         # Called after the links terminal closes; proceed if a stage3 tarball was found
@@ -1121,30 +1062,28 @@ class SetupWizardWindow(Gtk.Window):
         self.prog.set_show_text(True)             
         self.prog.set_fraction(0)
 
-        def pulse():
-            # pulse the progress bar to indicate ongoing extraction
-            self.prog.pulse()
-            return True
-
-        # zapamiętaj ID timera, by móc go potem zatrzymać
-        self._pulse_timer_id = GLib.timeout_add(150, pulse)
-
         def untar():
-            # extract the stage3 archive
-            subprocess.call(
-                ["tar", "xpf", tarball, "-C", "/mnt/gentoo"],
-                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-            )
-            # mark completion
-            Path("/mnt/gentoo/system.txt").touch()
-            # remove the archive to save space
+            # extract the stage3 archive – parallel xz, real byte progress
             try:
-                os.remove(tarball)
-            except OSError:
-                pass
+                stats = extract_tarball(
+                    tarball, "/mnt/gentoo",
+                    on_progress=lambda *a: self._ui.set(
+                        self, "_show_transfer_progress", *a, self.prog)
+                )
+            except Exception as e:
+                GLib.idle_add(self._error_dialog, f"Błąd rozpakowywania:\n{e}")
+                return
+            self.extract_mb_s = stats.mb_per_s
+            print(f"[info] Stage3 rozpakowany: {stats.mb_per_s:.1f} MB/s")
 
-            # zatrzymaj timer pulsowania paska
-            GLib.source_remove(self._pulse_timer_id)
+            # mark completion
+            Path("/mnt/gentoo/system.txt").touch()
+            # remove the archive to save space (the cached copy stays)
+            if not (self.stage3_cache and self.stage3_cache.contains(tarball)):
+                try:
+                    os.remove(tarball)
+                except OSError:
+                    pass
 
             # cleanup and advance
             GLib.idle_add(self.prog.destroy)
@@ -1477,6 +1416,11 @@ class SetupWizardWindow(Gtk.Window):
         lbl.get_style_context().add_class("h3")
         lbl.set_xalign(0)
 
+        # CPU / RAM / cgroup / gcc → MAKEOPTS, --jobs, -march (raz na sesję)
+        if getattr(self, "hw_profile", None) is None:
+            self.hw_profile = detect_hardware()
+        tuning = self.hw_profile
+
         # Input fields grid
         grid = Gtk.Grid(row_spacing=6, column_spacing=6)
                 # ▼ wybór locale (dla locale-gen + eselect locale)
@@ -1506,7 +1450,8 @@ class SetupWizardWindow(Gtk.Window):
         grid.attach(self.user_entry,            1, 1, 1, 1)
 
         grid.attach(Gtk.Label(label="march:"),  0, 2, 1, 1)
-        self.march_entry = Gtk.Entry(text="native")
+        self.march_entry = Gtk.Entry(
+            text=tuning.march if tuning.march in march_list else "native")
         compl_march = Gtk.EntryCompletion()
         store_m = Gtk.ListStore(str)
         for a in march_list:
@@ -1519,7 +1464,8 @@ class SetupWizardWindow(Gtk.Window):
         grid.attach(self.march_entry, 1, 2, 1, 1)
 
         grid.attach(Gtk.Label(label="mtune:"),  0, 3, 1, 1)
-        self.mtune_entry = Gtk.Entry(text="native")
+        self.mtune_entry = Gtk.Entry(
+            text=tuning.mtune if tuning.mtune in mtune_list else "native")
         compl_mtune = Gtk.EntryCompletion()
         store_t = Gtk.ListStore(str)
         for a in mtune_list:
@@ -1532,9 +1478,58 @@ class SetupWizardWindow(Gtk.Window):
         grid.attach(self.mtune_entry, 1, 3, 1, 1)
 
         grid.attach(Gtk.Label(label="jobs:"),0, 4, 1, 1)
-        self.cor_entry = Gtk.Entry(text=str(multiprocessing.cpu_count()))
+        self.cor_entry = Gtk.Entry(text=str(tuning.make_jobs))
         grid.attach(self.cor_entry,             1, 4, 1, 1)
 
+        # katalog budowania w RAM – tylko gdy pamięci wystarczy (hw_tuning.TMPFS_MIN)
+        self.cb_tmpfs = Gtk.CheckButton(label=i18n.MESSAGES.get(
+            "opt_tmpfs", "Build in RAM (tmpfs PORTAGE_TMPDIR)"))
+        self.cb_tmpfs.set_active(bool(tuning.tmpfs))
+        self.cb_tmpfs.set_sensitive(bool(tuning.tmpfs))
+        grid.attach(self.cb_tmpfs, 1, 5, 1, 1)
+
+        def on_tmpfs_toggled(cb):
+            # bez tmpfs kompilatory mają cały RAM – o ile jobs nie zmieniono ręcznie
+            profiles = (tuning.without_tmpfs(), tuning)
+            if self.cor_entry.get_text() == str(profiles[not cb.get_active()].make_jobs):
+                self.cor_entry.set_text(str(profiles[cb.get_active()].make_jobs))
+        self.cb_tmpfs.connect("toggled", on_tmpfs_toggled)
+
+        # ccache – domyślnie włączony, gdy jest trwały katalog (GENTOO_HELPER_CCACHE)
+        self.cb_ccache = Gtk.CheckButton(label=i18n.MESSAGES.get(
+            "opt_ccache", "Compiler cache (ccache)"))
+        self.cb_ccache.set_active(ccache_setup.host_dir() is not None)
+        grid.attach(self.cb_ccache, 1, 6, 1, 1)
+
+        # pakiety binarne (GENTOO_HELPER_BINPKGS: katalog lub URL binhosta)
+        grid.attach(Gtk.Label(label=i18n.MESSAGES.get("opt_binpkg", "Binary packages:")), 0, 7, 1, 1)
+        self.binpkg_combo = Gtk.ComboBoxText()
+        for mode, text in (
+            ("off",   i18n.MESSAGES.get("binpkg_off", "off – build everything from source")),
+            ("use",   i18n.MESSAGES.get("binpkg_use", "use the binhost")),
+            ("build", i18n.MESSAGES.get("binpkg_build", "use the binhost and add new builds to it")),
+        ):
+            self.binpkg_combo.append(mode, text)
+        self.binpkg_combo.set_active_id("use" if binpkg.source() else "off")
+        self.binpkg_combo.set_tooltip_text(binpkg.source() or binpkg.BINPKGS_ENV)
+        grid.attach(self.binpkg_combo, 1, 7, 1, 1)
+
+        # przyspieszona instalacja: ciężkie pakiety z oficjalnego binhosta Gentoo
+        self.cb_accelerated = Gtk.CheckButton(label=i18n.MESSAGES.get(
+            "opt_accelerated", "Accelerated install (heavy packages from the official binhost)"))
+        self.cb_accelerated.set_tooltip_text(binpkg.official_source(tuning.level))
+        grid.attach(self.cb_accelerated, 1, 8, 1, 1)
+        # tylko bez binhosta floty – filtr --usepkg-include objąłby też jego pakiety
+        self.binpkg_combo.connect("changed", self._on_binpkg_mode_changed)
+        self._on_binpkg_mode_changed(self.binpkg_combo)
+
+        # wykryty profil kompilacji (trafia do make.conf i package.env)
+        lbl_tuning = Gtk.Label(xalign=0, selectable=True)
+        lbl_tuning.set_markup(
+            f"<b>{GLib.markup_escape_text(i18n.MESSAGES.get('hw_profile', 'Build profile (detected hardware)'))}</b>\n"
+            f"<small>{GLib.markup_escape_text(tuning.summary())}</small>"
+        )
+
         # GPU checkboxes
         hbox_gpu = Gtk.Box(spacing=10, orientation=Gtk.Orientation.HORIZONTAL)
         for label in ("Intel", "Intel Iris", "Nvidia", "AMD"):
@@ -1571,6 +1566,7 @@ class SetupWizardWindow(Gtk.Window):
         inner = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=14)
         scrolled.add(inner)
         inner.pack_start(grid,       False, False, 0)
+        inner.pack_start(lbl_tuning, False, False, 0)
         inner.pack_start(hbox_gpu,   False, False, 10)
         inner.pack_start(grid_extra, False, False, 10)
                 # ─── Wybór środowiska graficznego ───
@@ -1651,6 +1647,16 @@ class SetupWizardWindow(Gtk.Window):
             self.NASZMARCH = march
             self.NASZMTUNE = mtune
             self.NASZCOR   = self.cor_entry.get_text()
+            self.USE_TMPFS = self.cb_tmpfs.get_active()
+            tuning = self.hw_profile if self.USE_TMPFS else self.hw_profile.without_tmpfs()
+            self.tuning    = tuning.with_jobs(self.NASZCOR)
+            self.USE_CCACHE = self.cb_ccache.get_active()
+            self.CCACHE_GB = ccache_setup.max_size_gb(ccache_setup.host_dir() or "/mnt/gentoo")
+            self.BINPKG_MODE = self.binpkg_combo.get_active_id()
+            self.BINPKG_SRC = binpkg.source()
+            self.ACCEL_SRC = (binpkg.official_source(self.tuning.level)
+                              if self.cb_accelerated.get_active() and self.BINPKG_MODE == "off"
+                              else None)
             self.LOCALE    = self.locale_combo.get_active_id()
             self.NASZEXTRA = " ".join(
                 pkg for lbl, pkg in {
@@ -1673,16 +1679,17 @@ class SetupWizardWindow(Gtk.Window):
             # 5) Przełącz na widok logu
             self.step_box.foreach(lambda w: self.step_box.remove(w))
 
-            # 6) ScrolledWindow z TextView
-            log_sc = Gtk.ScrolledWindow()
+            # 6) Log: ograniczony bufor linii (pełny log → „Zapisz log”)
+            log_sc = RingLogView()
             log_sc.set_vexpand(True)
             log_sc.set_min_content_height(200)
             log_sc.set_shadow_type(Gtk.ShadowType.NONE)
             log_sc.set_margin_top(12)
             log_sc.set_margin_bottom(12)
 
-            self.log_view = Gtk.TextView(editable=False, wrap_mode=Gtk.WrapMode.WORD)
-            self.log_buf  = self.log_view.get_buffer()
+            self.log_ring = log_sc
+            self.log_view = log_sc.view
+            self.log_buf  = log_sc.buffer
             self.log_view.get_style_context().add_class("transparent-bg")
             log_sc.get_style_context().add_class("transparent-bg")
             try:
@@ -1693,9 +1700,15 @@ class SetupWizardWindow(Gtk.Window):
             except Exception:
                 pass
 
-            log_sc.add(self.log_view)
             self.step_box.pack_start(log_sc, True, True, 0)
 
+            btn_save_log = Gtk.Button(
+                label=i18n.MESSAGES.get("btn_save_log", "Save full log…")
+            )
+            btn_save_log.set_halign(Gtk.Align.END)
+            btn_save_log.connect("clicked", self._save_full_log)
+            self.step_box.pack_start(btn_save_log, False, False, 0)
+
             # ➜ Jeden label pod scrollem: [i/total] pakiet
             self.emerge_output_label = Gtk.Label(label="")
             self.emerge_output_label.set_xalign(0)
@@ -1759,6 +1772,16 @@ class SetupWizardWindow(Gtk.Window):
             f"(yes | etc-update --automode -3 && emerge {pkgs})"
         )
 
+    def _fetch_only(self, *targets):
+        """
+        Komenda pobierająca z góry distfiles dla późniejszych kroków emerge
+        (bez kompilacji).  Każdy zestaw osobno – jeśli jeden się nie
+        rozwiąże (np. pakiet z overlayu, który nie jest jeszcze włączony),
+        pozostałe i tak zostaną pobrane; brakujące pobierze sam emerge.
+        """
+        parts = [f"emerge --fetchonly {t} || rc=$?" for t in targets if t.strip()]
+        return "rc=0; " + "; ".join(parts) + "; exit $rc"
+
     # ——— find an available terminal emulator ———
     def _pick_terminal(self):
         # Return the first terminal emulator found in PATH
@@ -1799,196 +1822,323 @@ class SetupWizardWindow(Gtk.Window):
         if env_data and env_data["packages"]:
             programy.append(env_data["packages"])
 
-        #  ─── dynamiczny wybór listy kroków ─────────────
-        init_type = self._detect_init_type()
-
-        if init_type == "openrc":
-            import steps_openrc_desktop_profile as steps_mod
-            self.steps = steps_mod.get_openrc_steps(self, env_data, programy)
-        else:                                       # systemd
-            import steps_systemd_desktop_profile as steps_mod
-            self.steps = steps_mod.get_systemd_steps(self, env_data, programy)
-
-        self._copy_helper_tree("/mnt/gentoo")
-
-        # Which steps should be executed in the external terminal?
-        external = {
-            i18n.MESSAGES["step_install_kernel"],
-            i18n.MESSAGES["step_genkernel"],
-            i18n.MESSAGES["step_repo"],
-            i18n.MESSAGES["step_update_world2"],
-            i18n.MESSAGES["step_install_programs"],
-            i18n.MESSAGES["step_set_desktop_env"],  
-            i18n.MESSAGES["step_set_user_passwd"],
-            i18n.MESSAGES["step_install_grub_uefi"] if self.efi_choice else         i18n.MESSAGES["step_install_grub_bios"]
-        }
+        # worker thread → GUI: coalesced, at most ~30 redraws per second
+        ui = self._ui
+        log = ccache_mount = binpkg_mount = None
+        failure = None
+        # montowania i timer są zwalniane także wtedy, gdy instalacja padnie
+        # na czymś innym niż krok (spawn_pty, ranking mirrorów…)
+        try:
+            # najszybsze mirrory → GENTOO_MIRRORS w make.conf
+            self.NASZMIRRORS = " ".join(self._ranked_mirrors()[:MAKECONF_MIRRORS])
 
+            #  ─── dynamiczny wybór listy kroków ─────────────
+            init_type = self._detect_init_type()
 
+            if init_type == "openrc":
+                import steps_openrc_desktop_profile as steps_mod
+                self.steps = steps_mod.get_openrc_steps(self, env_data, programy)
+            else:                                       # systemd
+                import steps_systemd_desktop_profile as steps_mod
+                self.steps = steps_mod.get_systemd_steps(self, env_data, programy)
 
-        total = len(self.steps)
-        for idx, (label, cmd) in enumerate(self.steps, 1):
-            GLib.idle_add(self.append_log, f"→ {strip_version(label)}")
+            self._copy_helper_tree("/mnt/gentoo")
 
-            full_cmd = ["chroot", "/mnt/gentoo", "/bin/bash", "-lc", cmd]
+            # Which steps should be executed in the external terminal?
+            external = {
+                i18n.MESSAGES["step_install_kernel"],
+                i18n.MESSAGES["step_genkernel"],
+                i18n.MESSAGES["step_install_programs"],
+                i18n.MESSAGES["step_set_desktop_env"],  
+                i18n.MESSAGES["step_set_user_passwd"],
+                i18n.MESSAGES["step_install_grub_uefi"] if self.efi_choice else         i18n.MESSAGES["step_install_grub_bios"]
+            }
 
-            GLib.idle_add(self.progress_bar.hide)
-            GLib.idle_add(self.substep_bar.hide)
-            GLib.idle_add(self.emerge_output_label.set_text, "")
 
-            if 'emerge' in cmd:
-                seen_progress = False
-                last_i = last_tot = last_pkg = None
-                master_fd, slave_fd = pty.openpty()
-                proc = subprocess.Popen(
-                    full_cmd,
-                    stdout=slave_fd, stderr=slave_fd,
-                    bufsize=0, text=True
-                )
-                os.close(slave_fd)
-
-                with os.fdopen(master_fd) as stdout:
-                    seen_progress = False
-                    last_i = last_tot = last_pkg = None
-                    while True:
-                        try:
-                            line = stdout.readline()
-                            if not line:
-                                break
-                        except OSError:
-                            break
-
-                        if label in external:
-                            sys.stdout.write(line)
-                            sys.stdout.flush()
-
-                        clean = re.sub(r'\x1B\[[0-?]*[ -/]*[@-~]', '', line)
-
-                        if self.verbose_gui:
-                            GLib.idle_add(self.append_log, clean.rstrip('\n'))
-                
-                        # Jednoznacznie wykrywaj ">>> Emerging"
-                        if '>>> Emerging' in clean:
-                            seen_progress = True
-                            GLib.idle_add(self.progress_bar.set_fraction, 0.0)
-                            GLib.idle_add(self.progress_bar.set_text, "0 %")
-                            GLib.idle_add(self.progress_bar.show)
-
-                        m2 = re.search(r'>>> (?:Emerging|Installing) \(\s*(\d+)\s+of\s+(\d+)\s*\)\s+([^\s]+)', clean)
-                        m1 = re.search(r'\[\s*(\d+)\s*(?:\/|of)\s*(\d+)\s*\]\s+(.+)', clean)
-                        m_pct = re.search(r'\[\s*(\d{1,3})\s*%\]\s+(.+)', clean)
-
-                        if m2:
-                            cur, tot, full = m2.groups()
-                            pkg = strip_version(full.split("::")[0])
-                            last_i, last_tot, last_pkg = cur, tot, pkg
-
-                            frac = int(cur) / int(tot)
-                            pct  = int(frac * 100)
-
-                            GLib.idle_add(self.progress_bar.set_fraction, frac)
-                            GLib.idle_add(self.progress_bar.set_text, f"{pct} %")
-                            GLib.idle_add(self.progress_bar.show)
-
-                            GLib.idle_add(
-                                self.emerge_output_label.set_text,
-                                f"[{cur}/{tot}] {pkg}"
-                            )
-
-                        phase_patterns = [
-                            (r">>> Unpacking", "Unpacking..."),
-                            (r">>> Compiling", "Compiling..."),
-                            (r">>> Installing", "Installing..."),
-                            (r">>> Completed", "Completed!"),
-                            (r">>> Emerging", "Emerging..."),
-                            (r"Copying", "Copying..."),
-                            
-                        ]
-
-                        for pat, txt in phase_patterns:
-                            if re.search(pat, clean):
-                                if last_i and last_tot and last_pkg:
-                                    GLib.idle_add(
-                                        self.emerge_output_label.set_text,
-                                        f"[{last_i}/{last_tot}] {last_pkg}  {txt}"
-                                    )
-                
-                        if m1 or m_pct:
-                            GLib.idle_add(self.substep_bar.show)
-                            if m1:
-                                sub, subtot, _ = m1.groups()
-                                GLib.idle_add(self.substep_bar.set_fraction, int(sub) / int(subtot))
-                            else:
-                                pct, _ = m_pct.groups()
-                                GLib.idle_add(self.substep_bar.set_fraction, int(pct) / 100)
-
-                        if ">>> Completed" in clean:
-                            GLib.idle_add(self.substep_bar.hide)
-                proc.wait()
-                GLib.idle_add(self.progress_bar.hide)
-                GLib.idle_add(self.substep_bar.hide)
-                GLib.idle_add(self.emerge_output_label.set_text, "")
-
-            elif 'genkernel' in cmd:
-
-                master_fd, slave_fd = pty.openpty()
-                proc = subprocess.Popen(full_cmd, stdout=slave_fd, stderr=slave_fd, bufsize=0, text=True)
-                os.close(slave_fd)
-
-                with os.fdopen(master_fd) as stdout:
-                    while True:
-                        try:
-                            line = stdout.readline()
-                            if not line:
-                                break
-                        except OSError:
-                            break
-
-                        if label in external:
-                            sys.stdout.write(line)
-                            sys.stdout.flush()
-
-                        clean = re.sub(r'\x1B\[[0-?]*[ -/]*[@-~]', '', line)
-
-                        pretty = map_genkernel_line(clean)
-                        if pretty:
-                            progress = None
-                            for idx2, (pattern, _) in enumerate(GENKERNEL_GUI_MAP):
-                                if re.search(pattern, clean):
-                                    progress = (idx2 + 1) / len(GENKERNEL_GUI_MAP)
-                                    break
-                            if progress:
-                                pct = int(progress * 100)
-                                GLib.idle_add(self.progress_bar.set_fraction, progress)
-                                GLib.idle_add(self.progress_bar.set_text, f"{pct} %")
-                                GLib.idle_add(self.progress_bar.show)
-                            GLib.idle_add(self.emerge_output_label.set_text, pretty)
+
+            # pełny, skompresowany log kroków → /mnt/gentoo/var/log/gentoo-helper
+            log = self._open_install_log()
+
+            # trwały katalog ccache z hosta → CCACHE_DIR w systemie docelowym
+            ccache_mount = self._bind_ccache() if self.USE_CCACHE else None
+            # katalog z pakietami binarnymi z hosta → PKGDIR w systemie docelowym
+            binpkg_mount = self._bind_binpkgs()
+
+            # kroki ukończone w poprzednim (przerwanym) przebiegu są pomijane
+            journal = RunJournal()
+            steps = [as_step(s) for s in self.steps]
+            if journal.bind(steps):
+                ui.batch(self.append_log_lines, i18n.MESSAGES.get(
+                    "install_resumed", "Resuming the previous installation – completed steps are skipped (↷)."))
+
+            # procesy kroków w tle (prefetch) – przerwanie instalacji je kończy
+            background_procs = set()
+
+            def run_step(idx, step):
+                label, cmd = step.label, step.cmd
+                if journal.is_done(idx):
+                    ui.batch(self.append_log_lines, f"↷ {strip_version(label)}")
+                    return 0
+                ui.batch(self.append_log_lines, f"→ {strip_version(label)}")
+                started = time.monotonic()
+                key = log.begin_step(label, cmd) if log else None
+
+                full_cmd = ["chroot", "/mnt/gentoo", "/bin/bash", "-lc", cmd]
+
+                # a background step (distfile prefetch) runs next to the builds:
+                # its output goes to the log only, the progress widgets are theirs
+                foreground = not step.background
+                if foreground:
+                    ui.set(self.progress_bar, "set_visible", False)
+                    ui.set(self.substep_bar, "set_visible", False)
+                    ui.set(self.emerge_output_label, "set_text", "")
+
+                # the pty + progress parsing only for the heavy steps; one that
+                # also runs genkernel (kernel step) is tracked as an emerge
+                tools = heavy_commands(cmd) if foreground and step.heavy else set()
+                if tools and tools != {"genkernel"}:
+                    proc, master_fd = spawn_pty(full_cmd)
+                    tracker = EmergeTracker()
+                    try:
+                        # large non-blocking reads, whole batches of lines at once
+                        for lines in read_batches(master_fd):
+                            if log:
+                                log.write(lines, key)
+                            if label in external:
+                                sys.stdout.write("\n".join(lines) + "\n")
+                                sys.stdout.flush()
+
+                            if self.verbose_gui:
+                                ui.batch(self.append_log_lines, *map(strip_ansi, lines))
+
+                            # one substring pre-filter + one regex per line;
+                            # the GUI only needs the state after the batch
+                            if not tracker.feed_lines(lines):
+                                continue
+
+                            if tracker.total:
+                                frac = tracker.fraction
+                                ui.set(self.progress_bar, "set_fraction", frac)
+                                ui.set(self.progress_bar, "set_text", f"{int(frac * 100)} %")
+                                ui.set(self.progress_bar, "set_visible", True)
+                                ui.set(self.emerge_output_label, "set_text",
+                                       f"[{tracker.index}/{tracker.total}] "
+                                       f"{strip_version(tracker.package)}  {tracker.phase_text}")
+                            # the build counter belongs to the current phase only
+                            if tracker.substep:
+                                ui.set(self.substep_bar, "set_fraction", tracker.substep.fraction)
+                            ui.set(self.substep_bar, "set_visible", tracker.substep is not None)
+                    finally:
+                        os.close(master_fd)
+                    proc.wait()
+                    ui.set(self.progress_bar, "set_visible", False)
+                    ui.set(self.substep_bar, "set_visible", False)
+                    ui.set(self.emerge_output_label, "set_text", "")
+
+                elif tools:
+
+                    proc, master_fd = spawn_pty(full_cmd)
+                    try:
+                        for lines in read_batches(master_fd):
+                            if log:
+                                log.write(lines, key)
+                            if label in external:
+                                sys.stdout.write("\n".join(lines) + "\n")
+                                sys.stdout.flush()
+
+                            for line in lines:
+                                clean = strip_ansi(line)
+
+                                pretty = map_genkernel_line(clean)
+                                if pretty:
+                                    progress = None
+                                    for idx2, (pattern, _) in enumerate(GENKERNEL_GUI_MAP):
+                                        if re.search(pattern, clean):
+                                            progress = (idx2 + 1) / len(GENKERNEL_GUI_MAP)
+                                            break
+                                    if progress:
+                                        pct = int(progress * 100)
+                                        ui.set(self.progress_bar, "set_fraction", progress)
+                                        ui.set(self.progress_bar, "set_text", f"{pct} %")
+                                        ui.set(self.progress_bar, "set_visible", True)
+                                    ui.set(self.emerge_output_label, "set_text", pretty)
+                    finally:
+                        os.close(master_fd)
 
                     proc.wait()
-                    GLib.idle_add(self.progress_bar.hide)
-                    GLib.idle_add(self.emerge_output_label.set_text, "")
+                    ui.set(self.progress_bar, "set_visible", False)
+                    ui.set(self.emerge_output_label, "set_text", "")
 
 
-            else:
-                proc = subprocess.run(full_cmd, capture_output=True, text=True)
-                if self.verbose_gui:
-                    if proc.stdout:
-                        for l in proc.stdout.splitlines():
-                            GLib.idle_add(self.append_log, l)
-                    if proc.stderr:
-                        for l in proc.stderr.splitlines():
-                            GLib.idle_add(self.append_log, l)
-
-                GLib.idle_add(self.progress_bar.hide)
-                GLib.idle_add(self.substep_bar.hide)
-                GLib.idle_add(self.emerge_output_label.set_text, "")
-
-            status = "OK" if proc.returncode == 0 else f"FAIL ({proc.returncode})"
-            GLib.idle_add(self.append_log, f"✓ {label}: {status}")
-
-        GLib.idle_add(self._stop_install_timer)
+                else:
+                    # stdout+stderr in one stream, straight to the log file;
+                    # a background step gets its own process group (see on_abort)
+                    proc = subprocess.Popen(
+                        full_cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                        start_new_session=not foreground,
+                    )
+                    if not foreground:
+                        background_procs.add(proc)
+                    with proc.stdout:
+                        for lines in read_batches(proc.stdout.fileno()):
+                            if log:
+                                log.write(lines, key)
+                            if self.verbose_gui and foreground:
+                                ui.batch(self.append_log_lines, *lines)
+                    proc.wait()
+                    background_procs.discard(proc)
+
+                    if foreground:
+                        ui.set(self.progress_bar, "set_visible", False)
+                        ui.set(self.substep_bar, "set_visible", False)
+                        ui.set(self.emerge_output_label, "set_text", "")
+
+                status = "OK" if proc.returncode == 0 else f"FAIL ({proc.returncode})"
+                ui.batch(self.append_log_lines, f"✓ {label}: {status}")
+                if log:
+                    log.end_step(proc.returncode, key)
+                try:
+                    journal.record(idx, step, proc.returncode, time.monotonic() - started)
+                except OSError as e:
+                    print(f"[warn] Nie można zapisać dziennika kroków: {e}")
+                return proc.returncode
+
+            def on_abort():
+                for proc in list(background_procs):
+                    self._terminate_group(proc)
+
+            def on_retry(idx, step, attempt, delay):
+                ui.batch(self.append_log_lines, i18n.MESSAGES.get(
+                    "step_retry", "↻ {label}: retry {attempt} in {delay} s"
+                ).format(label=strip_version(step.label), attempt=attempt, delay=delay))
+
+            # independent file-writing steps run side by side, emerge/genkernel
+            # steps one at a time (resources and failure policies declared in
+            # the steps_* modules)
+            run_steps(steps, run_step, on_retry=on_retry, on_abort=on_abort)
+
+            if self.USE_CCACHE:
+                self._report_ccache()
+            if self.BINPKG_MODE != "off" or self.ACCEL_SRC:
+                self._report_binpkgs()
+        except StepFailed as e:
+            failure = i18n.MESSAGES.get(
+                "install_aborted",
+                "Installation stopped: step “{label}” failed (rc={rc}). "
+                "Fix the problem and start the installation again – completed steps will be skipped."
+            ).format(label=strip_version(e.step.label), rc=e.rc)
+        except Exception as e:
+            traceback.print_exc()
+            failure = i18n.MESSAGES.get(
+                "install_error", "Installation stopped by an error: {error}"
+            ).format(error=e)
+        finally:
+            if failure:
+                ui.batch(self.append_log_lines, f"✗ {failure}")
+            if log:
+                log.close()
+                print(f"[info] Log instalacji: {log.path}")
+            if ccache_mount:
+                ccache_setup.unbind(ccache_mount)
+            if binpkg_mount:
+                binpkg.unbind(binpkg_mount)
+            if failure and self.USE_TMPFS:
+                self._umount_tmpfs()
+            # everything still queued must reach the GUI before the next step
+            GLib.idle_add(ui.flush_now)
+            GLib.idle_add(self._stop_install_timer)
+        if failure:
+            GLib.idle_add(self._error_dialog, failure)
+            return
+
         GLib.idle_add(self.append_log, i18n.MESSAGES["install_done_title"])
         GLib.idle_add(self._build_step_user_passwd)
 
+    @staticmethod
+    def _terminate_group(proc, timeout=10):
+        # chroot → bash → emerge: cała grupa procesów, SIGKILL gdy nie zdąży
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            try:
+                os.killpg(proc.pid, sig)
+            except ProcessLookupError:
+                return
+            try:
+                proc.wait(timeout=timeout)
+                return
+            except subprocess.TimeoutExpired:
+                continue
+
+    def _umount_tmpfs(self):
+        # przerwana instalacja – krok „Release the RAM build directory” nie ruszył,
+        # a katalog nieudanej kompilacji dalej zajmuje RAM
+        path = "/mnt/gentoo/var/tmp/portage"
+        if os.path.ismount(path):
+            rc = subprocess.run(["umount", path], check=False).returncode
+            if rc:
+                print(f"[warn] Nie można odmontować {path} (rc={rc})")
+
+    def _bind_ccache(self):
+        source = ccache_setup.host_dir()
+        if not source:
+            return None
+        try:
+            return ccache_setup.bind("/mnt/gentoo", source)
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"[warn] Nie można podmontować katalogu ccache {source}: {e}")
+            return None
+
+    def _report_ccache(self):
+        result = ccache_setup.stats("/mnt/gentoo")
+        if not result:
+            return
+        hits, misses = result
+        calls = hits + misses
+        self._ui.batch(self.append_log_lines, i18n.MESSAGES.get(
+            "ccache_report", "ccache: {hits} of {calls} compilations served from the cache ({rate:.0f} %)"
+        ).format(hits=hits, calls=calls, rate=100.0 * hits / calls if calls else 0.0))
+
+    def _on_binpkg_mode_changed(self, combo):
+        fleet = combo.get_active_id() != "off"
+        if fleet:
+            self.cb_accelerated.set_active(False)
+        self.cb_accelerated.set_sensitive(not fleet)
+
+    def _bind_binpkgs(self):
+        # binhost floty albo katalog zastępujący oficjalny binhost – nigdy oba
+        src = self.BINPKG_SRC if self.BINPKG_MODE != "off" else self.ACCEL_SRC
+        if not src or binpkg.is_url(src):
+            return None
+        try:
+            return binpkg.bind("/mnt/gentoo", src)
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"[warn] Nie można podmontować katalogu pakietów {src}: {e}")
+            return None
+
+    def _report_binpkgs(self):
+        since = int(self.install_start_time.timestamp())
+        merges = binpkg.read_merges("/mnt/gentoo" + binpkg.EMERGE_LOG, since)
+        src = self.BINPKG_SRC if self.BINPKG_MODE != "off" else None
+        if self.BINPKG_MODE == "build":
+            # czasy kompilacji obok pakietów – następna instalacja policzy oszczędność
+            pkgdir = src if src and not binpkg.is_url(src) else "/mnt/gentoo" + binpkg.PKGDIR
+            try:
+                binpkg.save_times(pkgdir, merges)
+                print(f"[info] Pakiety binarne: {pkgdir}")
+            except OSError as e:
+                print(f"[warn] Nie można zapisać czasów kompilacji w {pkgdir}: {e}")
+        binaries, total, avoided = binpkg.report(merges, binpkg.load_times(src) if src else {})
+        self._ui.batch(self.append_log_lines, i18n.MESSAGES.get(
+            "binpkg_report", "Binary packages: {binaries} of {total} installed from binaries, "
+                             "~{hours} h {minutes} min of compilation avoided"
+        ).format(binaries=binaries, total=total, hours=avoided // 3600, minutes=avoided % 3600 // 60))
+
+    def _open_install_log(self):
+        try:
+            return InstallLog()
+        except OSError as e:
+            print(f"[warn] Nie można utworzyć logu instalacji: {e}")
+            return None
+
     def get_selected_desktop_env(self):
         for btn in self.desktop_env_buttons:
             if btn.get_active():
@@ -2002,10 +2152,30 @@ class SetupWizardWindow(Gtk.Window):
 
     # ------------------------------------------------------------------ #
     def append_log(self, text: str):
-        """Appends a line to the log window and scrolls to the bottom."""
-        end_iter = self.log_buf.get_end_iter()
-        self.log_buf.insert(end_iter, text + "\n")
-        self.log_view.scroll_mark_onscreen(self.log_buf.get_insert())
+        """Appends a line to the log window (scrolls only when at the bottom)."""
+        self.log_ring.append(text)
+
+    def append_log_lines(self, lines):
+        """Appends a batch of lines with a single buffer insert."""
+        self.log_ring.append_lines(lines)
+
+    def _save_full_log(self, _btn):
+        # the view keeps only the newest lines – the full log comes from the spill file
+        dlg = Gtk.FileChooserDialog(
+            title=i18n.MESSAGES.get("btn_save_log", "Save full log…"),
+            parent=self, action=Gtk.FileChooserAction.SAVE
+        )
+        dlg.add_buttons(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
+                        Gtk.STOCK_SAVE, Gtk.ResponseType.OK)
+        dlg.set_do_overwrite_confirmation(True)
+        dlg.set_current_name("gentoo-helper-install.log")
+        if dlg.run() == Gtk.ResponseType.OK:
+            path = dlg.get_filename()
+            try:
+                self.log_ring.save(path)
+            except OSError as e:
+                self._error_dialog(f"Błąd zapisu logu:\n{e}")
+        dlg.destroy()
 
     def _start_install_timer(self):
         from datetime import datetime